@@ -0,0 +1,162 @@
+"""Memory and time of reading large capabilities documents, OWSLib vs the
+streaming reader in linkcheck/capabilities.py.
+
+Generates WMS 1.3.0 and WFS 2.0.0 fixture documents with many (nested)
+layers and reads each in a fresh interpreter, reporting wall time and the
+growth of peak RSS.
+
+    python benchmarks/capabilities_parser.py [--layers 5000]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'linkcheck')
+
+WMS_LAYER = """
+      <Layer queryable="1">
+        <Name>layer_{i}</Name>
+        <Title>Layer {i}</Title>
+        <Abstract>Abstract of layer {i}, describing the soil property mapped in this layer.</Abstract>
+        <KeywordList><Keyword>soil</Keyword><Keyword>layer {i}</Keyword></KeywordList>
+        <CRS>EPSG:3035</CRS>
+        <EX_GeographicBoundingBox>
+          <westBoundLongitude>-10</westBoundLongitude><eastBoundLongitude>30</eastBoundLongitude>
+          <southBoundLatitude>35</southBoundLatitude><northBoundLatitude>70</northBoundLatitude>
+        </EX_GeographicBoundingBox>
+        <BoundingBox CRS="EPSG:4326" minx="35" miny="-10" maxx="70" maxy="30"/>
+        <MetadataURL type="ISO19115:2003">
+          <Format>text/xml</Format>
+          <OnlineResource xlink:type="simple" xlink:href="https://example.org/csw?request=GetRecordById&amp;id=record-{i}"/>
+        </MetadataURL>
+        <Style><Name>default</Name><Title>Default</Title></Style>
+        <Style><Name>style_{i}</Name><Title>Style {i}</Title></Style>
+      </Layer>"""
+
+WMS_DOCUMENT = """<?xml version="1.0" encoding="UTF-8"?>
+<WMS_Capabilities version="1.3.0" xmlns="http://www.opengis.net/wms" xmlns:xlink="http://www.w3.org/1999/xlink">
+  <Service>
+    <Name>WMS</Name><Title>Benchmark WMS</Title><Abstract>Generated</Abstract>
+    <OnlineResource xlink:type="simple" xlink:href="https://example.org/wms"/>
+  </Service>
+  <Capability>
+    <Request>
+      <GetCapabilities><Format>text/xml</Format>
+        <DCPType><HTTP><Get><OnlineResource xlink:type="simple" xlink:href="https://example.org/wms?"/></Get></HTTP></DCPType>
+      </GetCapabilities>
+      <GetMap><Format>image/png</Format>
+        <DCPType><HTTP><Get><OnlineResource xlink:type="simple" xlink:href="https://example.org/wms?"/></Get></HTTP></DCPType>
+      </GetMap>
+    </Request>
+    <Exception><Format>XML</Format></Exception>
+    <Layer>
+      <Title>Root</Title>
+      <CRS>EPSG:4326</CRS><CRS>EPSG:3857</CRS>
+      {groups}
+    </Layer>
+  </Capability>
+</WMS_Capabilities>
+"""
+
+WFS_FEATURE_TYPE = """
+    <FeatureType>
+      <Name>ns:feature_{i}</Name>
+      <Title>Feature {i}</Title>
+      <Abstract>Abstract of feature type {i}.</Abstract>
+      <ows:Keywords><ows:Keyword>soil</ows:Keyword></ows:Keywords>
+      <DefaultCRS>urn:ogc:def:crs:EPSG::4326</DefaultCRS>
+      <OtherCRS>urn:ogc:def:crs:EPSG::3857</OtherCRS>
+      <ows:WGS84BoundingBox><ows:LowerCorner>-10 35</ows:LowerCorner><ows:UpperCorner>30 70</ows:UpperCorner></ows:WGS84BoundingBox>
+      <MetadataURL xlink:href="https://example.org/csw?request=GetRecordById&amp;id=record-{i}"/>
+    </FeatureType>"""
+
+WFS_DOCUMENT = """<?xml version="1.0" encoding="UTF-8"?>
+<wfs:WFS_Capabilities version="2.0.0" xmlns="http://www.opengis.net/wfs/2.0" xmlns:wfs="http://www.opengis.net/wfs/2.0"
+    xmlns:ows="http://www.opengis.net/ows/1.1" xmlns:xlink="http://www.w3.org/1999/xlink" xmlns:fes="http://www.opengis.net/fes/2.0">
+  <ows:ServiceIdentification><ows:Title>Benchmark WFS</ows:Title><ows:Abstract>Generated</ows:Abstract>
+    <ows:ServiceType>WFS</ows:ServiceType><ows:ServiceTypeVersion>2.0.0</ows:ServiceTypeVersion></ows:ServiceIdentification>
+  <ows:OperationsMetadata>
+    <ows:Operation name="GetCapabilities"><ows:DCP><ows:HTTP><ows:Get xlink:href="https://example.org/wfs?"/></ows:HTTP></ows:DCP></ows:Operation>
+    <ows:Operation name="DescribeFeatureType"><ows:DCP><ows:HTTP><ows:Get xlink:href="https://example.org/wfs?"/></ows:HTTP></ows:DCP></ows:Operation>
+    <ows:Operation name="GetFeature"><ows:DCP><ows:HTTP><ows:Get xlink:href="https://example.org/wfs?"/></ows:HTTP></ows:DCP></ows:Operation>
+  </ows:OperationsMetadata>
+  <FeatureTypeList>{features}
+  </FeatureTypeList>
+</wfs:WFS_Capabilities>
+"""
+
+# Runs in a fresh interpreter: read the document at argv[1] as argv[2] with argv[3]
+RUNNER = r"""
+import resource, sys, time
+path, service_type, parser = sys.argv[1:4]
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+if parser == 'owslib':
+    from owslib.wms import WebMapService
+    from owslib.wfs import WebFeatureService
+    data = open(path, 'rb').read()
+    started = time.perf_counter()
+    if service_type == 'wms':
+        service = WebMapService('https://example.org/wms', version='1.3.0', xml=data)
+    else:
+        service = WebFeatureService('https://example.org/wfs', version='2.0.0', xml=data)
+    names = list(service.contents)
+else:
+    from capabilities import read_capabilities
+    started = time.perf_counter()
+    with open(path, 'rb') as f:
+        target = 'layer_0' if service_type == 'wms' else 'ns:feature_0'
+        stop_when = (lambda layer: layer.name == target) if parser == 'stream-early' else None
+        names = read_capabilities(f, service_type, stop_when=stop_when).layer_names
+elapsed = time.perf_counter() - started
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(elapsed, (peak - before) / 1024, len(names))
+"""
+
+
+def build_documents(layers, directory):
+    groups = []
+    for g in range(0, layers, 100):
+        children = ''.join(WMS_LAYER.format(i=i) for i in range(g, min(g + 100, layers)))
+        groups.append(f'<Layer><Name>group_{g}</Name><Title>Group {g}</Title>{children}</Layer>')
+    wms = os.path.join(directory, 'wms.xml')
+    with open(wms, 'w') as f:
+        f.write(WMS_DOCUMENT.format(groups=''.join(groups)))
+
+    wfs = os.path.join(directory, 'wfs.xml')
+    with open(wfs, 'w') as f:
+        f.write(WFS_DOCUMENT.format(features=''.join(WFS_FEATURE_TYPE.format(i=i) for i in range(layers))))
+    return {'wms': wms, 'wfs': wfs}
+
+
+def run(path, service_type, parser):
+    proc = subprocess.run([sys.executable, '-c', RUNNER, path, service_type, parser],
+                          cwd=SRC, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+    elapsed, rss, count = proc.stdout.split()
+    return float(elapsed), float(rss), int(count)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--layers', type=int, default=5000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        documents = build_documents(args.layers, directory)
+        print(f"{'document':<10} {'MB':>6} {'parser':<14} {'seconds':>8} {'peak RSS MB':>12} {'layers':>7}")
+        for service_type, path in documents.items():
+            size = os.path.getsize(path) / 1024 / 1024
+            for name in ('owslib', 'stream', 'stream-early'):
+                try:
+                    elapsed, rss, count = run(path, service_type, name)
+                except RuntimeError as e:
+                    print(f"{service_type:<10} {size:>6.1f} {name:<14} failed: {e}")
+                    continue
+                print(f"{service_type:<10} {size:>6.1f} {name:<14} {elapsed:>8.2f} {rss:>12.1f} {count:>7}")
+
+
+if __name__ == '__main__':
+    main()
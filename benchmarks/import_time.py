@@ -0,0 +1,67 @@
+"""Import-time benchmark of the linkchecker modules.
+
+Times each import in a fresh interpreter, so the cost of importing OWSLib
+(and friends) at startup shows up next to the cost of the modules using it.
+Run `python -X importtime` on a single module for a per-module breakdown.
+
+    python benchmarks/import_time.py [--repeat 5]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+# (label, module to import, directory to import it from)
+CASES = [
+    ('service_types', 'service_types', os.path.join(SRC, 'linkcheck')),
+    ('ogc_services', 'ogc_services', os.path.join(SRC, 'linkcheck')),
+    ('linkchecker', 'linkchecker', os.path.join(SRC, 'linkcheck')),
+    ('on_demand_url_checker', 'linkcheck.on_demand_url_checker', SRC),
+    ('api', 'api', SRC),
+    ('owslib (all probes)', 'owslib.wms, owslib.wmts, owslib.wfs, owslib.wcs, owslib.ogcapi.features', SRC),
+]
+
+# api.py builds the database url at import, nothing connects to it
+DATABASE_ENV = {
+    'POSTGRES_USER': 'linkcheck',
+    'POSTGRES_PASSWORD': 'linkcheck',
+    'POSTGRES_HOST': 'localhost',
+    'POSTGRES_PORT': '5432',
+    'POSTGRES_DB': 'linkcheck',
+}
+
+
+def import_time(module, cwd):
+    """Import time in ms of `module` in a fresh interpreter"""
+    code = (
+        'import time; started = time.perf_counter(); '
+        f'import {module}; '
+        'print(time.perf_counter() - started)'
+    )
+    env = dict(DATABASE_ENV, **os.environ)
+    proc = subprocess.run([sys.executable, '-c', code], cwd=cwd, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+    return float(proc.stdout.strip().splitlines()[-1]) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'module':<25} {'median ms':>10} {'min ms':>10}")
+    for label, module, cwd in CASES:
+        try:
+            times = [import_time(module, cwd) for _ in range(args.repeat)]
+        except RuntimeError as e:
+            print(f"{label:<25} failed: {e}")
+            continue
+        print(f"{label:<25} {statistics.median(times):>10.1f} {min(times):>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
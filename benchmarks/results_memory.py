@@ -0,0 +1,79 @@
+"""Memory of check results held during a run: dicts vs CheckResult.
+
+Builds `--count` results the way the checkers do (each with its own url
+string and response headers) and reports the traced memory, scaled to 1M
+results.
+
+    python benchmarks/results_memory.py [--count 200000]
+"""
+import argparse
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'linkcheck'))
+
+from results import CheckResult  # noqa: E402
+
+CONTENT_TYPES = ['text/html', 'application/pdf', 'application/zip', 'text/xml', 'image/tiff']
+
+
+def response(i):
+    """Values as they come out of a response: fresh objects per result"""
+    status = 404 if i % 10 == 0 else 200
+    return (
+        f'https://example.org/datasets/{i:08d}/download',
+        int(str(status)),
+        ''.join(CONTENT_TYPES[i % len(CONTENT_TYPES)]),
+        i * 10,
+        'Wed, 21 Oct 2015 07:28:00 GMT',
+        {'dns': i % 7 / 3, 'connect': i % 11 / 3, 'tls': i % 13 / 3, 'ttfb': i % 17 / 3, 'total': i % 19 / 3},
+    )
+
+
+def as_dict(i):
+    url, status, content_type, size, modified, timings = response(i)
+    return {
+        'url': url,
+        'status_code': status,
+        'is_redirect': False,
+        'valid': 200 <= status < 400,
+        'content_type': content_type,
+        'content_size': size,
+        'last_modified': modified,
+        'gis_capabilities': None,
+        'timings': timings,
+    }
+
+
+def as_result(i):
+    url, status, content_type, size, modified, timings = response(i)
+    result = CheckResult(url, status_code=status, final_url=url, content_type=content_type,
+                         content_size=size, last_modified=modified)
+    result.set_timings(timings)
+    return result
+
+
+def measure(build, count):
+    tracemalloc.start()
+    results = [build(i) for i in range(count)]
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del results
+    return current
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=200000)
+    args = parser.parse_args()
+
+    scale = 1000000 / args.count
+    print(f"{'representation':<15} {'MB per 1M':>10} {'bytes each':>11}")
+    for name, build in (('dict', as_dict), ('CheckResult', as_result)):
+        used = measure(build, args.count)
+        print(f"{name:<15} {used * scale / 1024 / 1024:>10.0f} {used / args.count:>11.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Memory and lookup time of the in-memory status index of the API.
+
+Loads `--count` links into a StatusIndex and reports the memory of the
+loaded index, the peak while loading, the time of a lookup and of merging
+in `--added` new links.
+
+    python benchmarks/status_index_memory.py [--count 1000000]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'linkcheck'))
+
+from status_index import StatusIndex  # noqa: E402
+
+ERROR_CLASSES = ['none', 'none', 'none', 'http', 'timeout', 'connection']
+
+
+def rows(count, start=0):
+    checked = datetime(2025, 1, 1)
+    for i in range(start, start + count):
+        yield {
+            'urlname': f'https://example.org/datasets/{i:08d}/download',
+            'url_key': f'https://example.org/datasets/{i:08d}/download',
+            'id_link': i + 1,
+            'last_status_code': 404 if i % 10 == 0 else 200,
+            'last_error_class': ERROR_CLASSES[i % len(ERROR_CLASSES)],
+            'deprecated': i % 50 == 0,
+            'last_checked': checked + timedelta(seconds=i),
+            'record_ids': [f'record-{i // 2}'],
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=1000000)
+    parser.add_argument('--lookups', type=int, default=100000)
+    parser.add_argument('--added', type=int, default=1000)
+    args = parser.parse_args()
+
+    # timed without tracemalloc, which slows down loading several times
+    index = StatusIndex()
+    started = time.perf_counter()
+    index.rebuild(rows(args.count))
+    load_time = time.perf_counter() - started
+    index = StatusIndex()
+    tracemalloc.start()
+    index.rebuild(rows(args.count))
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    urls = [f'https://example.org/datasets/{i * 7919 % args.count:08d}/download' for i in range(args.lookups)]
+    started = time.perf_counter()
+    for url in urls:
+        index.lookup(url)
+    lookup_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    index.update(list(rows(args.added, args.count)))
+    update_time = time.perf_counter() - started
+
+    print(f"links            {len(index):>10}")
+    print(f"index MB         {current / 1024 / 1024:>10.1f}")
+    print(f"bytes per link   {current / args.count:>10.1f}")
+    print(f"peak MB (load)   {peak / 1024 / 1024:>10.1f}")
+    print(f"load seconds     {load_time:>10.2f}")
+    print(f"lookup us        {lookup_time / args.lookups * 1e6:>10.2f}")
+    print(f"merge seconds    {update_time:>10.2f}  ({args.added} new links)")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,25 @@
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
 from dotenv import load_dotenv
 from databases import Database
 from typing import List, Optional
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime
 import asyncpg
+import asyncio
 import logging
+import time
 import os
 from urllib.parse import quote_plus
 from typing import Dict, Any, Union
+from linkcheck.canonical import canonicalize_url
+from linkcheck.export import FORMATS, ChunkEncoder, export_filename, export_stream
+from linkcheck.events import CHANNEL, EventBroadcaster, format_sse
+from linkcheck.queries import LISTS, SUMMARY_TOP_HOSTS, latest_status_query, record_status_query, summary_document, summary_query
+from linkcheck.snapshots import SUMMARY, snapshot_file
+from linkcheck.status_index import STATUS_INDEX_REFRESH, last_run_query, status_index
 from linkcheck.on_demand_url_checker import AsyncURLChecker, diagnose_link_status
+from linkcheck.metrics import API_LATENCY, render_latest
 
 # Load environment variables from .env file
 load_dotenv()
@@ -29,6 +39,14 @@ print(f"DB: {DATABASE_URL.replace(os.environ.get('POSTGRES_PASSWORD'),'*****')};
 
 rootpath = os.environ.get("ROOTPATH") or "/"
 
+# Status events, received with LISTEN on a dedicated connection
+broadcaster = EventBroadcaster()
+events_connection = None
+events_task = None
+EVENTS_HEARTBEAT = 15  # seconds between keep-alive comments on /events
+EVENTS_RECONNECT_MAX = 60  # longest backoff in seconds before listening again
+status_index_task = None
+
 # FastAPI app instance
 app = FastAPI(
     title="Linkchecker-Liveness",
@@ -37,6 +55,20 @@ app = FastAPI(
 )
 logger = logging.getLogger(__name__)
 
+@app.middleware('http')
+async def observe_latency(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by route template, so /status/{item:path} is a single series
+        route = request.scope.get('route')
+        endpoint = route.path if route is not None else 'unmatched'
+        API_LATENCY.labels(method=request.method, endpoint=endpoint, status=status).observe(time.perf_counter() - started)
+
 # Define response models
 class LinkResponse(BaseModel):
     id_link: int 
@@ -47,6 +79,10 @@ class LinkResponse(BaseModel):
     link_size: Optional[int] = None 
     last_modified: Optional[datetime] = None
     gis_capabilities: Optional[Union[Dict[str, Any], str]] = None
+    final_url: Optional[str] = None
+    redirect_chain: Optional[List[str]] = None
+    detected_format: Optional[str] = None
+    format_mismatch: Optional[str] = None
 
 class StatusResponse(LinkResponse):
     status_code: Optional[int] = None
@@ -57,16 +93,39 @@ class StatusResponse(LinkResponse):
 
 class TimeoutResponse(LinkResponse):
     status_code: Optional[int] = None  # Make status_code optional for timeout cases
-    final_url: Optional[str] = None
     record_id: Optional[str] = None 
     is_redirect: Optional[bool] = None
     error_message: Optional[str] = None
     timestamp: datetime
     
+class LatestStatusResponse(BaseModel):
+    urlname: str
+    id_link: int
+    status_code: Optional[int] = None
+    valid: bool
+    error_class: Optional[str] = None
+    deprecated: bool
+    last_checked: Optional[datetime] = None
+
+class RecordLinkStatus(LinkResponse):
+    status_code: Optional[int] = None
+    is_redirect: Optional[bool] = None
+    error_message: Optional[str] = None
+    timestamp: Optional[datetime] = None  # None if the link was not checked, e.g. deprecated
+
+class RecordStatusRequest(BaseModel):
+    record_ids: List[str] = Field(..., min_length=1, max_length=1000)
+
+class RecordStatusResponse(BaseModel):
+    record_id: str
+    links: List[RecordLinkStatus]
+
     # New response models for on-demand checking
 class LinkCheckRequest(BaseModel):
     url: str
     check_ogc_capabilities: Optional[bool] = False
+    deep_validation: Optional[bool] = False
+    declared_format: Optional[str] = None
 
 class LinkCheckResponse(BaseModel):
     url: str
@@ -77,15 +136,14 @@ class LinkCheckResponse(BaseModel):
     error: Optional[str] = None
     is_redirect: Optional[bool] = None
     final_url: Optional[str] = None
+    redirect_chain: Optional[List[str]] = None
+    detected_format: Optional[str] = None
+    format_mismatch: Optional[str] = None
     gis_capabilities: Optional[dict] = None
+    timings: Optional[Dict[str, Optional[float]]] = None
     diagnosis: str
     timestamp: datetime
     
-# Define status lists
-REDIRECTION_STATUSES = [301, 302, 304, 307, 308]
-CLIENT_ERROR_STATUSES = [400, 401, 403, 404, 405, 409]
-SERVER_ERROR_STATUSES = [500, 501, 503, 504]
-
 # Helper function to execute SQL query and fetch results
 async def fetch_data(query: str, values: dict = {}):
     try:
@@ -105,7 +163,9 @@ async def check_single_url(request: LinkCheckRequest):
     """
     # Perform URL check
     async with AsyncURLChecker() as checker:
-        result = await checker.check_url(request.url, request.check_ogc_capabilities)
+        result = (await checker.check_url(
+            request.url, request.check_ogc_capabilities, request.deep_validation, request.declared_format
+        )).as_dict()
     
     gis_cap = result.get('gis_capabilities')
     print(f"GIS Capabilities: {gis_cap}")
@@ -119,116 +179,163 @@ async def check_single_url(request: LinkCheckRequest):
         error=result.get('error'),
         is_redirect=result.get('is_redirect'),
         final_url=result.get('final_url'),
+        redirect_chain=result.get('redirect_chain'),
+        detected_format=result.get('detected_format'),
+        format_mismatch=result.get('format_mismatch'),
         gis_capabilities=result.get('gis_capabilities'),
+        timings=result.get('timings'),
         diagnosis=diagnose_link_status(result),
         timestamp=datetime.now()
     )
 
+# Prometheus metrics of the API and on-demand checks
+@app.get('/metrics', include_in_schema=False)
+async def metrics():
+    payload, content_type = render_latest()
+    return Response(content=payload, media_type=content_type)
+
+async def finished_run():
+    """The latest finished run, as the status index last saw it when it is
+    kept up to date; None if it cannot be read"""
+    if STATUS_INDEX_REFRESH > 0 and status_index.loaded:
+        return status_index.run
+    try:
+        return (await database.fetch_one(query=last_run_query(schema)))['run']
+    except Exception as e:
+        logger.warning(f"Could not read the latest run: {e}")
+        return None
+
+async def snapshot_response(request: Request, name: str):
+    """The snapshot of `name` written by the last linkchecker run, None if
+    there is no fresh one"""
+    snapshot = snapshot_file(name, request.headers.get('accept-encoding'), run=await finished_run())
+    if snapshot is None:
+        return None
+    path, encoding = snapshot
+    headers = {'Vary': 'Accept-Encoding'}
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    return FileResponse(path, media_type='application/json', headers=headers)
+
+async def fetch_list(request: Request, name: str):
+    """Rows of list endpoint `name`, from its snapshot when fresh"""
+    response = await snapshot_response(request, name)
+    if response is not None:
+        return response
+    query, values, _ = LISTS[name]
+    return await fetch_data(query=query(schema), values=values)
+
 # Endpoint to retrieve data with redirection statuses
 @app.get('/Redirection_URLs/3xx', response_model=List[StatusResponse])
-async def get_redirection_statuses():
-    query = f"""
-        SELECT l.id_link, l.urlname, l.deprecated, l.consecutive_failures, l.link_type, l.link_size, l.last_modified, l.gis_capabilities, 
-               r.record_id, vh.status_code, vh.is_redirect, vh.error_message, vh.timestamp
-        FROM {schema}.links l
-        JOIN {schema}.records r ON l.fk_record = r.id
-        JOIN {schema}.validation_history vh ON l.id_link = vh.fk_link
-        WHERE vh.status_code = ANY(:statuses)
-        AND vh.timestamp = (
-            SELECT MAX(timestamp)
-            FROM validation_history
-            WHERE fk_link = l.id_link
-        )
-    """
-    data = await fetch_data(query=query, values={'statuses': REDIRECTION_STATUSES})
-    return data
+async def get_redirection_statuses(request: Request):
+    return await fetch_list(request, 'redirection')
 
 # Endpoint to retrieve data with client error statuses
 @app.get('/Client_Error_URLs/4xx', response_model=List[StatusResponse])
-async def get_client_error_statuses():
-    query = f"""
-        SELECT l.id_link, l.urlname, l.deprecated, l.consecutive_failures, l.link_type, l.link_size, l.last_modified, l.gis_capabilities,
-               r.record_id, vh.status_code, vh.is_redirect, vh.error_message, vh.timestamp
-        FROM {schema}.links l
-        JOIN {schema}.records r ON l.fk_record = r.id
-        JOIN {schema}.validation_history vh ON l.id_link = vh.fk_link
-        WHERE vh.status_code = ANY(:statuses)
-        AND vh.timestamp = (
-            SELECT MAX(timestamp)
-            FROM {schema}.validation_history
-            WHERE fk_link = l.id_link
-        )
-    """
-    data = await fetch_data(query=query, values={'statuses': CLIENT_ERROR_STATUSES})
-    return data
+async def get_client_error_statuses(request: Request):
+    return await fetch_list(request, 'client_error')
 
 # Endpoint to retrieve data with server error statuses
 @app.get('/Server_Errors_URLs/5xx', response_model=List[StatusResponse])
-async def get_server_error_statuses():
-    query = f"""
-        SELECT l.id_link, l.urlname, l.deprecated, l.consecutive_failures, l.link_type, l.link_size, l.last_modified, l.gis_capabilities,
-               r.record_id, vh.status_code, vh.is_redirect, vh.error_message, vh.timestamp
-        FROM {schema}.links l
-        JOIN {schema}.records r ON l.fk_record = r.id
-        JOIN {schema}.validation_history vh ON l.id_link = vh.fk_link
-        WHERE vh.status_code = ANY(:statuses)
-        AND vh.timestamp = (
-            SELECT MAX(timestamp)
-            FROM {schema}.validation_history
-            WHERE fk_link = l.id_link
-        )
-    """
-    data = await fetch_data(query=query, values={'statuses': SERVER_ERROR_STATUSES})
-    return data
+async def get_server_error_statuses(request: Request):
+    return await fetch_list(request, 'server_error')
 
 # Endpoint to retrieve data for a specific URL
 @app.get('/status/{item:path}', response_model=List[StatusResponse])
-async def get_status_for_url(item):
-    query = f"""
-        SELECT l.id_link, l.urlname, l.deprecated, l.consecutive_failures, l.link_type, l.link_size, l.last_modified, l.gis_capabilities,
-               r.record_id, vh.status_code, vh.is_redirect, vh.error_message, vh.timestamp
-        FROM {schema}.links l
-        JOIN {schema}.records r ON l.fk_record = r.id
-        JOIN {schema}.validation_history vh ON l.id_link = vh.fk_link
-        WHERE l.urlname = :item
-        AND vh.timestamp = (
-            SELECT MAX(timestamp)
-            FROM {schema}.validation_history
-            WHERE fk_link = l.id_link
-        )
+async def get_status_for_url(
+    item,
+    brief: bool = Query(False, description="Only the link, status code, record and time of the check, from memory")
+):
     """
-    data = await fetch_data(query=query, values={'item': item})
+    Latest status of the link for each of its records. Urls the status index
+    does not know are answered without a query; with `brief` known urls are
+    too, without the other fields of the check (error message, redirects,
+    capabilities...).
+    """
+    # links are stored by their canonical url
+    url = canonicalize_url(item)
+    if status_index.loaded:
+        status = status_index.lookup(url)
+        # like the query, links that were not checked yet have no status
+        if status is None or status['last_checked'] is None:
+            return []
+        if brief:
+            return [
+                {
+                    'id_link': status['id_link'],
+                    'urlname': status['urlname'],
+                    'deprecated': status['deprecated'],
+                    'status_code': status['status_code'],
+                    'record_id': record_id,
+                    'timestamp': status['last_checked'],
+                }
+                for record_id in status['record_ids']
+            ]
+    query = latest_status_query(schema, "l.url_key = :item")
+    data = await fetch_data(query=query, values={'item': url})
     return data
 
+# Latest status of a URL from the in-memory status index
+@app.get('/latest_status/{item:path}', response_model=LatestStatusResponse)
+async def get_latest_status(item):
+    url = canonicalize_url(item)
+    if status_index.loaded:
+        status = status_index.lookup(url)
+    else:
+        rows = await fetch_data(query=f"""
+            SELECT urlname, id_link, last_status_code AS status_code, last_error_class AS error_class, deprecated, last_checked
+            FROM {schema}.links
+            WHERE url_key = :url
+        """, values={'url': url})
+        status = dict(rows[0]) if rows else None
+        if status:
+            status['valid'] = status['status_code'] is not None and 200 <= status['status_code'] < 400
+    if status is None:
+        raise HTTPException(status_code=404, detail="URL not found")
+    return status
+
 # Update the timeout endpoint to match other query structures
 @app.get('/Timeout_URLs', response_model=List[TimeoutResponse])
-async def get_timeout_urls():
-    query = f"""
-        SELECT l.id_link, l.urlname, l.deprecated, l.consecutive_failures, l.link_type, l.link_size, l.last_modified, l.gis_capabilities,
-               r.record_id, vh.status_code, vh.is_redirect, vh.error_message, vh.timestamp
-        FROM {schema}.links l
-        JOIN {schema}.records r ON l.fk_record = r.id
-        JOIN {schema}.validation_history vh ON l.id_link = vh.fk_link
-        WHERE (vh.error_message LIKE '%ReadTimeout%' OR vh.error_message LIKE '%ConnectTimeout%')
-        AND vh.timestamp = (
-            SELECT MAX(timestamp)
-            FROM {schema}.validation_history
-            WHERE fk_link = l.id_link
-        )
-    """
-    data = await fetch_data(query=query)
-    return data
+async def get_timeout_urls(request: Request):
+    return await fetch_list(request, 'timeout')
 
 @app.get('/Deprecated_URLs', response_model=List[LinkResponse])
-async def get_deprecated_urls():
-    query = f"""
-        SELECT l.id_link, l.urlname, r.record_id, l.deprecated, l.consecutive_failures, l.link_type, l.link_size, l.last_modified, l.gis_capabilities
-        FROM {schema}.links l
-        JOIN {schema}.records r ON l.fk_record = r.id
-        WHERE l.deprecated IS TRUE
+async def get_deprecated_urls(request: Request):
+    return await fetch_list(request, 'deprecated')
+
+@app.get('/summary')
+async def get_summary(
+    request: Request,
+    host: Optional[str] = Query(None, description="Only count the links of this host"),
+    top: int = Query(SUMMARY_TOP_HOSTS, ge=1, le=1000, description="Number of hosts with the most links to list")
+):
     """
-    data = await fetch_data(query=query)
-    return data
+    Number of links by the class of their latest status, error category,
+    host, link type and OGC service type, with the deprecated and timed out totals.
+    """
+    if host is None and top == SUMMARY_TOP_HOSTS:
+        response = await snapshot_response(request, SUMMARY)
+        if response is not None:
+            return response
+    values = {'top': top}
+    if host:
+        values['host'] = host.lower()
+    rows = await fetch_data(query=summary_query(schema, host), values=values)
+    return summary_document(rows)
+
+@app.post('/records/status', response_model=List[RecordStatusResponse])
+async def get_records_status(request: RecordStatusRequest):
+    """
+    The links of each record, with their latest status, in the order of
+    `record_ids`; records that are not known have no links.
+    """
+    record_ids = list(dict.fromkeys(request.record_ids))
+    rows = await fetch_data(query=record_status_query(schema), values={'record_ids': record_ids})
+    links = {record_id: [] for record_id in record_ids}
+    for row in rows:
+        row = dict(row)
+        links[row.pop('record_id')].append(row)
+    return [{'record_id': record_id, 'links': record_links} for record_id, record_links in links.items()]
 
 @app.get("/URL_status_history", response_model=List[StatusResponse])
 async def get_url_status_history(
@@ -246,23 +353,28 @@ async def get_url_status_history(
             l.link_size,
             l.last_modified,
             l.gis_capabilities,
+            l.final_url,
+            l.redirect_chain,
+            l.detected_format,
+            l.format_mismatch,
             vh.status_code,
             vh.is_redirect,
             vh.error_message,
             vh.timestamp
         FROM 
-            {schema}.links l
-        JOIN {schema}.records r ON l.fk_record = r.id
+            {schema}.links_with_capabilities l
+        JOIN {schema}.record_links rl ON rl.fk_link = l.id_link
+        JOIN {schema}.records r ON r.id = rl.fk_record
         JOIN {schema}.validation_history vh ON l.id_link = vh.fk_link
         WHERE 
-            l.urlname = :url
+            l.url_key = :url
         ORDER BY 
             vh.timestamp DESC
         LIMIT :limit
     """
 
     try:
-        results = await fetch_data(query=query, values={'url': url, 'limit': limit})
+        results = await fetch_data(query=query, values={'url': canonicalize_url(url), 'limit': limit})
         logger.info(f"Query returned {len(results)} results for URL: {url}")
         
         response_data = [StatusResponse(**dict(row)) for row in results]
@@ -272,6 +384,98 @@ async def get_url_status_history(
         logger.error(f"Error occurred while fetching URL status history: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Failed to fetch URL status history")
 
+@app.get('/export')
+async def export_links(
+    start: datetime = Query(..., description="First check time to export (ISO 8601)"),
+    end: Optional[datetime] = Query(None, description="Export checks before this time (ISO 8601, default: now)"),
+    format: str = Query('parquet', pattern='^(parquet|csv)$', description="parquet or csv (gzip compressed)")
+):
+    """
+    Stream all links with their validation history checked in [start, end),
+    as Parquet or gzip compressed CSV.
+    """
+    end = end or datetime.now()
+    try:
+        encoder = ChunkEncoder(format)
+    except RuntimeError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    return StreamingResponse(
+        export_stream(database, start, end, encoder, schema),
+        media_type=FORMATS[format][0],
+        headers={'Content-Disposition': f'attachment; filename="{export_filename(format, start, end)}"'}
+    )
+
+async def fetch_events(after: int, limit: int = 1000):
+    query = f"""
+        SELECT id, event, urlname AS url, old_status_code, new_status_code, created_at
+        FROM {schema}.status_events
+        WHERE id > :after
+        ORDER BY id
+        LIMIT :limit
+    """
+    return [dict(row) for row in await fetch_data(query=query, values={'after': after, 'limit': limit})]
+
+@app.get('/events')
+async def status_event_stream(
+    request: Request,
+    last_event_id: Optional[int] = Query(None, description="Resume after this event id (or send a Last-Event-ID header)")
+):
+    """
+    Server-Sent Events stream of link status transitions: `broken`, `recovered`
+    and `deprecated`. Without a last event id only new events are sent.
+    """
+    header = request.headers.get('last-event-id')
+    if header and header.isdigit():
+        last_event_id = int(header)
+    if last_event_id is None:
+        rows = await fetch_data(query=f"SELECT COALESCE(MAX(id), 0) AS id FROM {schema}.status_events")
+        last_event_id = rows[0]['id']
+
+    # subscribe before replaying, events committed meanwhile are not missed
+    queue = broadcaster.subscribe()
+
+    async def stream():
+        last = last_event_id
+        try:
+            replay = True
+            while not await request.is_disconnected():
+                if replay:
+                    replay = False
+                    while True:
+                        events = await fetch_events(last)
+                        for event in events:
+                            yield format_sse(event)
+                            last = event['id']
+                        if len(events) < 1000:
+                            break
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=EVENTS_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    # without a listener, poll the table instead
+                    replay = events_connection is None
+                    continue
+                if queue.overflowed:
+                    # fell behind, drop the queue and catch up from the table
+                    queue.overflowed = False
+                    while not queue.empty():
+                        queue.get_nowait()
+                    replay = True
+                    continue
+                if event['id'] <= last:
+                    continue
+                if 'url' not in event:
+                    # payload too large to notify in full
+                    replay = True
+                    continue
+                yield format_sse(event)
+                last = event['id']
+        finally:
+            broadcaster.unsubscribe(queue)
+
+    return StreamingResponse(stream(), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 # Start the application
 @app.on_event('startup')
 async def startup():
@@ -281,10 +485,62 @@ async def startup():
             await database.execute(query=f"SET search_path TO {os.environ.get('POSTGRES_SCHEMA')},public;")
     except Exception as e:
         raise HTTPException(status_code=500, detail="Database connection failed") from e
+    global events_task, status_index_task
+    events_task = asyncio.create_task(listen_for_events())
+    if STATUS_INDEX_REFRESH > 0:
+        # loaded in the background, until then lookups go to the database
+        status_index_task = asyncio.create_task(refresh_status_index())
+
+async def listen_for_events():
+    """Keep a connection listening for status events, connecting again with
+    backoff when it is lost; meanwhile /events polls the table"""
+    global events_connection
+    delay = 1
+    while True:
+        lost = asyncio.Event()
+        connection = None
+        try:
+            connection = await asyncpg.connect(DATABASE_URL)
+            connection.add_termination_listener(lambda _: lost.set())
+            await connection.add_listener(CHANNEL, broadcaster.on_notification)
+        except Exception as e:
+            if connection is not None:
+                connection.terminate()
+            logger.warning(f"Could not listen for status events, trying again in {delay} seconds: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, EVENTS_RECONNECT_MAX)
+            continue
+        events_connection = connection
+        delay = 1
+        # events committed while not listening are caught up from the table
+        broadcaster.resync()
+        try:
+            await lost.wait()
+        finally:
+            events_connection = None
+        logger.warning("Lost the connection listening for status events, reconnecting")
+
+async def refresh_status_index():
+    """Keep the in-memory status index up to date, see linkcheck/status_index.py"""
+    while True:
+        try:
+            started = time.perf_counter()
+            loaded, run = status_index.loaded, status_index.run
+            count = await status_index.refresh(database, schema)
+            if not loaded or run != status_index.run:
+                logger.info(f"Status index of {count} links loaded in {time.perf_counter() - started:.2f} seconds")
+        except Exception as e:
+            logger.warning(f"Could not refresh the status index: {e}")
+        await asyncio.sleep(STATUS_INDEX_REFRESH)
 
 @app.on_event('shutdown')
 async def shutdown():
+    for task in (events_task, status_index_task):
+        if task is not None:
+            task.cancel()
     try:
+        if events_connection is not None:
+            await events_connection.close()
         await database.disconnect()
     except Exception as e:
         raise HTTPException(status_code=500, detail="Database disconnection failed") from e
\ No newline at end of file
@@ -0,0 +1,54 @@
+"""Canonical form of urls, used to check equivalent urls only once.
+
+Distributions refer to the same resource with differently cased hosts,
+explicit default ports, query parameters in another order, trailing
+slashes or fragments. `canonicalize_url` maps all of these to one url,
+the key the linkchecker task finds equivalent urls by, stored in
+`links.url_key`. It is never requested: servers may treat paths case
+sensitive or depend on the order of parameters, so the first of the
+equivalent urls is checked as published and stored in `links.urlname`.
+
+Paths and parameter values are kept as they are.
+"""
+from urllib.parse import urlsplit, urlunsplit
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def canonicalize_url(url):
+    """The canonical form of `url`:
+
+    - scheme and host in lower case, default ports removed
+    - query parameters sorted (by case folded name, then value); empty ones
+      (`&&`, `&=&`) removed, those without a value (`b=`) kept
+    - trailing slash of the path removed, an empty path becomes `/`
+    - fragment removed
+
+    Urls that can not be parsed are returned stripped but otherwise unchanged.
+    """
+    url = url.strip()
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return url
+    scheme = parts.scheme.lower()
+    if not parts.netloc:
+        return url
+
+    host = (parts.hostname or '').rstrip('.')
+    if ':' in host:  # ipv6
+        host = f'[{host}]'
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        host = f'{host}:{port}'
+    userinfo = parts.netloc.rpartition('@')[0] if '@' in parts.netloc else ''
+    netloc = f'{userinfo}@{host}' if userinfo else host
+
+    path = parts.path.rstrip('/') or '/'
+
+    # sorted on the raw pairs, so encoding of names and values is kept
+    params = [param for param in parts.query.split('&') if param and param != '=']
+    params.sort(key=lambda param: (param.partition('=')[0].casefold(), param))
+    query = '&'.join(params)
+
+    return urlunsplit((scheme, netloc, path, query, ''))
@@ -0,0 +1,268 @@
+"""Streaming reader for WMS and WFS capabilities documents.
+
+OWSLib builds the full DOM plus an object per layer, which for national
+services with thousands of (nested) layers costs hundreds of MB. This reader
+walks the document with lxml `iterparse`, keeps only the fields the
+capabilities probes report, frees elements as soon as they are read and can
+stop as soon as a wanted layer has been found.
+"""
+import re
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+import requests
+from lxml import etree
+
+XLINK_HREF = '{http://www.w3.org/1999/xlink}href'
+
+# Query parameters of a capabilities url that are replaced when building requests
+OGC_PARAMS = {'service', 'request', 'version', 'acceptversions', 'typename', 'typenames'}
+
+# Per service type: element holding a layer, default version
+LAYER_ELEMENTS = {'wms': 'Layer', 'wfs': 'FeatureType'}
+VERSIONS = {'wms': '1.3.0', 'wfs': '2.0.0'}
+
+CRS_ELEMENTS = {'CRS', 'SRS', 'DefaultCRS', 'OtherCRS', 'DefaultSRS', 'OtherSRS'}
+EXCEPTION_ELEMENTS = {'ServiceExceptionReport', 'ExceptionReport'}
+
+# WMS 1.3.0 bounding boxes follow the axis order of the crs, these are
+# swapped to x/y like OWSLib does
+YX_CRS = {'EPSG:4326', 'EPSG:4258', 'EPSG:3034', 'EPSG:3035'}
+
+
+class Layer:
+    """The capabilities of a single layer (WMS) or feature type (WFS)"""
+    __slots__ = ('name', 'title', 'abstract', 'keywords', 'bbox', 'crs', 'styles', 'metadata_urls', 'queryable', 'parent_bbox')
+
+    def __init__(self, parent=None):
+        self.name = None
+        self.title = None
+        self.abstract = None
+        self.keywords = []
+        self.metadata_urls = []
+        self.bbox = None
+        # WMS layers inherit crs, bbox, styles and queryable from their parent
+        self.crs = list(parent.crs) if parent else []
+        self.styles = list(parent.styles) if parent else []
+        self.queryable = parent.queryable if parent else False
+        self.parent_bbox = (parent.bbox or parent.parent_bbox) if parent else None
+
+    def has_crs(self, code):
+        """True if the layer is available in EPSG `code` (e.g. '4326')"""
+        suffix = ':' + code
+        return any(crs.upper().endswith(suffix) for crs in self.crs)
+
+
+class Capabilities:
+    """Service level information and the layers read from a capabilities document"""
+    __slots__ = ('service_type', 'title', 'abstract', 'layers', 'complete')
+
+    def __init__(self, service_type):
+        self.service_type = service_type
+        self.title = None
+        self.abstract = None
+        self.layers = []
+        # False when reading stopped at the wanted layer
+        self.complete = False
+
+    @property
+    def layer_names(self):
+        return [layer.name for layer in self.layers if layer.name]
+
+    def index(self):
+        return LayerIndex(self.layers)
+
+
+class LayerIndex:
+    """Lookup tables to match distributions to the layers of one capabilities
+    document in constant time, by name, by case folded title and by the ids
+    of the metadata records the layers refer to.
+
+    Works on any layer objects, the accessors read name, title and metadata
+    urls from them (defaults suit `Layer`).
+    """
+    __slots__ = ('layers', 'names', 'by_name', 'by_title', 'by_record_id')
+
+    def __init__(self, layers, name=None, title=None, metadata_urls=None):
+        name = name or (lambda layer: layer.name)
+        title = title or (lambda layer: layer.title)
+        metadata_urls = metadata_urls or (lambda layer: layer.metadata_urls)
+
+        self.layers = layers
+        self.names = []
+        self.by_name = {}
+        self.by_title = {}
+        self.by_record_id = {}
+        # setdefault: the first layer in document order wins, as a scan would
+        for layer in layers:
+            layer_name = name(layer)
+            if layer_name:
+                self.names.append(layer_name)
+                self.by_name.setdefault(layer_name, layer)
+            layer_title = title(layer)
+            if layer_title:
+                self.by_title.setdefault(layer_title.casefold(), layer)
+            for url in metadata_urls(layer) or ():
+                for token in record_id_tokens(url):
+                    self.by_record_id.setdefault(token, layer)
+
+    def __len__(self):
+        return len(self.layers)
+
+    def match(self, lname, md_id):
+        """The layer named `lname`, else the layer referring to metadata
+        record `md_id`, else the layer titled `lname`"""
+        layer = None
+        if lname is not None:
+            layer = self.by_name.get(lname)
+        if layer is None and md_id:
+            layer = self.by_record_id.get(md_id)
+        if layer is None and lname:
+            layer = self.by_title.get(lname.casefold())
+        return layer
+
+
+_TOKEN_SEPARATORS = re.compile(r'[/?&=#;]')
+_EXTENSIONS = ('.xml', '.json', '.html', '.jsonld')
+
+
+def record_id_tokens(url):
+    """The parts of a metadata url that may be the id of the record, e.g.
+    `abc` for `https://example.org/csw?request=GetRecordById&id=abc` or
+    `https://example.org/collections/main/items/abc.xml`"""
+    tokens = {url}
+    for token in _TOKEN_SEPARATORS.split(url):
+        if not token:
+            continue
+        tokens.add(token)
+        if token.lower().endswith(_EXTENSIONS):
+            tokens.add(token.rsplit('.', 1)[0])
+        if token.lower().startswith('urn:uuid:'):
+            tokens.add(token[9:])
+    return tokens
+
+
+def _localname(tag):
+    return tag.rsplit('}', 1)[-1] if isinstance(tag, str) else None
+
+
+def _text(elem):
+    return elem.text.strip() if elem.text and elem.text.strip() else None
+
+
+def _free(elem):
+    # Drop the element and its already processed siblings
+    elem.clear()
+    parent = elem.getparent()
+    if parent is not None:
+        while elem.getprevious() is not None:
+            del parent[0]
+
+
+def _bbox(elem):
+    """(minx, miny, maxx, maxy, crs) of a wms BoundingBox element"""
+    try:
+        minx, miny, maxx, maxy = (float(elem.get(key)) for key in ('minx', 'miny', 'maxx', 'maxy'))
+    except (TypeError, ValueError):
+        return None
+    crs = elem.get('CRS')
+    if crs in YX_CRS:
+        return miny, minx, maxy, maxx, crs
+    return minx, miny, maxx, maxy, crs or elem.get('SRS')
+
+
+def _corner(elem):
+    try:
+        x, y = (float(v) for v in elem.text.split()[:2])
+    except (AttributeError, ValueError):
+        return None
+    return x, y
+
+
+def read_capabilities(source, service_type, stop_when=None):
+    """Read a WMS or WFS capabilities document from a file (like) object.
+
+    `stop_when` is an optional callable receiving each completed Layer;
+    reading stops as soon as it returns True. Raises ValueError on an OGC
+    exception report, lxml errors on invalid xml.
+    """
+    layer_element = LAYER_ELEMENTS[service_type]
+    capabilities = Capabilities(service_type)
+    path = []
+    layers = []  # stack of open layers, wms layers nest
+
+    for event, elem in etree.iterparse(source, events=('start', 'end'), resolve_entities=False, huge_tree=True):
+        name = _localname(elem.tag)
+        if name is None:  # comments, processing instructions
+            continue
+
+        if event == 'start':
+            if not path and name in EXCEPTION_ELEMENTS:
+                raise ValueError("Service returned an exception report")
+            if name == layer_element:
+                layer = Layer(layers[-1] if layers else None)
+                if elem.get('queryable') is not None:
+                    layer.queryable = elem.get('queryable') == '1'
+                layers.append(layer)
+                # listed in document order, parents before their children
+                capabilities.layers.append(layer)
+            path.append(name)
+            continue
+
+        path.pop()
+        parent = path[-1] if path else None
+        grandparent = path[-2] if len(path) > 1 else None
+        layer = layers[-1] if layers else None
+
+        if name == layer_element:
+            layers.pop()
+            if layer.bbox is None:
+                layer.bbox = layer.parent_bbox
+            _free(elem)
+            if stop_when is not None and stop_when(layer):
+                return capabilities
+            continue
+
+        if layer is not None and parent == layer_element:
+            if name in ('Name', 'Title', 'Abstract'):
+                setattr(layer, name.lower(), _text(elem))
+            elif name in CRS_ELEMENTS and elem.text:
+                # wms 1.1.1 allows a space separated list
+                layer.crs.extend(elem.text.split())
+            elif name == 'BoundingBox' and layer.bbox is None:
+                layer.bbox = _bbox(elem)
+            elif name == 'MetadataURL' and elem.get(XLINK_HREF):
+                layer.metadata_urls.append(elem.get(XLINK_HREF))
+        elif layer is not None and grandparent == layer_element:
+            if name == 'Keyword' and _text(elem):
+                layer.keywords.append(_text(elem))
+            elif name == 'Name' and parent == 'Style' and _text(elem) and _text(elem) not in layer.styles:
+                layer.styles.append(_text(elem))
+            elif name == 'OnlineResource' and parent == 'MetadataURL' and elem.get(XLINK_HREF):
+                layer.metadata_urls.append(elem.get(XLINK_HREF))
+            elif name == 'LowerCorner' and parent == 'WGS84BoundingBox':
+                layer.bbox = _corner(elem)
+            elif name == 'UpperCorner' and parent == 'WGS84BoundingBox' and layer.bbox and _corner(elem):
+                layer.bbox = layer.bbox[:2] + _corner(elem) + ('urn:ogc:def:crs:OGC:1.3:CRS84',)
+        elif layer is None and parent in ('Service', 'ServiceIdentification') and name in ('Title', 'Abstract'):
+            setattr(capabilities, name.lower(), _text(elem))
+
+        _free(elem)
+
+    capabilities.complete = True
+    return capabilities
+
+
+def service_url(url):
+    """The url of an OGC service without request specific parameters"""
+    parts = urlsplit(url)
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k.lower() not in OGC_PARAMS]
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(query), ''))
+
+
+def fetch_capabilities(url, service_type, timeout=30, stop_when=None, headers=None):
+    """Request and stream-read the capabilities document of the service at `url`"""
+    params = {'service': service_type.upper(), 'request': 'GetCapabilities', 'version': VERSIONS[service_type]}
+    with requests.get(service_url(url), params=params, timeout=timeout, headers=headers, stream=True) as response:
+        response.raise_for_status()
+        response.raw.decode_content = True
+        return read_capabilities(response.raw, service_type, stop_when=stop_when)
@@ -0,0 +1,116 @@
+"""Per-host circuit breaker of the linkchecker task.
+
+When a host is down every one of its links would cost the full url timeout.
+After `CIRCUIT_BREAKER_THRESHOLD` consecutive connection level failures
+(dns, connection refused/reset, connect timeout) the circuit of the host
+opens and its remaining links fail immediately as host unreachable. Once
+`CIRCUIT_BREAKER_COOLDOWN` seconds passed a single link is let through as
+probe (half-open): on success the circuit closes again, on failure it stays
+open for another cooldown.
+"""
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+try:
+    from .metrics import CIRCUITS_OPENED
+    from .results import CheckResult, ErrorClass
+except ImportError:
+    from metrics import CIRCUITS_OPENED
+    from results import CheckResult, ErrorClass
+
+# Consecutive connection failures that open the circuit of a host, 0 disables
+CIRCUIT_BREAKER_THRESHOLD = int(os.environ.get("CIRCUIT_BREAKER_THRESHOLD") or 5)
+# Seconds an open circuit waits before letting a probe through
+CIRCUIT_BREAKER_COOLDOWN = float(os.environ.get("CIRCUIT_BREAKER_COOLDOWN") or 60)
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+
+def is_connection_failure(result):
+    """True if `result` failed before the host answered"""
+    if result.error_class in (ErrorClass.DNS, ErrorClass.CONNECTION):
+        return True
+    # read timeouts mean the host is up but slow
+    return result.error_class == ErrorClass.TIMEOUT and 'ConnectTimeout' in (result.error or '')
+
+
+def host(url):
+    """The host a circuit is kept for, the url itself if it has none"""
+    try:
+        return (urlsplit(url).hostname or url).lower()
+    except ValueError:
+        return url
+
+
+class _Circuit:
+    __slots__ = ('state', 'failures', 'opened_at')
+
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+
+
+class HostCircuitBreaker:
+    """Circuits by host, safe to use from the checker threads"""
+
+    def __init__(self, threshold=CIRCUIT_BREAKER_THRESHOLD, cooldown=CIRCUIT_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._circuits = {}
+        self._lock = threading.Lock()
+
+    def allow(self, url):
+        """True if `url` may be requested, False if its host circuit is open"""
+        if self.threshold <= 0:
+            return True
+        with self._lock:
+            circuit = self._circuits.get(host(url))
+            if circuit is None or circuit.state == CLOSED:
+                return True
+            if circuit.state == OPEN and time.monotonic() - circuit.opened_at >= self.cooldown:
+                # let one probe through, the others keep failing fast until it returns
+                circuit.state = HALF_OPEN
+                return True
+            return False
+
+    def record(self, url, result):
+        """Update the circuit of the host of `url` with the outcome of a request"""
+        if self.threshold <= 0:
+            return
+        name = host(url)
+        with self._lock:
+            circuit = self._circuits.get(name)
+            if not is_connection_failure(result):
+                if circuit is not None:
+                    if circuit.state != CLOSED:
+                        print(f"Host {name} is reachable again, closing its circuit")
+                    del self._circuits[name]
+                return
+            if circuit is None:
+                circuit = self._circuits[name] = _Circuit()
+            circuit.failures += 1
+            if circuit.state == HALF_OPEN or (circuit.state == CLOSED and circuit.failures >= self.threshold):
+                if circuit.state == CLOSED:
+                    print(f"Host {name} failed {circuit.failures} consecutive connections, "
+                          f"skipping its links for {self.cooldown:.0f}s")
+                    CIRCUITS_OPENED.inc()
+                circuit.state = OPEN
+                circuit.opened_at = time.monotonic()
+
+    def unreachable(self, url):
+        """The result of a link skipped because its host circuit is open"""
+        with self._lock:
+            circuit = self._circuits.get(host(url))
+            failures = circuit.failures if circuit else self.threshold
+        return CheckResult.failed(
+            url,
+            f"Host unreachable: skipped after {failures} consecutive connection failures",
+            ErrorClass.HOST_UNREACHABLE
+        )
+
+    def open_hosts(self):
+        with self._lock:
+            return sorted(name for name, circuit in self._circuits.items() if circuit.state != CLOSED)
@@ -0,0 +1,132 @@
+"""Status transition events of links.
+
+The linkchecker task compares the outcome of each check with the last known
+state of the link (`link_states`, kept across runs) and stores a transition
+in `status_events`: `broken` (ok -> broken), `recovered` (broken -> ok) or
+`deprecated` (newly deprecated). Each event is announced with
+`NOTIFY link_status`, delivered when the write commits. The API fans the
+notifications out on its `/events` Server-Sent Events stream; clients
+resume after the last event they saw from the `status_events` table.
+"""
+import asyncio
+import json
+
+CHANNEL = 'link_status'
+# Postgres limits notification payloads to 8000 bytes
+MAX_PAYLOAD = 7900
+
+EVENT_TYPES = ('broken', 'recovered', 'deprecated')
+
+
+def status_transitions(previous, valid, deprecated):
+    """Events of a link going from `previous` (valid, deprecated) or None
+    for a new link, to the state `valid`, `deprecated`"""
+    if previous is None:
+        return []
+    was_valid, was_deprecated = previous
+    events = []
+    if was_valid and not valid:
+        events.append('broken')
+    elif was_valid is False and valid:
+        events.append('recovered')
+    if deprecated and not was_deprecated:
+        events.append('deprecated')
+    return events
+
+
+def record_transitions(cur, url, link_id, valid, deprecated, status_code, key=None):
+    """Update the state of `url`, store and notify its transitions; runs in
+    the transaction of the check result. The state is kept by `key`, the
+    canonical url, so it follows the link whichever equivalent url is
+    checked. Returns the events."""
+    key = key or url
+    cur.execute("SELECT valid, deprecated, status_code FROM link_states WHERE urlname = %s FOR UPDATE", (key,))
+    row = cur.fetchone()
+    cur.execute("""
+        INSERT INTO link_states (urlname, valid, deprecated, status_code, updated_at)
+        VALUES (%s, %s, %s, %s, now())
+        ON CONFLICT (urlname) DO UPDATE
+        SET valid = EXCLUDED.valid,
+            deprecated = EXCLUDED.deprecated,
+            status_code = EXCLUDED.status_code,
+            updated_at = EXCLUDED.updated_at
+    """, (key, valid, deprecated, status_code))
+
+    events = status_transitions(row[:2] if row else None, valid, deprecated)
+    for event in events:
+        cur.execute("""
+            INSERT INTO status_events (urlname, fk_link, event, old_status_code, new_status_code)
+            VALUES (%s, %s, %s, %s, %s)
+            RETURNING id, created_at
+        """, (url, link_id, event, row[2], status_code))
+        event_id, created_at = cur.fetchone()
+        payload = event_payload(event_id, url, event, row[2], status_code, created_at)
+        cur.execute("SELECT pg_notify(%s, %s)", (CHANNEL, payload))
+    return events
+
+
+def event_payload(event_id, url, event, old_status_code, new_status_code, created_at):
+    """json of an event, only its id and type if the url makes it too large to notify"""
+    payload = json.dumps({
+        'id': event_id,
+        'event': event,
+        'url': url,
+        'old_status_code': old_status_code,
+        'new_status_code': new_status_code,
+        'created_at': created_at.isoformat() if created_at else None
+    })
+    if len(payload.encode('utf-8')) > MAX_PAYLOAD:
+        payload = json.dumps({'id': event_id, 'event': event})
+    return payload
+
+
+def format_sse(event):
+    """An event dict as Server-Sent Events message"""
+    data = json.dumps(event, default=lambda value: value.isoformat() if hasattr(value, 'isoformat') else str(value))
+    return f"id: {event['id']}\nevent: {event['event']}\ndata: {data}\n\n"
+
+
+class EventBroadcaster:
+    """Fans notifications out to the queues of connected clients.
+
+    A client that does not keep up loses its queue contents and is flagged,
+    it then catches up from the status_events table.
+    """
+
+    def __init__(self, queue_size=1000):
+        self.queue_size = queue_size
+        self._subscribers = set()
+
+    def subscribe(self):
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        queue.overflowed = False
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self._subscribers.discard(queue)
+
+    def publish(self, event):
+        for queue in self._subscribers:
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                queue.overflowed = True
+
+    def resync(self):
+        """Make every client catch up from the table, e.g. after notifications
+        may have been missed while the listener was reconnecting"""
+        for queue in self._subscribers:
+            queue.overflowed = True
+            try:
+                # wakes the client up
+                queue.put_nowait({'id': 0, 'event': 'resync'})
+            except asyncio.QueueFull:
+                pass
+
+    def on_notification(self, connection, pid, channel, payload):
+        """asyncpg listener callback"""
+        try:
+            self.publish(json.loads(payload))
+        except ValueError:
+            pass
@@ -0,0 +1,186 @@
+"""Bulk export of links with their validation history.
+
+Rows of `links` joined with `validation_history` in a time range are read
+through a server side cursor and written chunk by chunk, as gzip compressed
+CSV or as Parquet (one row group per chunk), so the memory used does not
+grow with the size of the export. Used by `linkchecker.py export` and the
+`/export` endpoint of the API.
+
+Parquet needs pyarrow, imported only when used.
+"""
+import csv
+import gzip
+import io
+from datetime import datetime
+
+EXPORT_CHUNK_SIZE = 50000
+FORMATS = {
+    'csv': ('application/gzip', '.csv.gz'),
+    'parquet': ('application/vnd.apache.parquet', '.parquet'),
+}
+
+# (column, sql expression, arrow type name)
+COLUMNS = [
+    ('id_link', 'l.id_link', 'int64'),
+    ('urlname', 'l.urlname', 'string'),
+    ('link_type', 'l.link_type', 'string'),
+    ('link_size', 'l.link_size', 'int64'),
+    ('last_modified', 'l.last_modified', 'timestamp'),
+    ('deprecated', 'l.deprecated', 'bool'),
+    ('consecutive_failures', 'l.consecutive_failures', 'int64'),
+    ('final_url', 'l.final_url', 'string'),
+    ('detected_format', 'l.detected_format', 'string'),
+    ('format_mismatch', 'l.format_mismatch', 'string'),
+    ('status_code', 'vh.status_code', 'int64'),
+    ('is_redirect', 'vh.is_redirect', 'bool'),
+    ('error_message', 'vh.error_message', 'string'),
+    ('dns_ms', 'vh.dns_ms', 'float32'),
+    ('connect_ms', 'vh.connect_ms', 'float32'),
+    ('tls_ms', 'vh.tls_ms', 'float32'),
+    ('ttfb_ms', 'vh.ttfb_ms', 'float32'),
+    ('total_ms', 'vh.total_ms', 'float32'),
+    ('timestamp', 'vh.timestamp', 'timestamp'),
+]
+COLUMN_NAMES = [name for name, _, _ in COLUMNS]
+
+
+def export_query(schema=None, paramstyle='pyformat'):
+    """Query of the rows checked in [start, end), for psycopg2 (`pyformat`)
+    or the databases package (`named`)"""
+    prefix = f"{schema}." if schema else ''
+    start, end = ('%(start)s', '%(end)s') if paramstyle == 'pyformat' else (':start', ':end')
+    return f"""
+        SELECT {', '.join(expression for _, expression, _ in COLUMNS)}
+        FROM {prefix}validation_history vh
+        JOIN {prefix}links l ON l.id_link = vh.fk_link
+        WHERE vh.timestamp >= {start} AND vh.timestamp < {end}
+        ORDER BY vh.id
+    """
+
+
+class _Sink(io.RawIOBase):
+    """Write-only file collecting bytes until drained, so encoded chunks can
+    be streamed while they are produced"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+class CsvWriter:
+    def __init__(self, sink):
+        self._gzip = gzip.GzipFile(fileobj=sink, mode='wb')
+        self._text = io.TextIOWrapper(self._gzip, encoding='utf-8', newline='')
+        self._csv = csv.writer(self._text)
+        self._csv.writerow(COLUMN_NAMES)
+
+    def write(self, rows):
+        self._csv.writerows(rows)
+        self._text.flush()
+
+    def close(self):
+        self._text.close()
+
+
+class ParquetWriter:
+    def __init__(self, sink):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise RuntimeError("Parquet export requires pyarrow") from e
+        types = {'int64': pa.int64(), 'string': pa.string(), 'bool': pa.bool_(),
+                 'float32': pa.float32(), 'timestamp': pa.timestamp('us')}
+        self._pa = pa
+        self._schema = pa.schema([(name, types[type_name]) for name, _, type_name in COLUMNS])
+        self._writer = pq.ParquetWriter(sink, self._schema, compression='zstd')
+
+    def write(self, rows):
+        columns = list(zip(*rows)) if rows else [[] for _ in COLUMNS]
+        table = self._pa.Table.from_arrays(
+            [self._pa.array(column, type=field.type) for column, field in zip(columns, self._schema)],
+            schema=self._schema
+        )
+        self._writer.write_table(table)
+
+    def close(self):
+        self._writer.close()
+
+
+WRITERS = {'csv': CsvWriter, 'parquet': ParquetWriter}
+
+
+class ChunkEncoder:
+    """Encodes chunks of rows into the bytes of an export file"""
+
+    def __init__(self, fmt):
+        if fmt not in WRITERS:
+            raise ValueError(f"Unknown export format {fmt}, expected one of {', '.join(WRITERS)}")
+        self._sink = _Sink()
+        self._writer = WRITERS[fmt](self._sink)
+
+    def encode(self, rows):
+        self._writer.write([tuple(row) for row in rows])
+        return self._sink.drain()
+
+    def finish(self):
+        self._writer.close()
+        return self._sink.drain()
+
+
+def export_to_file(conn, start, end, fmt, output, chunk_size=EXPORT_CHUNK_SIZE):
+    """Write the rows checked in [start, end) to the binary file `output`
+    using a server side (named) psycopg2 cursor. Returns the number of rows."""
+    encoder = ChunkEncoder(fmt)
+    count = 0
+    with conn.cursor(name='link_export') as cur:
+        cur.itersize = chunk_size
+        cur.execute(export_query(), {'start': start, 'end': end})
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            output.write(encoder.encode(rows))
+            count += len(rows)
+    output.write(encoder.finish())
+    conn.commit()
+    return count
+
+
+async def export_stream(database, start, end, encoder, schema=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """Async generator of the bytes of an export encoded by the ChunkEncoder
+    `encoder`, reading with the cursor of `database.iterate` (the databases package)"""
+    rows = []
+    async for row in database.iterate(query=export_query(schema, 'named'), values={'start': start, 'end': end}):
+        rows.append(tuple(row[name] for name in COLUMN_NAMES))
+        if len(rows) >= chunk_size:
+            yield encoder.encode(rows)
+            rows = []
+    if rows:
+        yield encoder.encode(rows)
+    yield encoder.finish()
+
+
+def export_filename(fmt, start, end):
+    return f"links_{start:%Y%m%d}_{end:%Y%m%d}{FORMATS[fmt][1]}"
+
+
+def parse_time(value):
+    return datetime.fromisoformat(value)
@@ -0,0 +1,182 @@
+"""Incremental harvesting of distributions from an OGC API Records catalogue.
+
+Instead of reading the `metadata.distributions` table the linkchecker task
+can page through the items of the catalogue itself (`--harvest`). Pages are
+fetched concurrently by offset once the first page tells how many records
+match (catalogues that do not report `numberMatched` are followed by their
+`next` links). After a successful harvest only records updated since the
+previous one are requested, with a CQL2 filter on their `updated` property
+(`datetime` would filter on their temporal extent) and newest first, and
+their links replace the stored ones in the `harvested_distributions` table.
+Catalogues that ignore the filter but sort are read until the first older
+record, others are read in full and filtered here.
+
+Point `OGCAPI_URL` at a local stand-in server to try it out, it only needs
+to serve `/collections/{collection}/items` as GeoJSON; tests/catalogue.py
+is one.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+import requests
+
+HARVEST_PAGE_SIZE = int(os.environ.get("HARVEST_PAGE_SIZE") or 100)
+HARVEST_WORKERS = int(os.environ.get("HARVEST_WORKERS") or 4)
+HARVEST_TIMEOUT = 30
+
+# Links of a record that point at the catalogue itself
+SKIPPED_RELATIONS = {'self', 'alternate', 'collection', 'root', 'next', 'prev', 'previous', 'parent'}
+
+
+class Harvester:
+    """Fetches the records of one items endpoint"""
+
+    def __init__(self, items_url, page_size=HARVEST_PAGE_SIZE, workers=HARVEST_WORKERS, headers=None):
+        self.items_url = items_url
+        self.page_size = page_size
+        self.workers = workers
+        self.headers = headers or {}
+        self._local = threading.local()
+
+    @property
+    def session(self):
+        # requests sessions are not thread safe, use one per worker thread
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            session.headers.update(self.headers)
+        return session
+
+    def _params(self, since, offset=None):
+        params = {'limit': self.page_size}
+        if 'f=' not in urlsplit(self.items_url).query:
+            params['f'] = 'json'
+        if offset:
+            params['offset'] = offset
+        if since is not None:
+            params['filter'] = f"updated >= TIMESTAMP('{since.astimezone(timezone.utc):%Y-%m-%dT%H:%M:%SZ}')"
+            params['filter-lang'] = 'cql2-text'
+            params['sortby'] = '-updated'
+        return params
+
+    def fetch_page(self, url, params=None):
+        response = self.session.get(url, params=params, timeout=HARVEST_TIMEOUT)
+        response.raise_for_status()
+        return response.json()
+
+    def get_pagination_info(self, since=None):
+        """(total pages, items per page, first page) of the items endpoint,
+        total pages is None if the catalogue does not report `numberMatched`"""
+        first = self.fetch_page(self.items_url, self._params(since))
+        matched = first.get('numberMatched')
+        if matched is None:
+            return None, self.page_size, first
+        return max(1, -(-int(matched) // self.page_size)), self.page_size, first
+
+    def records(self, since=None):
+        """All records (GeoJSON features) updated since `since` (all if None)"""
+        total_pages, page_size, first = self.get_pagination_info(since)
+        features = first.get('features') or []
+        if since is not None and not all(is_updated_since(record, since) for record in features) \
+                and _newest_first(features):
+            # the filter was ignored but not the sort order
+            yield from self._pages_until(first, since)
+            return
+        yield from features
+
+        if total_pages is None:
+            page = first
+            while True:
+                page = self._next_page(page)
+                if page is None:
+                    return
+                yield from page.get('features') or []
+
+        offsets = [page * page_size for page in range(1, total_pages)]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for page in executor.map(lambda offset: self.fetch_page(self.items_url, self._params(since, offset)), offsets):
+                yield from page.get('features') or []
+
+    def _next_page(self, page):
+        next_url = next((link['href'] for link in page.get('links') or []
+                         if link.get('rel') == 'next' and link.get('href')), None)
+        if next_url is None or not page.get('features'):
+            return None
+        return self.fetch_page(next_url)
+
+    def _pages_until(self, page, since):
+        """Records from `page` on, newest first, until the first one updated before `since`"""
+        offset = 0
+        while page is not None:
+            features = page.get('features') or []
+            for record in features:
+                if not is_updated_since(record, since):
+                    return
+                yield record
+            if not features:
+                return
+            offset += len(features)
+            page = self._next_page(page) or self.fetch_page(self.items_url, self._params(since, offset))
+
+
+def _newest_first(records):
+    updated = [_updated(record) for record in records]
+    return None not in updated and all(a >= b for a, b in zip(updated, updated[1:]))
+
+
+def _updated(record):
+    value = (record.get('properties') or {}).get('updated')
+    if not value:
+        return None
+    try:
+        updated = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    return updated if updated.tzinfo else updated.replace(tzinfo=timezone.utc)
+
+
+def is_updated_since(record, since):
+    """True unless the record says it was last updated before `since`;
+    a safeguard for catalogues that ignore the datetime filter"""
+    if since is None:
+        return True
+    updated = _updated(record)
+    return updated is None or updated >= since
+
+
+def extract_links(record):
+    """(record id, url, format, name) of the links of a record"""
+    record_id = record.get('id')
+    links = list(record.get('links') or [])
+    # pycsw reports distributions as associations in older versions
+    links.extend((record.get('properties') or {}).get('associations') or [])
+    distributions = []
+    seen = set()
+    for link in links:
+        href = (link.get('href') or link.get('url') or '').strip()
+        if not href.startswith('http') or href in seen or link.get('rel') in SKIPPED_RELATIONS:
+            continue
+        seen.add(href)
+        distributions.append((
+            record_id,
+            href,
+            link.get('protocol') or link.get('type'),
+            link.get('name') or link.get('title')
+        ))
+    return distributions
+
+
+def harvest(items_url, since=None, headers=None):
+    """(ids of the harvested records, their distributions) of the records
+    updated since `since`"""
+    harvester = Harvester(items_url, headers=headers)
+    record_ids, distributions = [], []
+    for record in harvester.records(since):
+        if record.get('id') is None or not is_updated_since(record, since):
+            continue
+        record_ids.append(record['id'])
+        distributions.extend(extract_links(record))
+    return record_ids, distributions
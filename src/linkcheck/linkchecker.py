@@ -1,17 +1,33 @@
 import traceback
 
-from bs4 import BeautifulSoup
 from dotenv import load_dotenv
-from lxml import html
-from urllib.parse import urlparse, parse_qs, urlencode, unquote
+from urllib.parse import unquote, urlsplit
 
 from concurrent.futures import ThreadPoolExecutor
+from harvest import harvest
+from events import record_transitions
+from export import FORMATS, export_filename, export_to_file, parse_time
+from canonical import canonicalize_url
+from circuit_breaker import HostCircuitBreaker, is_connection_failure
+from redirects import PERMANENT_REDIRECTS, redirect_cache
+from retry import RETRY_AFTER_STATUSES, RetryPolicy, is_transient, parse_retry_after, wait_until
 from ogc_services import process_ogc_links
+from service_types import detect_service_type
+from wfs_schema import schema_cache
+from results import CheckResult, LinkSource
+from snapshots import invalidate_snapshots, write_snapshots
+from sniff import DEEP_VALIDATION, detect_format, format_mismatch, range_header, read_head
+from timings import TimedHTTPAdapter, trace
+from metrics import DB_WRITE_LATENCY, RETRIES, RUN_DURATION, RUN_LAST_SUCCESS, label_hosts, record_check, track_request, write_textfile
 import psycopg2
 import requests
-import math
+import threading
+import hashlib
 import time
 import json
+from datetime import datetime, timezone
+import argparse
+import sys
 import os
 
 # Configuration constants
@@ -26,6 +42,8 @@ MAX_WORKERS = 5  # Threads used for url checking
 load_dotenv()
 
 STOREINDB = os.environ.get("STOREINDB") or True
+# Store dns/connect/tls/ttfb timings of each check in validation_history
+STORE_TIMINGS = (os.environ.get("STORE_TIMINGS") or "true").lower() == "true"
 
 # base catalog
 base = os.environ.get("OGCAPI_URL") or "https://demo.pycsw.org/gisdata"
@@ -34,22 +52,68 @@ collection = os.environ.get("OGCAPI_COLLECTION") or "metadata:main"
 # format catalogue path with f-string
 catalogue_json_url= f"{base}/collections/{collection}/items?f=json"
 catalogue_domain= f"{base}/collections/{collection}/items/"
+# Harvest the links from the catalogue instead of metadata.distributions
+HARVEST = (os.environ.get("HARVEST") or "false").lower() == "true"
  
 class URLChecker:
-    def __init__(self, timeout=TIMEOUT):
+    def __init__(self, timeout=TIMEOUT, circuit_breaker=None, retry_policy=None, deep_validation=DEEP_VALIDATION):
         self.timeout = timeout
+        self.deep_validation = deep_validation
+        self.circuit_breaker = circuit_breaker or HostCircuitBreaker()
+        self.retry_policy = retry_policy or RetryPolicy()
+        self._local = threading.local()
+        # results by the final url they reached, reused for links that
+        # turn out to redirect there through hops learned during the run
+        self._final_results = {}
+        self._final_results_lock = threading.Lock()
+
+    @property
+    def session(self):
+        # requests sessions are not thread safe, use one per worker thread
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.headers['User-Agent'] = USERAGENT
+            adapter = TimedHTTPAdapter()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._local.session = session
+        return session
 
     def check_url(self, url):
+        if not self.circuit_breaker.allow(url):
+            result = self.circuit_breaker.unreachable(url)
+            record_check(result)
+            return result
+        with track_request(url), trace() as timings:
+            result = self._check_url(url)
+        self.circuit_breaker.record(url, result)
+        result.set_timings(timings)
+        record_check(result)
+        if self.deep_validation and result.valid:
+            result.detected_format = self._sniff(result.final_url or url)
+        return result
+
+    def _sniff(self, url):
+        """Format of the resource at `url` from its first bytes, None if unknown"""
         try:
-            response = requests.head(url, timeout=self.timeout,
-                                    allow_redirects=True,
-                                    headers={'User-Agent': USERAGENT})
+            with self.session.get(url, headers=range_header(), timeout=self.timeout, stream=True) as response:
+                if response.status_code >= 400:
+                    return None
+                return detect_format(read_head(response.iter_content(chunk_size=1024)))
+        except requests.RequestException as e:
+            print(f"Could not read the content of {url}: {e}")
+            return None
+
+    def _check_url(self, url):
+        try:
+            response = self.session.head(url, timeout=self.timeout,
+                                    allow_redirects=True)
            
             # If head request fails, try GET request
             if response.status_code >= 400:
-                response = requests.get(url, timeout=self.timeout,
-                                       allow_redirects=True,
-                                       headers={'User-Agent': USERAGENT})
+                response = self.session.get(url, timeout=self.timeout,
+                                       allow_redirects=True)
                
             # Get content type from header
             content_type = response.headers.get('content-type','').split(';')[0]
@@ -65,44 +129,121 @@ class URLChecker:
                 if 'bytes' in range_header and '/' in range_header:
                     content_size = int(range_header.split('/')[-1])
 
+            # hops followed, cached so later checks can skip them
+            redirect_chain = None
+            if response.history:
+                redirect_chain = [hop.url for hop in response.history] + [response.url]
+                redirect_cache.add(redirect_chain, [hop.status_code for hop in response.history])
+
+            retry_after = None
+            if response.status_code in RETRY_AFTER_STATUSES:
+                retry_after = parse_retry_after(response.headers.get('retry-after'))
+
             # print("Url size is",content_size)
             # print(f'\x1b[36m Success: \x1b[0m {url}')
-            return {
-                'url': url,
-                'status_code': response.status_code,
-                'is_redirect': response.url != url,
-                'valid': 200 <= response.status_code < 400,
-                'content_type': content_type,
-                'content_size': content_size,
-                'last_modified': last_modified,
-                'gis_capabilities': None
-            }
+            return CheckResult(
+                url,
+                status_code=response.status_code,
+                final_url=response.url,
+                content_type=content_type,
+                content_size=content_size,
+                last_modified=last_modified,
+                retry_after=retry_after,
+                redirect_chain=redirect_chain
+            )
         except requests.RequestException as e:
-            print(f'\x1b[31;20m Failed: \x1b[0m {url}; Error: {str(e)}\nStack trace:\n{traceback.format_exc()}')
-            return {
-                'url': url,
-                'error': str(e),
-                'status_code': None,
-                'is_redirect': None,
-                'valid': False,
-                'content_type': None,
-                'content_size': None,
-                'last_modified': None,
-                'gis_capabilities': None
-            }
+            result = CheckResult.failed(url, e)
+            if is_connection_failure(result):
+                # expected when a host is down, a stack trace adds nothing
+                print(f'\x1b[31;20m Failed: \x1b[0m {url}; Error: {str(e)}')
+            else:
+                print(f'\x1b[31;20m Failed: \x1b[0m {url}; Error: {str(e)}\nStack trace:\n{traceback.format_exc()}')
+            return result
+
+    def _check_when_due(self, url, due):
+        wait_until(due)
+        return self._timed_check(url)
+
+    def _timed_check(self, url):
+        result = self._known_result(url)
+        if result is None:
+            result = self.check_url(url)
+            self._learn(result)
+        return result, time.monotonic()
+
+    def _known_result(self, url):
+        """Result of `url` if it is, or redirects to, a final url reached by a
+        check earlier in this run"""
+        chain = redirect_cache.resolve(url)
+        with self._final_results_lock:
+            result = self._final_results.get(chain[-1])
+        return result.redirected_from(url, chain[:-1]) if result is not None else None
+
+    def _learn(self, result):
+        # transient failures are retried, only settled outcomes are shared
+        if result.status_code is None or is_transient(result):
+            return
+        final = result.at_final_url()
+        with self._final_results_lock:
+            self._final_results[final.url] = final
 
     def check_urls(self, urls):
+        """Check all `urls`, links redirecting (per the redirect cache) to
+        the same target are checked once. Returns the results in order."""
+        chains = [redirect_cache.resolve(url) for url in urls]
+        targets = list(dict.fromkeys(chain[-1] for chain in chains))
+        if len(targets) < len(chains):
+            print(f"Checking {len(targets)} distinct targets of {len(chains)} links")
+        checked = dict(zip(targets, self._check_targets(targets)))
+
+        results = []
+        for chain in chains:
+            result = checked[chain[-1]]
+            if len(chain) > 1 and not result.valid:
+                # the cached redirect may be outdated, follow it again next run
+                redirect_cache.invalidate(chain)
+            results.append(result.redirected_from(chain[0], chain[:-1]))
+        return results
+
+    def _check_targets(self, urls):
+        """Check all `urls`, then retry their transient failures in up to
+        `retry_policy.attempts` passes. Returns the final results in order."""
+        policy = self.retry_policy
         with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-            results = list(executor.map(self.check_url, urls))
+            checked = list(executor.map(self._timed_check, urls))
+
+            for attempt in range(1, policy.attempts + 1):
+                scheduled = []  # (due, index)
+                for i, (result, finished) in enumerate(checked):
+                    if not is_transient(result):
+                        continue
+                    delay = policy.delay(attempt, result.retry_after)
+                    if delay is None or not policy.take():
+                        continue
+                    scheduled.append((finished + delay, i))
+                if not scheduled:
+                    break
+                # the backoff runs from the failure, most are due by the end of the sweep
+                scheduled.sort()
+                print(f"Retrying {len(scheduled)} transient failures (attempt {attempt})")
+                retried = executor.map(lambda item: self._check_when_due(urls[item[1]], item[0]), scheduled)
+                for (_, i), (result, finished) in zip(scheduled, retried):
+                    RETRIES.labels(outcome='recovered' if result.valid else 'failed').inc()
+                    checked[i] = (result, finished)
+
+        results = [result for result, _ in checked]
+        open_hosts = self.circuit_breaker.open_hosts()
+        if open_hosts:
+            print(f"Unreachable hosts: {', '.join(open_hosts)}")
         return results
 
-def setup_database():
+def connect_database():
 
     opts=''
     if os.environ.get("POSTGRES_SCHEMA"):
         opts = f"-c search_path={os.environ.get('POSTGRES_SCHEMA')}"
 
-    conn = psycopg2.connect(
+    return psycopg2.connect(
         host=os.environ.get("POSTGRES_HOST"),
         port=os.environ.get("POSTGRES_PORT"),
         dbname=os.environ.get("POSTGRES_DB"),
@@ -110,12 +251,16 @@ def setup_database():
         password=os.environ.get("POSTGRES_PASSWORD"),
         options=opts
     )
+
+def setup_database():
+    conn = connect_database()
     cur = conn.cursor()
    
     # Drop existing tables
     if os.environ.get("POSTGRES_SCHEMA"): # else it will drop the records table from public
         cur.execute("DROP TABLE IF EXISTS records CASCADE")
     cur.execute("DROP TABLE IF EXISTS links CASCADE")
+    cur.execute("DROP TABLE IF EXISTS record_links CASCADE")
     cur.execute("DROP TABLE IF EXISTS validation_history CASCADE")
 
     # Create tables
@@ -129,14 +274,31 @@ def setup_database():
         """
         CREATE TABLE IF NOT EXISTS links (
             id_link SERIAL PRIMARY KEY,
-            urlname TEXT UNIQUE,
+            urlname TEXT,
+            url_key TEXT UNIQUE,
             link_type TEXT,
             link_size BIGINT,
             last_modified TIMESTAMP,
-            fk_record INTEGER REFERENCES records(id),
             deprecated BOOLEAN DEFAULT FALSE,
             consecutive_failures INTEGER DEFAULT 0,
-            gis_capabilities JSONB DEFAULT '{}'::JSONB
+            capabilities_hash TEXT,
+            layer_list_hash TEXT,
+            final_url TEXT,
+            redirect_chain TEXT[],
+            detected_format TEXT,
+            format_mismatch TEXT,
+            host TEXT,
+            service_type TEXT,
+            last_status_code INTEGER,
+            last_error_class TEXT,
+            last_checked TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS record_links (
+            fk_record INTEGER REFERENCES records(id) ON DELETE CASCADE,
+            fk_link INTEGER REFERENCES links(id_link) ON DELETE CASCADE,
+            PRIMARY KEY (fk_record, fk_link)
         )
         """,
         """
@@ -146,6 +308,11 @@ def setup_database():
             status_code INTEGER,
             is_redirect BOOLEAN,
             error_message TEXT,
+            dns_ms REAL,
+            connect_ms REAL,
+            tls_ms REAL,
+            ttfb_ms REAL,
+            total_ms REAL,
             timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
         """
@@ -153,10 +320,102 @@ def setup_database():
    
     for table in tables:
         cur.execute(table)
+
+    # Capabilities documents by content hash, shared by all links with the
+    # same capabilities; the layer list of a service is stored separately as
+    # it is the same for every link on that service
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS capability_documents (
+            content_hash TEXT PRIMARY KEY,
+            document JSONB NOT NULL
+        )
+    """)
+    # Links with their capabilities joined back in, as used by the api
+    cur.execute("""
+        CREATE OR REPLACE VIEW links_with_capabilities AS
+        SELECT l.*,
+            COALESCE(
+                CASE WHEN ll.document IS NULL THEN cd.document
+                     ELSE cd.document || jsonb_build_object('layer_all', ll.document)
+                END,
+                '{}'::JSONB
+            ) AS gis_capabilities
+        FROM links l
+        LEFT JOIN capability_documents cd ON cd.content_hash = l.capabilities_hash
+        LEFT JOIN capability_documents ll ON ll.content_hash = l.layer_list_hash
+    """)
+
+    # Caches that outlive a run
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS wfs_schemas (
+            endpoint TEXT,
+            typename TEXT,
+            content_hash TEXT,
+            schema JSONB,
+            fetched_at TIMESTAMP,
+            PRIMARY KEY (endpoint, typename)
+        )
+    """)
+    # Last known state of each link and its transitions, kept across runs
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS link_states (
+            urlname TEXT PRIMARY KEY,
+            valid BOOLEAN,
+            deprecated BOOLEAN,
+            status_code INTEGER,
+            updated_at TIMESTAMPTZ
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS status_events (
+            id BIGSERIAL PRIMARY KEY,
+            urlname TEXT NOT NULL,
+            fk_link INTEGER,
+            event TEXT NOT NULL,
+            old_status_code INTEGER,
+            new_status_code INTEGER,
+            created_at TIMESTAMPTZ DEFAULT now()
+        )
+    """)
+    # Runs of the linkchecker task, the api reloads its status index when one finishes
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS runs (
+            id SERIAL PRIMARY KEY,
+            started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS harvest_state (
+            items_url TEXT PRIMARY KEY,
+            last_harvest TIMESTAMPTZ
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS harvested_distributions (
+            record_id TEXT,
+            url TEXT,
+            format TEXT,
+            name TEXT,
+            PRIMARY KEY (record_id, url)
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS redirect_cache (
+            source_url TEXT PRIMARY KEY,
+            target_url TEXT NOT NULL,
+            status_code INTEGER,
+            fetched_at TIMESTAMP
+        )
+    """)
         
     # Create indexes for better performance
     indexes = [
-        "CREATE INDEX IF NOT EXISTS idx_validation_latest ON validation_history (fk_link, timestamp DESC)"
+        "CREATE INDEX IF NOT EXISTS idx_validation_latest ON validation_history (fk_link, timestamp DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_record_links_link ON record_links (fk_link)",
+        "CREATE INDEX IF NOT EXISTS idx_validation_timestamp ON validation_history (timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_links_host ON links (host)",
+        "CREATE INDEX IF NOT EXISTS idx_links_last_checked ON links (last_checked)"
     ]
    
     for index in indexes:
@@ -165,6 +424,133 @@ def setup_database():
     conn.commit()
     return conn, cur
 
+def start_run(conn):
+    with conn.cursor() as cur:
+        cur.execute("INSERT INTO runs DEFAULT VALUES RETURNING id")
+        run_id = cur.fetchone()[0]
+    conn.commit()
+    return run_id
+
+def finish_run(conn, run_id):
+    """Mark the run as finished, the latest status of all its links is stored"""
+    with conn.cursor() as cur:
+        cur.execute("UPDATE runs SET finished_at = CURRENT_TIMESTAMP WHERE id = %s", (run_id,))
+    conn.commit()
+
+def load_wfs_schemas(conn):
+    """Fill the WFS schema cache from the database"""
+    if not (schema_cache.enabled or schema_cache.services):
+        return
+    with conn.cursor() as cur:
+        cur.execute("SELECT endpoint, typename, content_hash, schema, fetched_at FROM wfs_schemas")
+        schema_cache.load(cur.fetchall())
+
+def save_wfs_schemas(conn):
+    """Store the WFS schemas fetched during this run"""
+    rows = schema_cache.changed()
+    if not rows:
+        return
+    with conn.cursor() as cur:
+        cur.executemany("""
+            INSERT INTO wfs_schemas (endpoint, typename, content_hash, schema, fetched_at)
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (endpoint, typename) DO UPDATE
+            SET fetched_at = EXCLUDED.fetched_at,
+                content_hash = EXCLUDED.content_hash,
+                schema = CASE
+                    WHEN wfs_schemas.content_hash = EXCLUDED.content_hash THEN wfs_schemas.schema
+                    ELSE EXCLUDED.schema
+                END
+        """, [(endpoint, typename, schema_hash, json.dumps(schema, default=safe_serialize), fetched_at)
+              for endpoint, typename, schema_hash, schema, fetched_at in rows])
+    conn.commit()
+
+def harvest_distributions(conn, full=False):
+    """Harvest the records updated since the last successful harvest (all
+    records if `full`) from the catalogue into harvested_distributions"""
+    with conn.cursor() as cur:
+        cur.execute("SELECT last_harvest FROM harvest_state WHERE items_url = %s", (catalogue_json_url,))
+        row = cur.fetchone()
+    since = None if full or row is None else row[0]
+    started = datetime.now(timezone.utc)
+
+    print(f"Harvesting {'records updated since ' + since.isoformat() if since else 'all records'} from {catalogue_json_url}")
+    record_ids, distributions = harvest(catalogue_json_url, since=since, headers={'User-Agent': USERAGENT})
+
+    with conn.cursor() as cur:
+        if since is None:
+            cur.execute("DELETE FROM harvested_distributions")
+        else:
+            cur.execute("DELETE FROM harvested_distributions WHERE record_id = ANY(%s)", (record_ids,))
+        cur.executemany("""
+            INSERT INTO harvested_distributions (record_id, url, format, name)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (record_id, url) DO NOTHING
+        """, distributions)
+        cur.execute("""
+            INSERT INTO harvest_state (items_url, last_harvest)
+            VALUES (%s, %s)
+            ON CONFLICT (items_url) DO UPDATE SET last_harvest = EXCLUDED.last_harvest
+        """, (catalogue_json_url, started))
+    conn.commit()
+    print(f"Harvested {len(distributions)} links of {len(record_ids)} records")
+
+def load_redirects(conn):
+    """Fill the redirect cache with the unexpired permanent hops from the database"""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT source_url, target_url, status_code, fetched_at FROM redirect_cache
+            WHERE fetched_at > %s AND status_code = ANY(%s)
+        """, (datetime.now() - redirect_cache.ttl, sorted(PERMANENT_REDIRECTS)))
+        redirect_cache.load(cur.fetchall())
+
+def save_redirects(conn):
+    """Store the redirect hops followed during this run, drop expired and invalidated ones"""
+    rows = redirect_cache.changed()
+    with conn.cursor() as cur:
+        cur.executemany("DELETE FROM redirect_cache WHERE source_url = %s",
+                        [(row[0],) for row in rows if row[1] is None])
+        cur.executemany("""
+            INSERT INTO redirect_cache (source_url, target_url, status_code, fetched_at)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (source_url) DO UPDATE
+            SET target_url = EXCLUDED.target_url,
+                status_code = EXCLUDED.status_code,
+                fetched_at = EXCLUDED.fetched_at
+        """, [row for row in rows if row[1] is not None])
+        cur.execute("DELETE FROM redirect_cache WHERE fetched_at <= %s OR NOT status_code = ANY(%s)",
+                    (datetime.now() - redirect_cache.ttl, sorted(PERMANENT_REDIRECTS)))
+    conn.commit()
+
+# Hashes of the capability documents known to be stored
+stored_documents = set()
+
+def store_document(cur, document):
+    """Store `document` content addressed, returns its hash (or None)"""
+    if document is None:
+        return None
+    serialized = json.dumps(document, default=safe_serialize, sort_keys=True, separators=(',', ':'))
+    content_hash = hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+    if content_hash not in stored_documents:
+        cur.execute("""
+            INSERT INTO capability_documents (content_hash, document)
+            VALUES (%s, %s)
+            ON CONFLICT (content_hash) DO NOTHING
+        """, (content_hash, serialized))
+    return content_hash
+
+def prune_documents(conn):
+    """Remove capability documents no link refers to anymore"""
+    with conn.cursor() as cur:
+        cur.execute("""
+            DELETE FROM capability_documents d
+            WHERE NOT EXISTS (
+                SELECT 1 FROM links l
+                WHERE l.capabilities_hash = d.content_hash OR l.layer_list_hash = d.content_hash
+            )
+        """)
+    conn.commit()
+
 def safe_serialize(obj):
     # Try objects that expose their attributes
     if hasattr(obj, "__dict__"):
@@ -173,36 +559,48 @@ def safe_serialize(obj):
     # Fall back to a string representation
     return str(obj)
 
-def insert_or_update_link(conn, url_result, record_id):
+def upsert_records(cur, record_ids):
+    """Ids of the records rows of `record_ids`, inserting missing ones"""
+    if not record_ids:
+        return []
+    # DO NOTHING leaves existing rows untouched, they are selected instead;
+    # the select sees the table as before the insert, so no row is returned twice
+    cur.execute("""
+        WITH ids AS (
+            SELECT unnest(%s::TEXT[]) AS record_id
+        ), inserted AS (
+            INSERT INTO records (record_id)
+            SELECT record_id FROM ids
+            ON CONFLICT (record_id) DO NOTHING
+            RETURNING id
+        )
+        SELECT id FROM inserted
+        UNION ALL
+        SELECT r.id FROM records r JOIN ids ON ids.record_id = r.record_id
+    """, ([catalogue_domain + record_id for record_id in sorted(set(record_ids))],))
+    return [row[0] for row in cur.fetchall()]
+
+def insert_or_update_link(conn, url_result, record_ids, service_type=None):
+    """Store the result of checking a link, referenced by the records `record_ids`.
+    The latest status is also kept on the link itself for the summaries of the api."""
+    started = time.time()
     try:
         with conn.cursor() as cur:
             urlname = url_result['url']
-           
-            if record_id:
-                cur.execute("""
-                    INSERT INTO records (record_id)
-                    VALUES (%s)
-                    ON CONFLICT (record_id) DO NOTHING
-                    RETURNING id
-                """, (catalogue_domain + record_id,))
-                record_result = cur.fetchone()
-               
-                if record_result:
-                    record_db_id = record_result[0]
-                else:
-                    cur.execute("SELECT id FROM records WHERE record_id = %s",
-                              (catalogue_domain + record_id,))
-                    record_result = cur.fetchone()
-                    record_db_id = record_result[0] if record_result else None
-            else:
-                record_db_id = None
+            # equivalent urls are one link, stored with the url that was checked
+            key = canonicalize_url(urlname)
+            record_db_ids = upsert_records(cur, record_ids)
                
-            gis_caps = json.dumps(url_result['gis_capabilities'], default=safe_serialize, indent=2) if url_result['gis_capabilities'] else '{}'
+            capabilities = dict(url_result['gis_capabilities']) if url_result['gis_capabilities'] else None
+            layer_all = capabilities.pop('layer_all', None) if capabilities else None
+            capabilities_hash = store_document(cur, capabilities)
+            layer_list_hash = store_document(cur, layer_all)
            
             cur.execute("""
-                INSERT INTO links (urlname, fk_record, consecutive_failures, link_type, link_size, last_modified, gis_capabilities)
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-                ON CONFLICT (urlname) DO UPDATE
+                INSERT INTO links (urlname, url_key, consecutive_failures, link_type, link_size, last_modified, capabilities_hash, layer_list_hash, final_url, redirect_chain, detected_format, format_mismatch,
+                                   host, service_type, last_status_code, last_error_class, last_checked)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
+                ON CONFLICT (url_key) DO UPDATE
                 SET consecutive_failures = CASE
                         WHEN %s THEN 0
                         ELSE links.consecutive_failures + 1
@@ -215,102 +613,80 @@ def insert_or_update_link(conn, url_result, record_id):
                     link_type = EXCLUDED.link_type,
                     link_size = EXCLUDED.link_size,
                     last_modified = EXCLUDED.last_modified,
-                    gis_capabilities = EXCLUDED.gis_capabilities
+                    capabilities_hash = EXCLUDED.capabilities_hash,
+                    layer_list_hash = EXCLUDED.layer_list_hash,
+                    final_url = EXCLUDED.final_url,
+                    redirect_chain = EXCLUDED.redirect_chain,
+                    detected_format = EXCLUDED.detected_format,
+                    format_mismatch = EXCLUDED.format_mismatch,
+                    host = EXCLUDED.host,
+                    service_type = EXCLUDED.service_type,
+                    last_status_code = EXCLUDED.last_status_code,
+                    last_error_class = EXCLUDED.last_error_class,
+                    last_checked = EXCLUDED.last_checked
                 RETURNING id_link, deprecated
             """, (
                     urlname,
-                    record_db_id,
+                    key,
                     0 if url_result['valid'] else 1,
                     url_result['content_type'],
                     url_result['content_size'],
                     url_result['last_modified'],
-                    gis_caps,
+                    capabilities_hash,
+                    layer_list_hash,
+                    url_result.get('final_url'),
+                    url_result.get('redirect_chain'),
+                    url_result.get('detected_format'),
+                    url_result.get('format_mismatch'),
+                    urlsplit(urlname).hostname,
+                    service_type,
+                    url_result['status_code'],
+                    url_result.get('error_class'),
                     url_result['valid'],
                     url_result['valid'],
                     MAX_FAILURES
                 ))
            
             link_id, deprecated = cur.fetchone()
+            record_transitions(cur, urlname, link_id, url_result['valid'], deprecated, url_result['status_code'], key)
+
+            if record_db_ids:
+                cur.execute("""
+                    INSERT INTO record_links (fk_record, fk_link)
+                    SELECT unnest(%s::INTEGER[]), %s
+                    ON CONFLICT DO NOTHING
+                """, (record_db_ids, link_id))
 
             if not deprecated:
+                timings = (url_result.get('timings') if STORE_TIMINGS else None) or {}
                 cur.execute("""
                     INSERT INTO validation_history(
                         fk_link, status_code,
-                        is_redirect, error_message
+                        is_redirect, error_message,
+                        dns_ms, connect_ms, tls_ms, ttfb_ms, total_ms
                     )
-                    VALUES(%s, %s, %s, %s)
+                    VALUES(%s, %s, %s, %s, %s, %s, %s, %s, %s)
                 """, (
                     link_id,
                     url_result['status_code'],
                     url_result['is_redirect'],
-                    str(url_result.get('error'))
+                    str(url_result.get('error')),
+                    timings.get('dns'),
+                    timings.get('connect'),
+                    timings.get('tls'),
+                    timings.get('ttfb'),
+                    timings.get('total')
                 ))
            
             conn.commit()
+            stored_documents.update(h for h in (capabilities_hash, layer_list_hash) if h)
+            DB_WRITE_LATENCY.observe(time.time() - started)
             return link_id if not deprecated else None
     except Exception as e:
         conn.rollback()
         print(f"Error processing URL {url_result['url']}: {str(e)}\nStack trace:\n{traceback.format_exc()}")
         return None
 
-def detect_service_type(url, protocol=None):
-    if not url:
-        return None
-    
-    url_lower = url.lower()
-    
-    # Check for OGC API patterns in URL
-    is_ogcapi_url = any(pattern in url_lower for pattern in ['/ogc/features', '/ogcapi', '/api/features'])
-    
-    # First check protocol if provided otherwise check URL
-    if protocol:
-        protocol_lower = protocol.lower()
-        
-        # Direct OGC API protocol
-        if 'ogc api' in protocol_lower:
-            return 'ogcapi'
-            
-        # Protocol specifies WFS but URL suggests OGC API
-        elif 'wfs' in protocol_lower and is_ogcapi_url:
-            print(f"URL suggests OGCAPI but protocol says WFS, using 'ogcapi' instead for: {url}")
-            return 'ogcapi'
-            
-        # Standard OGC service types
-        elif 'wms' in protocol_lower:
-            return 'wms'
-        elif 'wmts' in protocol_lower:
-            return 'wmts'
-        elif 'wfs' in protocol_lower:
-            return 'wfs'
-        elif 'wcs' in protocol_lower:
-            return 'wcs'
-        elif 'ows' in protocol_lower:
-            return 'wms'  # Default OWS to WMS
-    
-    if is_ogcapi_url:
-        return 'ogcapi'
-    
-    # Check for service parameter in query string
-    parsed_url = urlparse(url)
-    query_params = parse_qs(parsed_url.query)
-    if 'service' in query_params:
-        service = query_params['service'][0].lower()
-        if service in ['wms', 'wmts', 'wfs', 'wcs']:
-            return service
-    
-    # Check URL path for service indicators
-    if '/wms' in url_lower:
-        return 'wms'
-    elif '/wmts' in url_lower:
-        return 'wmts'
-    elif '/wfs' in url_lower:
-        return 'wfs'
-    elif '/wcs' in url_lower:
-        return 'wcs'
-    
-    # No clear indication found
-    return None
-
 def process_url(url, protocol, name, record):
     """Process URL and utilize process_ogc_api to get capabilities.
    
@@ -331,61 +707,112 @@ def process_url(url, protocol, name, record):
         # Pass the protocol to process_ogc_links for additional context
         capabilities_result = process_ogc_links(url, service_type, name, record)
         
-        return {
-            'record_id': record,
-            'name': name,
-            'url': url,
-            'protocol': protocol,
-            'service_type': service_type,
-            'capabilities': capabilities_result
-        }
-
-
-
+        return LinkSource(record, name, url, protocol, service_type, capabilities_result)
+
+
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Check the links of the catalogue records")
+    parser.add_argument('--harvest', action='store_true', default=HARVEST,
+                        help="harvest the links from the OGC API Records catalogue instead of metadata.distributions")
+    parser.add_argument('--full', action='store_true',
+                        help="harvest all records, not only those updated since the last harvest")
+    commands = parser.add_subparsers(dest='command')
+    commands.add_parser('check', help="check all links (default)")
+    export = commands.add_parser('export', help="export links with their validation history")
+    export.add_argument('--start', type=parse_time, required=True, help="first check time to export (ISO 8601)")
+    export.add_argument('--end', type=parse_time, default=datetime.now(), help="export checks before this time (ISO 8601, default now)")
+    export.add_argument('--format', choices=sorted(FORMATS), default='parquet')
+    export.add_argument('--output', help="file to write to, default links_<start>_<end>.<format>; - for stdout")
+    return parser.parse_args(argv)
+
+def export(args):
+    conn = connect_database()
+    output = args.output or export_filename(args.format, args.start, args.end)
+    started = time.time()
+    try:
+        if output == '-':
+            count = export_to_file(conn, args.start, args.end, args.format, sys.stdout.buffer)
+        else:
+            with open(output, 'wb') as f:
+                count = export_to_file(conn, args.start, args.end, args.format, f)
+    finally:
+        conn.close()
+    print(f"Exported {count} checks to {output} in {time.time() - started:.2f} seconds", file=sys.stderr)
 
-def main():
+def main(args=None):
+    args = args or parse_args()
+    if args.command == 'export':
+        return export(args)
     start_time = time.time()
     if STOREINDB:
+        # the tables are rebuilt, the snapshots of the last run are not served meanwhile
+        invalidate_snapshots()
         conn, cur = setup_database()
+        run_id = start_run(conn)
     url_checker = URLChecker()
-   
+    load_wfs_schemas(conn)
+    load_redirects(conn)
 
-    # total_pages, items_per_page = get_pagination_info(catalogue_json_url)
+    if args.harvest:
+        harvest_distributions(conn, full=args.full)
+        distributions_table = 'harvested_distributions'
+    else:
+        distributions_table = 'metadata.distributions'
 
-    cur.execute("""
+    cur.execute(f"""
             SELECT
                 record_id, url, format, name 
             FROM 
-                metadata.distributions
+                {distributions_table}
         """)
     records = cur.fetchall()
 
     print(f'Extracting {len(records)} distributions...')
-    url_record_map = {}  # Dictionary to store URL to record_id mapping
+    url_record_map = {}  # Dictionary to store URL to LinkSource mapping
+    url_records = {}  # URL to the ids of all records referring to it or an equivalent url
+    checked_urls = {}  # Canonical URL to the first URL with that form, which is checked
 
     # Process only total_pages number of pages
     for r in records:
-        print(f"Processing link {unquote(r[1]).split('?')[0]} from record {r[0]} at {time.time()-start_time}")
-        pre = process_url(unquote(r[1]), r[2], r[3], r[0])
+        if not r[1]:
+            continue
+        # the canonical form only finds equivalent urls, servers get the url as published
+        url = unquote(r[1])
+        url = checked_urls.setdefault(canonicalize_url(url), url)
+        if url in url_records:
+            # equivalent to a url seen before, capabilities of the first distribution are kept
+            if r[0]:
+                url_records[url].append(r[0])
+            continue
+        url_records[url] = [r[0]] if r[0] else []
+        print(f"Processing link {url.split('?')[0]} from record {r[0]} at {time.time()-start_time}")
+        pre = process_url(url, r[2], r[3], r[0])
         if pre:
-            url_record_map[unquote(r[1])] = pre
+            url_record_map[url] = pre
+    save_wfs_schemas(conn)
    
-    print(f"Found {len(url_record_map)} unique links to check")
+    print(f"Found {len(url_record_map)} unique links to check in {len(records)} distributions")
    
     # Check all URLs concurrently
+    label_hosts(url_record_map.keys())
     results = url_checker.check_urls(url_record_map.keys())
+    save_redirects(conn)
    
     # Process results
     if STOREINDB:
         # print(f"Update database...")
         processed_links = 0
         for result in results:
-            # Get both record_id and capabilities from the map
-            record_info = url_record_map[result.get('url','')]
+            # Get capabilities from the map, the link is reported for all its records
+            source = url_record_map[result.url]
             # Update result with capabilities info
-            result['gis_capabilities'] = record_info.get('capabilities','')
+            result.gis_capabilities = source.capabilities
+            # the format column of the distribution is passed on as protocol
+            result.format_mismatch = format_mismatch(result.detected_format, result.content_type, source.protocol)
            
-            if insert_or_update_link(conn, result, record_info['record_id']) is not None:
+            if insert_or_update_link(conn, result.as_dict(), url_records[result.url], source.service_type) is not None:
                 processed_links += 1
            
         cur.execute("""
@@ -395,11 +822,23 @@ def main():
             FROM validation_history
         """)
         total_checks, successful_checks = cur.fetchone()
+        prune_documents(conn)
+        finish_run(conn, run_id)
+        # the list endpoints of the api serve these until the next run
+        try:
+            write_snapshots(conn, run_id, schema=os.environ.get("POSTGRES_SCHEMA") or 'public')
+        except (OSError, psycopg2.Error) as e:
+            conn.rollback()
+            print(f"Could not write snapshots: {e}")
 
     end_time = time.time()
     print("\nSummary:")
     print(f"Time elapsed: {end_time - start_time:.2f} seconds")
 
+    RUN_DURATION.set(end_time - start_time)
+    RUN_LAST_SUCCESS.set(end_time)
+    write_textfile()
+
     if STOREINDB == True:
         print(f"Total checks performed: {total_checks}")
         print(f"Successful checks: {successful_checks}")
@@ -0,0 +1,154 @@
+"""Prometheus metrics shared by the linkchecker batch job and the API.
+
+The batch job writes its metrics to a textfile (for the node_exporter
+textfile collector) at the end of a run, the API serves them on `/metrics`.
+"""
+import os
+import time
+from collections import Counter as Tally
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram,
+    generate_latest, write_to_textfile
+)
+
+try:
+    from .results import ErrorClass
+except ImportError:
+    from results import ErrorClass
+
+# Textfile the batch job writes its metrics to
+METRICS_TEXTFILE = os.environ.get("METRICS_TEXTFILE") or "linkchecker.prom"
+
+# Hosts with their own latency series: the METRICS_MAX_HOSTS hosts with the
+# most links of a run and the comma separated METRICS_HOSTS; all other hosts,
+# and all on-demand checks of the API unless listed, are labelled 'other'
+METRICS_MAX_HOSTS = int(os.environ.get("METRICS_MAX_HOSTS") or 50)
+METRICS_HOSTS = frozenset(host.strip().lower() for host in (os.environ.get("METRICS_HOSTS") or '').split(',') if host.strip())
+OTHER_HOST = 'other'
+
+# Buckets tuned around the 5 second url timeout
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 3, 4, 5, 7.5, 10, 30)
+
+CHECKS = Counter(
+    'linkcheck_checks_total',
+    'Link checks performed, by outcome class',
+    ['outcome']
+)
+REQUEST_LATENCY = Histogram(
+    'linkcheck_request_duration_seconds',
+    'Duration of a single link check, by host (the largest hosts, others as "other")',
+    ['host'],
+    buckets=LATENCY_BUCKETS
+)
+IN_FLIGHT = Gauge(
+    'linkcheck_requests_in_flight',
+    'Link checks currently in progress'
+)
+PROBE_DURATION = Histogram(
+    'linkcheck_capabilities_probe_duration_seconds',
+    'Duration of OGC capabilities probes, by service type',
+    ['service_type'],
+    buckets=LATENCY_BUCKETS
+)
+DB_WRITE_LATENCY = Histogram(
+    'linkcheck_db_write_duration_seconds',
+    'Duration of a committed database write batch',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+)
+API_LATENCY = Histogram(
+    'linkcheck_api_request_duration_seconds',
+    'API request duration, by endpoint',
+    ['method', 'endpoint', 'status'],
+    buckets=LATENCY_BUCKETS
+)
+CIRCUITS_OPENED = Counter(
+    'linkcheck_circuits_opened_total',
+    'Hosts whose links were skipped after consecutive connection failures'
+)
+RETRIES = Counter(
+    'linkcheck_retries_total',
+    'Transient failures checked again after the sweep, by whether the retry succeeded',
+    ['outcome']
+)
+RUN_DURATION = Gauge(
+    'linkcheck_run_duration_seconds',
+    'Wall clock duration of the last linkchecker run'
+)
+RUN_LAST_SUCCESS = Gauge(
+    'linkcheck_run_last_success_timestamp_seconds',
+    'Unix time the last linkchecker run finished'
+)
+
+
+def outcome_class(status_code, error_class=ErrorClass.NONE):
+    """Map a check result onto a small set of outcome labels, by the
+    `ErrorClass` stored with the result when there is no status code"""
+    if status_code is None:
+        if error_class == ErrorClass.TIMEOUT:
+            return 'timeout'
+        if error_class == ErrorClass.HOST_UNREACHABLE:
+            return 'unreachable'
+        return 'error'
+    if 200 <= status_code < 300:
+        return 'ok'
+    if 300 <= status_code < 400:
+        return 'redirect'
+    if 400 <= status_code < 500:
+        return 'client_error'
+    return 'server_error'
+
+
+def _host(url):
+    try:
+        return urlparse(url).hostname or 'unknown'
+    except ValueError:
+        return 'unknown'
+
+
+_labelled_hosts = METRICS_HOSTS
+
+
+def label_hosts(urls, limit=METRICS_MAX_HOSTS):
+    """Give the `limit` hosts with the most of `urls` their own latency series"""
+    global _labelled_hosts
+    top = Tally(_host(url) for url in urls).most_common(limit)
+    _labelled_hosts = METRICS_HOSTS | frozenset(host for host, _ in top)
+
+
+def metric_host_label(url):
+    """Host of a url as metric label value, 'other' unless it is a labelled
+    host; not the host itself, see `label_hosts`"""
+    host = _host(url)
+    return host if host in _labelled_hosts else OTHER_HOST
+
+
+@contextmanager
+def track_request(url):
+    """Track in-flight count and latency of a single link check"""
+    IN_FLIGHT.inc()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        IN_FLIGHT.dec()
+        REQUEST_LATENCY.labels(host=metric_host_label(url)).observe(time.perf_counter() - started)
+
+
+def record_check(result):
+    CHECKS.labels(outcome=outcome_class(result.status_code, result.error_class)).inc()
+
+
+def write_textfile(path=METRICS_TEXTFILE):
+    """Write all metrics to `path`, atomically as required by the textfile collector"""
+    try:
+        write_to_textfile(path, REGISTRY)
+    except OSError as e:
+        print(f"Could not write metrics to {path}: {e}")
+
+
+def render_latest():
+    """Metrics payload and content type for a /metrics endpoint"""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
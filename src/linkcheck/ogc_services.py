@@ -1,226 +1,321 @@
-from owslib.wms import WebMapService
-from owslib.wmts import WebMapTileService          
-from owslib.wfs import WebFeatureService
-from owslib.wcs import WebCoverageService
-from owslib.ogcapi.features import Features
-     
-def process_ogc_links(url, ltype, lname, md_id):
-    def extract_metadata_urls(urls):
-        """Helper to extract metadata URLs"""
-        if not urls:
-            return []
-        metadata_urls = []
-        for mu in urls:
-            if isinstance(mu, dict) and 'url' in mu:
-                metadata_urls.append(mu['url'])
-            elif hasattr(mu, 'url'):
-                metadata_urls.append(mu.url)
-            else:
-                metadata_urls.append(str(mu))
-        return metadata_urls
-
-    match ltype:
-        case 'wms':
-            layer = None
-            try:
-                wms = WebMapService(url, version='1.3.0')
-                if lname is not None and lname in list(wms.contents):
-                    layer = wms.contents[lname]
-                else:
-                    # Search by metadata URL
-                    for l in wms.contents.items():
-                        if hasattr(l, 'metadataUrls') and l.metadataUrls:
-                            urls = extract_metadata_urls(l.metadataUrls)
-                            if md_id and any(md_id in url for url in urls):
-                                layer = l
-                                break
-                    # Only try to match by title if lname is not None
-                    if not layer and lname:
-                        for k, l in wms.contents.items():
-                            if hasattr(l, 'title') and hasattr(l, 'name') and l.title and lname and l.title.lower() == lname.lower():
-                                layer = l
-                                break
-
-                # If no layer is found and lname is None, return service-level info
-                if not layer and lname is None:
-                    return {
-                        'service_type': 'wms',
-                        'layer_name': None,
-                        'queryable': None,
-                        'layer_all': list(wms.contents),
-                        'title': getattr(wms, 'identification', None).title if hasattr(wms, 'identification') and hasattr(wms.identification, 'title') else None,
-                        'abstract': getattr(wms, 'identification', None).abstract if hasattr(wms, 'identification') and hasattr(wms.identification, 'abstract') else None,
-                        'keywords': [],
-                        'bbox': None,
-                        'crs4326': None,
-                        'crs3857': None,
-                        'styles': [],
-                        'metadata_urls': []
-                    }
-
-                # Convert matched layer to dictionary
-                return {
-                    'service_type': 'wms',
-                    'layer_name': layer.name if layer else None,
-                    'queryable': True if (layer and layer.queryable == 1) else False,
-                    'layer_all': list(wms.contents),
-                    'title': layer.title if layer else None,
-                    'abstract': layer.abstract if layer else None,
-                    'keywords': list(layer.keywords) if hasattr(layer, 'keywords') else [],
-                    'bbox': layer.boundingBox if hasattr(layer, 'boundingBox') else None,
-                    'crs4326': ('EPSG:4326' in list(layer.crsOptions) if hasattr(layer, 'crsOptions') else []),
-                    'crs3857': ('EPSG:3857' in list(layer.crsOptions) if hasattr(layer, 'crsOptions') else []),
-                    'styles': list(layer.styles.keys()) if hasattr(layer, 'styles') else [],
-                    'metadata_urls': extract_metadata_urls(layer.metadataUrls) if hasattr(layer, 'metadataUrls') else []
-                }
-            except Exception as e:
-                print(f"Error getting WMS capabilities at {url}: {e}")
-                return None
-
-        case 'wmts':
-            try:
-                layer = None
-                wmts = WebMapTileService(url)
-                if lname in list(wmts.contents):
-                    layer = wmts.contents[lname]
-                elif len(wmts.contents) == 1:
-                    layer = list(wmts.contents.values())[0]
-                else:
-                    for k,l in wmts.contents.items():
-                        if hasattr(l, 'title') and hasattr(l, 'name') and l.title.lower() == lname.lower():
-                            layer = l
-                            break
-                    
-
-                return {
-                    'service_type': 'wmts',
-                    'layer_name': layer.name if layer else None,
-                    'layer_all': list(wmts.contents),
-                    'title': layer.title if layer else None,
-                    'abstract': layer.abstract if hasattr(layer, 'abstract') else None,
-                    'bbox': layer.boundingBoxWGS84 if hasattr(layer, 'boundingBoxWGS84') else None,
-                    'formats': list(layer.formats) if hasattr(layer, 'formats') else [],
-                    'tilematrixsets': list(layer.tilematrixsets) if hasattr(layer, 'tilematrixsets') else [],
-                    'metadata_urls': extract_metadata_urls(layer.metadataUrls) if hasattr(layer, 'metadataUrls') else []
-                }
-            except Exception as e:
-                print(f"Error getting WMTS capabilities at {url}: {e}")
-                return None
-
-        case 'wfs':
-            try:
-                wfs = WebFeatureService(url=url, version='2.0.0')
-                feature = None
-                schema = None
-                
-                if lname in list(wfs.contents):
-                    feature = wfs.contents[lname]
-                    schema = wfs.get_schema(lname)
-                elif len(wfs.contents) == 1:
-                    feature = list(wfs.contents.values())[0]
-                    schema = wfs.get_schema(feature.id)
-                else:
-                    # Search by metadata URLs
-                    for f in wfs.contents.values():
-                        if hasattr(f, 'metadataUrls') and f.metadataUrls:
-                            urls = extract_metadata_urls(f.metadataUrls)
-                            if md_id and any(md_id in url for url in urls):
-                                feature = f
-                                schema = wfs.get_schema(f.id)
-                                break
-                    
-                    # If still no match and lname is provided, try matching by title
-                    if not feature and lname:
-                        for f in wfs.contents.values():
-                            if hasattr(f, 'title') and f.title and f.title.lower() == lname.lower():
-                                feature = f
-                                schema = wfs.get_schema(f.id)
-                                break
-                
-                return {
-                    'service_type': 'wfs',
-                    'layer_name': feature.id if feature else None,
-                    'layer_all': list(wfs.contents),
-                    'title': feature.title if feature else None,
-                    'abstract': feature.abstract if (feature and hasattr(feature, 'abstract')) else None,
-                    'keywords': list(feature.keywords) if (feature and hasattr(feature, 'keywords')) else [],
-                    'bbox': feature.boundingBox if (feature and hasattr(feature, 'boundingBox')) else None,
-                    'crs4326': ('EPSG:4326' in list(feature.crsOptions) if (feature and hasattr(feature, 'crsOptions')) else []),
-                    'crs3857': ('EPSG:3857' in list(feature.crsOptions) if (feature and hasattr(feature, 'crsOptions')) else []),
-                    'metadata_urls': extract_metadata_urls(feature.metadataUrls) if (feature and hasattr(feature, 'metadataUrls')) else [],
-                    'schema': (schema if isinstance(schema, dict) else schema.__dict__) if schema else None
-                }
-            except Exception as e:
-                print(f"Error getting WFS capabilities at {url}: {e}")
-                return None
-    
-        case 'wcs':
-            try:
-                wcs = WebCoverageService(url, version='2.0.1')
-                coverage = None
-                
-                if lname in list(wcs.contents):
-                    coverage = wcs.contents[lname]
-                elif len(wcs.contents) == 1:
-                    coverage = list(wcs.contents.values())[0]
-                else:
-                    # Search by metadata URLs
-                    for c in wcs.contents.values():
-                        if hasattr(c, 'metadataUrls') and c.metadataUrls:
-                            urls = extract_metadata_urls(c.metadataUrls)
-                            if md_id and any(md_id in url for url in urls):
-                                coverage = c
-                                break
-                    
-                    # If still no match and lname is provided, try matching by title
-                    if not coverage and lname:
-                        for c in wcs.contents.values():
-                            if hasattr(c, 'title') and c.title and c.title.lower() == lname.lower():
-                                coverage = c
-                                break
-
-                return {
-                    'service_type': 'wcs',
-                    'layer_name': coverage.id if coverage else None,
-                    'layer_all': list(wcs.contents), 
-                    'title': coverage.title if coverage else None,
-                    'abstract': coverage.abstract if (coverage and hasattr(coverage, 'abstract')) else None,
-                    'keywords': list(coverage.keywords) if (coverage and hasattr(coverage, 'keywords')) else [],
-                    'bbox': coverage.boundingBox if (coverage and hasattr(coverage, 'boundingBox')) else None,
-                    'supported_formats': list(coverage.supportedFormats) if (coverage and hasattr(coverage, 'supportedFormat')) else [],
-                    'metadata_urls': extract_metadata_urls(coverage.metadataUrls) if (coverage and hasattr(coverage, 'metadataUrls')) else []
-                }
-            except Exception as e:
-                print(f"Error getting WCS capabilities at {url}: {e}")
-                return None
-        case 'ogcapi':
-            try:
-                if 'collections/' in url:
-                    lname2 = url.split('collections/').pop().split('/')[0].split('?')[0].split('#')[0]
-                    url = url.split('collections/')[0]
-                if lname2 not in [None,'']:
-                    lname = lname2
-                oaf = Features(url)
-                lyrs = oaf.collections()['collections']
-                ls_lyrs = [l['id'] for l in lyrs]
-                collection = None
-                if len(ls_lyrs) == 1:
-                    collection = lyrs[0]
-                else:    
-                    for l in lyrs:
-                        if lname not in [None, ''] and (lname == l.get('id','') or lname.lower() == l.get('title','')):
-                            collection = l
-                            break
-                        # todo: check metadata link matches md_id
-                return {
-                    'service_type': 'ogcapi',
-                    'layer_name': collection.id if hasattr(collection, 'id') else None,
-                    'layer_all': ls_lyrs,
-                    'title': collection.title if hasattr(collection, 'title') else None,
-                    'abstract': collection.description if hasattr(collection, 'description') else None,
-                    'bbox': collection.extent if hasattr(collection, 'extent') else None,
-                    'crs': collection.crs if hasattr(collection, 'crs') else None
-                }
-            except Exception as e:
-                print(f"Error getting OGC API collection at {url}: {e}")
-                return None
\ No newline at end of file
+"""Capabilities probes for OGC services.
+
+Probes are kept in a registry by service type. OWSLib is imported inside
+each probe, so a process only pays for the OWSLib modules of the service
+types it actually meets. Register additional probes with `register_probe`.
+WMS and WFS capabilities are read with the streaming reader in
+capabilities.py rather than OWSLib.
+
+Capabilities are loaded once per service and kept, together with a layer
+index, in a small cache; distributions pointing at the same service only
+cost an index lookup.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    from .capabilities import LayerIndex, fetch_capabilities, service_url
+    from .metrics import PROBE_DURATION
+    from .wfs_schema import schema_cache
+except ImportError:
+    from capabilities import LayerIndex, fetch_capabilities, service_url
+    from metrics import PROBE_DURATION
+    from wfs_schema import schema_cache
+
+PROBES = {}
+
+# Timeout of capabilities requests, matches the OWSLib default
+PROBE_TIMEOUT = 30
+# Number of services and seconds their capabilities are cached
+CAPABILITIES_CACHE_SIZE = int(os.environ.get("CAPABILITIES_CACHE_SIZE") or 32)
+CAPABILITIES_CACHE_TTL = int(os.environ.get("CAPABILITIES_CACHE_TTL") or 3600)
+# Seconds a failure to load capabilities is cached
+CAPABILITIES_ERROR_TTL = int(os.environ.get("CAPABILITIES_ERROR_TTL") or 30)
+
+# Probes of this thread load the capabilities again instead of using the cache
+_probe_options = threading.local()
+
+
+class CapabilitiesCache:
+    """LRU cache with expiry of loaded services, keyed by (service type, service url).
+
+    Failures are cached for `error_ttl` seconds only, so a service that is
+    down is not tried again for each of its distributions in a row, but a
+    fixed service is picked up soon.
+    """
+
+    def __init__(self, maxsize=CAPABILITIES_CACHE_SIZE, ttl=CAPABILITIES_CACHE_TTL, error_ttl=CAPABILITIES_ERROR_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.error_ttl = error_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, service_type, url, loader):
+        """The cached value for the service at `url`, calling `loader(url)` on a miss"""
+        key = (service_type, service_url(url))
+        with self._lock:
+            entry = None if getattr(_probe_options, 'fresh', False) else self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                value, error = entry[1], entry[2]
+                if error is not None:
+                    raise error
+                return value
+
+        value, error = None, None
+        try:
+            value = loader(url)
+        except Exception as e:
+            error = e
+
+        with self._lock:
+            ttl = self.ttl if error is None else self.error_ttl
+            self._entries[key] = (time.monotonic() + ttl, value, error)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        if error is not None:
+            raise error
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+capabilities_cache = CapabilitiesCache()
+
+
+def register_probe(service_type):
+    """Register the decorated function as capabilities probe for `service_type`.
+
+    A probe is called as `probe(url, lname, md_id)` and returns a dict with
+    the capabilities of the matched layer, or None.
+    """
+    def decorator(probe):
+        PROBES[service_type] = probe
+        return probe
+    return decorator
+
+
+def process_ogc_links(url, ltype, lname, md_id, fresh=False):
+    """Probe the capabilities of an OGC service and match the layer `lname`;
+    with `fresh` the capabilities are loaded again rather than taken from the cache"""
+    probe = PROBES.get(ltype)
+    if probe is None:
+        return None
+    started = time.perf_counter()
+    _probe_options.fresh = fresh
+    try:
+        return probe(url, lname, md_id)
+    finally:
+        _probe_options.fresh = False
+        PROBE_DURATION.labels(service_type=ltype).observe(time.perf_counter() - started)
+
+
+def extract_metadata_urls(urls):
+    """Helper to extract metadata URLs"""
+    if not urls:
+        return []
+    metadata_urls = []
+    for mu in urls:
+        if isinstance(mu, dict) and 'url' in mu:
+            metadata_urls.append(mu['url'])
+        elif hasattr(mu, 'url'):
+            metadata_urls.append(mu.url)
+        else:
+            metadata_urls.append(str(mu))
+    return metadata_urls
+
+
+def _load_streamed(service_type):
+    def loader(url):
+        capabilities = fetch_capabilities(url, service_type, timeout=PROBE_TIMEOUT)
+        return capabilities, capabilities.index()
+    return loader
+
+
+def _load_owslib(service_class, **kwargs):
+    def loader(url):
+        service = service_class(url, **kwargs)
+        # index (id, contents) pairs, the ids are the layer names
+        return LayerIndex(
+            list(service.contents.items()),
+            name=lambda item: item[0],
+            title=lambda item: getattr(item[1], 'title', None),
+            metadata_urls=lambda item: extract_metadata_urls(getattr(item[1], 'metadataUrls', None))
+        )
+    return loader
+
+
+@register_probe('wms')
+def probe_wms(url, lname, md_id):
+    try:
+        wms, index = capabilities_cache.get('wms', url, _load_streamed('wms'))
+        layer = index.match(lname, md_id)
+
+        # If no layer is found and lname is None, return service-level info
+        if not layer and lname is None:
+            return {
+                'service_type': 'wms',
+                'layer_name': None,
+                'queryable': None,
+                'layer_all': index.names,
+                'title': wms.title,
+                'abstract': wms.abstract,
+                'keywords': [],
+                'bbox': None,
+                'crs4326': None,
+                'crs3857': None,
+                'styles': [],
+                'metadata_urls': []
+            }
+
+        # Convert matched layer to dictionary
+        return {
+            'service_type': 'wms',
+            'layer_name': layer.name if layer else None,
+            'queryable': bool(layer and layer.queryable),
+            'layer_all': index.names,
+            'title': layer.title if layer else None,
+            'abstract': layer.abstract if layer else None,
+            'keywords': layer.keywords if layer else [],
+            'bbox': layer.bbox if layer else None,
+            'crs4326': layer.has_crs('4326') if layer else None,
+            'crs3857': layer.has_crs('3857') if layer else None,
+            'styles': layer.styles if layer else [],
+            'metadata_urls': layer.metadata_urls if layer else []
+        }
+    except Exception as e:
+        print(f"Error getting WMS capabilities at {url}: {e}")
+        return None
+
+
+@register_probe('wmts')
+def probe_wmts(url, lname, md_id):
+    from owslib.wmts import WebMapTileService
+
+    try:
+        index = capabilities_cache.get('wmts', url, _load_owslib(WebMapTileService))
+        if len(index) == 1:
+            layer = index.layers[0][1]
+        else:
+            # wmts layers are not matched on metadata urls
+            match = index.match(lname, None)
+            layer = match[1] if match else None
+
+        return {
+            'service_type': 'wmts',
+            'layer_name': layer.name if layer else None,
+            'layer_all': index.names,
+            'title': layer.title if layer else None,
+            'abstract': layer.abstract if hasattr(layer, 'abstract') else None,
+            'bbox': layer.boundingBoxWGS84 if hasattr(layer, 'boundingBoxWGS84') else None,
+            'formats': list(layer.formats) if hasattr(layer, 'formats') else [],
+            'tilematrixsets': list(layer.tilematrixsets) if hasattr(layer, 'tilematrixsets') else [],
+            'metadata_urls': extract_metadata_urls(layer.metadataUrls) if hasattr(layer, 'metadataUrls') else []
+        }
+    except Exception as e:
+        print(f"Error getting WMTS capabilities at {url}: {e}")
+        return None
+
+
+@register_probe('wfs')
+def probe_wfs(url, lname, md_id):
+    try:
+        wfs, index = capabilities_cache.get('wfs', url, _load_streamed('wfs'))
+        if len(index) == 1:
+            feature = index.layers[0]
+        else:
+            feature = index.match(lname, md_id)
+
+        # DescribeFeatureType is an extra request per feature type, opt-in only
+        schema, schema_hash = None, None
+        if feature and schema_cache.enabled_for(url):
+            schema, schema_hash = schema_cache.get(service_url(url), feature.name)
+
+        return {
+            'service_type': 'wfs',
+            'layer_name': feature.name if feature else None,
+            'layer_all': index.names,
+            'title': feature.title if feature else None,
+            'abstract': feature.abstract if feature else None,
+            'keywords': feature.keywords if feature else [],
+            'bbox': feature.bbox if feature else None,
+            'crs4326': feature.has_crs('4326') if feature else None,
+            'crs3857': feature.has_crs('3857') if feature else None,
+            'metadata_urls': feature.metadata_urls if feature else [],
+            'schema': schema,
+            'schema_hash': schema_hash
+        }
+    except Exception as e:
+        print(f"Error getting WFS capabilities at {url}: {e}")
+        return None
+
+
+@register_probe('wcs')
+def probe_wcs(url, lname, md_id):
+    from owslib.wcs import WebCoverageService
+
+    try:
+        index = capabilities_cache.get('wcs', url, _load_owslib(WebCoverageService, version='2.0.1'))
+        if len(index) == 1:
+            coverage = index.layers[0][1]
+        else:
+            match = index.match(lname, md_id)
+            coverage = match[1] if match else None
+
+        return {
+            'service_type': 'wcs',
+            'layer_name': coverage.id if coverage else None,
+            'layer_all': index.names,
+            'title': coverage.title if coverage else None,
+            'abstract': coverage.abstract if (coverage and hasattr(coverage, 'abstract')) else None,
+            'keywords': list(coverage.keywords) if (coverage and hasattr(coverage, 'keywords')) else [],
+            'bbox': coverage.boundingBox if (coverage and hasattr(coverage, 'boundingBox')) else None,
+            'supported_formats': list(coverage.supportedFormats) if (coverage and hasattr(coverage, 'supportedFormat')) else [],
+            'metadata_urls': extract_metadata_urls(coverage.metadataUrls) if (coverage and hasattr(coverage, 'metadataUrls')) else []
+        }
+    except Exception as e:
+        print(f"Error getting WCS capabilities at {url}: {e}")
+        return None
+
+
+@register_probe('ogcapi')
+def probe_ogcapi(url, lname, md_id):
+    from owslib.ogcapi.features import Features
+
+    try:
+        lname2 = None
+        if 'collections/' in url:
+            lname2 = url.split('collections/').pop().split('/')[0].split('?')[0].split('#')[0]
+            url = url.split('collections/')[0]
+        if lname2 not in [None,'']:
+            lname = lname2
+        oaf = Features(url)
+        lyrs = oaf.collections()['collections']
+        ls_lyrs = [l['id'] for l in lyrs]
+        collection = None
+        if len(ls_lyrs) == 1:
+            collection = lyrs[0]
+        else:
+            for l in lyrs:
+                if lname not in [None, ''] and (lname == l.get('id','') or lname.lower() == l.get('title','')):
+                    collection = l
+                    break
+                # todo: check metadata link matches md_id
+        return {
+            'service_type': 'ogcapi',
+            'layer_name': collection.id if hasattr(collection, 'id') else None,
+            'layer_all': ls_lyrs,
+            'title': collection.title if hasattr(collection, 'title') else None,
+            'abstract': collection.description if hasattr(collection, 'description') else None,
+            'bbox': collection.extent if hasattr(collection, 'extent') else None,
+            'crs': collection.crs if hasattr(collection, 'crs') else None
+        }
+    except Exception as e:
+        print(f"Error getting OGC API collection at {url}: {e}")
+        return None
@@ -1,14 +1,63 @@
 import asyncio
 import aiohttp
+import time
 from datetime import datetime
 from typing import Dict, Any, Optional
-from urllib.parse import urlparse, parse_qs
 from .ogc_services import process_ogc_links
+from .service_types import detect_service_type
+from .metrics import record_check, track_request
+from .timings import empty_timings
+from .results import CheckResult, ErrorClass
+from .sniff import SNIFF_BYTES, detect_format, format_mismatch, range_header
 
 # Configuration constants
 TIMEOUT = 5
 USERAGENT = 'Soilwise Link Liveliness assessment v0.1.0'
 
+
+def _add_phase(ctx, phase, started):
+    timings = ctx.trace_request_ctx
+    if timings is not None and started is not None:
+        timings[phase] = round((timings[phase] or 0) + (time.perf_counter() - started) * 1000, 2)
+
+
+def _timing_trace_config() -> aiohttp.TraceConfig:
+    """
+    Trace hooks that record phase timings (ms) into the dict passed as
+    `trace_request_ctx`. aiohttp reports the TLS handshake as part of the
+    connection, so `connect` includes TLS and `tls` stays None.
+    """
+    async def on_dns_start(session, ctx, params):
+        ctx.dns_started = time.perf_counter()
+
+    async def on_dns_end(session, ctx, params):
+        _add_phase(ctx, 'dns', getattr(ctx, 'dns_started', None))
+        ctx.dns_ended = time.perf_counter()
+
+    async def on_connection_start(session, ctx, params):
+        ctx.connection_started = time.perf_counter()
+        ctx.dns_ended = None
+
+    async def on_connection_end(session, ctx, params):
+        # dns is resolved inside connection creation, only count what follows it
+        _add_phase(ctx, 'connect', ctx.dns_ended or getattr(ctx, 'connection_started', None))
+
+    async def on_headers_sent(session, ctx, params):
+        ctx.headers_sent = time.perf_counter()
+
+    async def on_request_end(session, ctx, params):
+        _add_phase(ctx, 'ttfb', getattr(ctx, 'headers_sent', None))
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_dns_resolvehost_start.append(on_dns_start)
+    trace_config.on_dns_resolvehost_end.append(on_dns_end)
+    trace_config.on_connection_create_start.append(on_connection_start)
+    trace_config.on_connection_create_end.append(on_connection_end)
+    trace_config.on_request_headers_sent.append(on_headers_sent)
+    trace_config.on_request_end.append(on_request_end)
+    trace_config.on_request_redirect.append(on_request_end)
+    return trace_config
+
 class AsyncURLChecker:
     """Async URL checker that handles single URL validation"""
     
@@ -22,7 +71,8 @@ class AsyncURLChecker:
         self.session = aiohttp.ClientSession(
             connector=connector,
             timeout=timeout,
-            headers={'User-Agent': USERAGENT}
+            headers={'User-Agent': USERAGENT},
+            trace_configs=[_timing_trace_config()]
         )
         return self
 
@@ -30,57 +80,65 @@ class AsyncURLChecker:
         if self.session:
             await self.session.close()
 
-    async def check_url(self, url: str, check_ogc_capabilities: bool = True) -> Dict[str, Any]:
+    async def check_url(self, url: str, check_ogc_capabilities: bool = True, deep_validation: bool = False,
+                        declared_format: Optional[str] = None) -> CheckResult:
         """
         Check a single URL asynchronously with optional OGC capabilities detection
+        and optional deep validation of the content against its declared format
         """
+        timings = empty_timings()
+        with track_request(url):
+            result = await self._check_url(url, check_ogc_capabilities, timings)
+        result.set_timings(timings)
+        record_check(result)
+        if deep_validation and result.valid:
+            result.detected_format = await self._sniff(result.final_url or url)
+            result.format_mismatch = format_mismatch(result.detected_format, result.content_type, declared_format)
+        return result
+
+    async def _sniff(self, url: str) -> Optional[str]:
+        """Format of the resource at `url` from its first bytes, None if unknown"""
+        try:
+            async with self.session.get(url, headers=range_header()) as response:
+                if response.status >= 400:
+                    return None
+                head = b''
+                async for chunk in response.content.iter_chunked(1024):
+                    head += chunk[:SNIFF_BYTES - len(head)]
+                    if len(head) >= SNIFF_BYTES:
+                        break
+                return detect_format(head)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Could not read the content of {url}: {e}")
+            return None
+
+    async def _check_url(self, url: str, check_ogc_capabilities: bool, timings: Dict[str, Any]) -> CheckResult:
+        started = time.perf_counter()
         try:
             # First try HEAD request
-            async with self.session.head(url, allow_redirects=True) as response:
+            async with self.session.head(url, allow_redirects=True, trace_request_ctx=timings) as response:
                 if response.status >= 400:
                     # If HEAD fails, try GET
-                    async with self.session.get(url, allow_redirects=True) as get_response:
+                    async with self.session.get(url, allow_redirects=True, trace_request_ctx=timings) as get_response:
                         result = await self._process_response(get_response, url)
                 else:
                     result = await self._process_response(response, url)
+            timings['total'] = round((time.perf_counter() - started) * 1000, 2)
             
             # Check OGC capabilities if requested and URL is valid
-            if check_ogc_capabilities and result['valid']:
-                ogc_capabilities = self._check_ogc_capabilities(url)
-                result['gis_capabilities'] = ogc_capabilities
-            else:
-                result['gis_capabilities'] = None
+            if check_ogc_capabilities and result.valid:
+                result.gis_capabilities = self._check_ogc_capabilities(url)
                 
             return result
                     
         except asyncio.TimeoutError:
-            return {
-                'url': url,
-                'error': 'Request timeout',
-                'status_code': None,
-                'is_redirect': None,
-                'valid': False,
-                'content_type': None,
-                'content_size': None,
-                'last_modified': None,
-                'final_url': url,
-                'gis_capabilities': None
-            }
+            timings['total'] = round((time.perf_counter() - started) * 1000, 2)
+            return CheckResult.failed(url, 'Request timeout', ErrorClass.TIMEOUT)
         except Exception as e:
-            return {
-                'url': url,
-                'error': str(e),
-                'status_code': None,
-                'is_redirect': None,
-                'valid': False,
-                'content_type': None,
-                'content_size': None,
-                'last_modified': None,
-                'final_url': url,
-                'gis_capabilities': None
-            }
-
-    async def _process_response(self, response, original_url: str) -> Dict[str, Any]:
+            timings['total'] = round((time.perf_counter() - started) * 1000, 2)
+            return CheckResult.failed(url, e)
+
+    async def _process_response(self, response, original_url: str) -> CheckResult:
         """Process HTTP response and extract relevant information"""
         content_type = response.headers.get('content-type', '').split(';')[0]
         last_modified = response.headers.get('last-modified')
@@ -94,16 +152,19 @@ class AsyncURLChecker:
             if 'bytes' in range_header and '/' in range_header:
                 content_size = int(range_header.split('/')[-1])
 
-        return {
-            'url': original_url,
-            'status_code': response.status,
-            'is_redirect': str(response.url) != original_url,
-            'valid': 200 <= response.status < 400,
-            'content_type': content_type,
-            'content_size': content_size,
-            'last_modified': last_modified,
-            'final_url': str(response.url)
-        }
+        redirect_chain = None
+        if response.history:
+            redirect_chain = [str(hop.url) for hop in response.history] + [str(response.url)]
+
+        return CheckResult(
+            original_url,
+            status_code=response.status,
+            final_url=str(response.url),
+            content_type=content_type,
+            content_size=content_size,
+            last_modified=last_modified,
+            redirect_chain=redirect_chain
+        )
 
     def _check_ogc_capabilities(self, url: str) -> Optional[Dict[str, Any]]:
         """
@@ -111,12 +172,13 @@ class AsyncURLChecker:
         """
         try:
             # Detect service type from URL
-            service_type = self._detect_service_type(url)
+            service_type = detect_service_type(url)
             
             if service_type:
                 # Use existing process_ogc_links function
-                # Pass None for layer name and metadata ID since we're just checking capabilities
-                capabilities = process_ogc_links(url, service_type, None, None)
+                # Pass None for layer name and metadata ID since we're just checking capabilities,
+                # load them fresh, the user may be re-checking a service they just fixed
+                capabilities = process_ogc_links(url, service_type, None, None, fresh=True)
                 return capabilities
             
             return None
@@ -126,46 +188,6 @@ class AsyncURLChecker:
             print(f"OGC capabilities check failed for {url}: {e}")
             return None
 
-    def _detect_service_type(self, url: str) -> Optional[str]:
-        """Detect OGC service type from URL"""
-        if not url:
-            return None
-        
-        url_lower = url.lower()
-        
-        # Check for OGC API patterns in URL
-        is_ogcapi_url = any(pattern in url_lower for pattern in [
-            '/ogc/features', '/ogcapi', '/api/features'
-        ])
-        
-        if is_ogcapi_url:
-            return 'ogcapi'
-        
-        # Check for service parameter in query string
-        parsed_url = urlparse(url)
-        query_params = parse_qs(parsed_url.query)
-        if 'service' in query_params:
-            service = query_params['service'][0].lower()
-            if service in ['wms', 'wmts', 'wfs', 'wcs']:
-                return service
-        
-        # Check URL path for service indicators
-        if '/wms' in url_lower:
-            print(f"Detected WMS service in URL: {url}")
-            return 'wms'
-        elif '/wmts' in url_lower:
-            print(f"Detected WMTS service in URL: {url}")
-            return 'wmts'
-        elif '/wfs' in url_lower:
-            print(f"Detected WFS service in URL: {url}")
-            return 'wfs'
-        elif '/wcs' in url_lower:
-            print(f"Detected WCS service in URL: {url}")
-            return 'wcs'
-        
-        # No clear indication found
-        return None
-
 
 def diagnose_link_status(result: Dict[str, Any]) -> str:
     """Provide detailed diagnosis of link issues"""
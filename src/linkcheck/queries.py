@@ -0,0 +1,152 @@
+"""Queries of the list endpoints of the API.
+
+Shared by the API and the snapshots the linkchecker task writes at the end
+of a run (snapshots.py), so both return the same rows. Queries use the
+named parameters of the databases package, `for_psycopg2` converts them.
+"""
+import re
+
+# Define status lists
+REDIRECTION_STATUSES = [301, 302, 304, 307, 308]
+CLIENT_ERROR_STATUSES = [400, 401, 403, 404, 405, 409]
+SERVER_ERROR_STATUSES = [500, 501, 503, 504]
+
+LINK_FIELDS = ['id_link', 'urlname', 'deprecated', 'consecutive_failures', 'link_type', 'link_size', 'last_modified',
+               'gis_capabilities', 'final_url', 'redirect_chain', 'detected_format', 'format_mismatch']
+STATUS_FIELDS = LINK_FIELDS + ['status_code', 'record_id', 'is_redirect', 'error_message', 'timestamp']
+
+
+def latest_status_query(schema, condition):
+    """Links with their records and latest status, where `condition` holds"""
+    return f"""
+        SELECT l.id_link, l.urlname, l.deprecated, l.consecutive_failures, l.link_type, l.link_size, l.last_modified, l.gis_capabilities, l.final_url, l.redirect_chain, l.detected_format, l.format_mismatch,
+               r.record_id, vh.status_code, vh.is_redirect, vh.error_message, vh.timestamp
+        FROM {schema}.links_with_capabilities l
+        JOIN {schema}.record_links rl ON rl.fk_link = l.id_link
+        JOIN {schema}.records r ON r.id = rl.fk_record
+        JOIN {schema}.validation_history vh ON l.id_link = vh.fk_link
+        WHERE {condition}
+        AND vh.timestamp = (
+            SELECT MAX(timestamp)
+            FROM {schema}.validation_history
+            WHERE fk_link = l.id_link
+        )
+    """
+
+
+def deprecated_query(schema):
+    return f"""
+        SELECT l.id_link, l.urlname, r.record_id, l.deprecated, l.consecutive_failures, l.link_type, l.link_size, l.last_modified, l.gis_capabilities, l.final_url, l.redirect_chain, l.detected_format, l.format_mismatch
+        FROM {schema}.links_with_capabilities l
+        JOIN {schema}.record_links rl ON rl.fk_link = l.id_link
+        JOIN {schema}.records r ON r.id = rl.fk_record
+        WHERE l.deprecated IS TRUE
+    """
+
+
+def record_status_query(schema):
+    """Links of the records `:record_ids` with their latest status, one row
+    per record and link. The records are found by their unique record_id,
+    their links through the primary key of record_links and the latest
+    status of each link through idx_validation_latest."""
+    return f"""
+        SELECT r.record_id, l.id_link, l.urlname, l.deprecated, l.consecutive_failures, l.link_type, l.link_size, l.last_modified, l.gis_capabilities, l.final_url, l.redirect_chain, l.detected_format, l.format_mismatch,
+               vh.status_code, vh.is_redirect, vh.error_message, vh.timestamp
+        FROM {schema}.records r
+        JOIN {schema}.record_links rl ON rl.fk_record = r.id
+        JOIN {schema}.links_with_capabilities l ON l.id_link = rl.fk_link
+        LEFT JOIN LATERAL (
+            SELECT status_code, is_redirect, error_message, timestamp
+            FROM {schema}.validation_history
+            WHERE fk_link = l.id_link
+            ORDER BY timestamp DESC
+            LIMIT 1
+        ) vh ON TRUE
+        WHERE r.record_id = ANY(:record_ids)
+        ORDER BY r.record_id, l.urlname
+    """
+
+
+SUMMARY_TOP_HOSTS = 20
+SUMMARY_DIMENSIONS = ('status_class', 'error_class', 'host', 'link_type', 'service_type')
+
+
+def summary_query(schema, host=None):
+    """Number of links, deprecated and timed out links by each of
+    SUMMARY_DIMENSIONS and in total, in a single pass over the latest status
+    kept in `links`; only the `:top` largest hosts, only links of `:host`
+    if `host`"""
+    condition = "WHERE host = :host" if host else ""
+    return f"""
+        SELECT dimension, value, links, deprecated, timeout
+        FROM (
+            SELECT g.*, ROW_NUMBER() OVER (PARTITION BY dimension ORDER BY links DESC, value) AS rank
+            FROM (
+                SELECT
+                    CASE
+                        WHEN GROUPING(status_class) = 0 THEN 'status_class'
+                        WHEN GROUPING(error_class) = 0 THEN 'error_class'
+                        WHEN GROUPING(host) = 0 THEN 'host'
+                        WHEN GROUPING(link_type) = 0 THEN 'link_type'
+                        WHEN GROUPING(service_type) = 0 THEN 'service_type'
+                        ELSE 'total'
+                    END AS dimension,
+                    COALESCE(status_class, error_class, host, link_type, service_type) AS value,
+                    COUNT(*) AS links,
+                    COUNT(*) FILTER (WHERE deprecated) AS deprecated,
+                    COUNT(*) FILTER (WHERE error_class = 'timeout') AS timeout
+                FROM (
+                    SELECT
+                        CASE
+                            WHEN last_status_code BETWEEN 200 AND 299 THEN 'ok'
+                            WHEN last_status_code BETWEEN 300 AND 399 THEN 'redirect'
+                            WHEN last_status_code BETWEEN 400 AND 499 THEN 'client_error'
+                            WHEN last_status_code >= 500 THEN 'server_error'
+                            WHEN last_status_code IS NULL THEN 'failed'
+                            ELSE 'other'
+                        END AS status_class,
+                        last_error_class AS error_class, host, link_type, service_type, deprecated
+                    FROM {schema}.links
+                    {condition}
+                ) l
+                GROUP BY GROUPING SETS ((status_class), (error_class), (host), (link_type), (service_type), ())
+            ) g
+        ) ranked
+        WHERE dimension <> 'host' OR rank <= :top
+        ORDER BY dimension, links DESC, value
+    """
+
+
+def summary_document(rows):
+    """The rows of summary_query as {total_links, deprecated, timeout,
+    <dimension>: {value: links}}; links without a value count as 'unknown'"""
+    document = {'total_links': 0, 'deprecated': 0, 'timeout': 0}
+    document.update((dimension, {}) for dimension in SUMMARY_DIMENSIONS)
+    for row in rows:
+        if row['dimension'] == 'total':
+            document.update(total_links=row['links'], deprecated=row['deprecated'], timeout=row['timeout'])
+        else:
+            document[row['dimension']][row['value'] or 'unknown'] = row['links']
+    return document
+
+
+# Per list endpoint: query, parameters, fields of its response model
+LISTS = {
+    'redirection': (lambda schema: latest_status_query(schema, "vh.status_code = ANY(:statuses)"),
+                    {'statuses': REDIRECTION_STATUSES}, STATUS_FIELDS),
+    'client_error': (lambda schema: latest_status_query(schema, "vh.status_code = ANY(:statuses)"),
+                     {'statuses': CLIENT_ERROR_STATUSES}, STATUS_FIELDS),
+    'server_error': (lambda schema: latest_status_query(schema, "vh.status_code = ANY(:statuses)"),
+                     {'statuses': SERVER_ERROR_STATUSES}, STATUS_FIELDS),
+    'timeout': (lambda schema: latest_status_query(
+                    schema, "(vh.error_message LIKE '%ReadTimeout%' OR vh.error_message LIKE '%ConnectTimeout%')"),
+                {}, STATUS_FIELDS),
+    'deprecated': (deprecated_query, {}, LINK_FIELDS),
+}
+
+_NAMED_PARAMETER = re.compile(r'(?<!:):(\w+)')
+
+
+def for_psycopg2(query):
+    """`query` with :name parameters as %(name)s, literal % escaped"""
+    return _NAMED_PARAMETER.sub(r'%(\1)s', query.replace('%', '%%'))
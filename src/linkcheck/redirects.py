@@ -0,0 +1,96 @@
+"""Cache of redirect hops, to resolve links to their targets without requests.
+
+DOIs, handles and http urls redirect to landing pages, and following the
+chain again on every run mostly costs requests to resolvers like doi.org.
+Every hop a check follows is cached (source url -> location). Links are
+resolved through the cached hops, before checking and again when their
+turn comes, so hops learned earlier in the run count too; links ending at
+the same target are checked once and the outcome is copied back to each of
+them.
+
+Permanent redirects (301, 308) are kept for `REDIRECT_CACHE_TTL` days, the
+linkchecker task persists them in the `redirect_cache` table. Temporary
+ones (302, 303, 307), e.g. to expiring pre-signed urls, are only used
+during the run that followed them.
+"""
+import os
+import threading
+from datetime import datetime, timedelta
+
+# Longer than the weekly interval between runs
+REDIRECT_CACHE_TTL = float(os.environ.get("REDIRECT_CACHE_TTL") or 30)
+PERMANENT_REDIRECTS = frozenset({301, 308})
+# Same limit as requests
+MAX_HOPS = 30
+
+
+class RedirectCache:
+    """Redirect hops by source url"""
+
+    def __init__(self, ttl_days=REDIRECT_CACHE_TTL):
+        self.ttl = timedelta(days=ttl_days)
+        self._hops = {}  # source url -> (target url, status code, fetched_at)
+        self._dirty = set()
+        self._persisted = set()  # sources with a permanent hop in the database
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._hops)
+
+    def add(self, chain, status_codes):
+        """Cache the hops of a followed redirect `chain` (source, ..., final url),
+        `status_codes` holds the redirect status of each hop"""
+        now = datetime.now()
+        with self._lock:
+            for source, target, status_code in zip(chain, chain[1:], status_codes):
+                if source == target:
+                    continue
+                self._hops[source] = (target, status_code, now)
+                if status_code in PERMANENT_REDIRECTS:
+                    self._dirty.add(source)
+                    self._persisted.add(source)
+                elif source in self._persisted:
+                    # no longer permanent, drop the stored hop
+                    self._dirty.add(source)
+                    self._persisted.discard(source)
+
+    def resolve(self, url):
+        """The chain (url, ..., target) of `url` through unexpired cached hops"""
+        chain = [url]
+        expired = datetime.now() - self.ttl
+        with self._lock:
+            while len(chain) <= MAX_HOPS:
+                hop = self._hops.get(chain[-1])
+                if hop is None or hop[2] < expired or hop[0] in chain:
+                    break
+                chain.append(hop[0])
+        return chain
+
+    def invalidate(self, chain):
+        """Forget the hops of `chain`, e.g. when its target turned out broken"""
+        with self._lock:
+            for source in chain[:-1]:
+                self._hops.pop(source, None)
+                if source in self._persisted:
+                    self._dirty.add(source)
+                    self._persisted.discard(source)
+
+    def load(self, entries):
+        """Fill the cache from (source_url, target_url, status_code, fetched_at) rows"""
+        with self._lock:
+            for source, target, status_code, fetched_at in entries:
+                self._hops[source] = (target, status_code, fetched_at)
+                self._persisted.add(source)
+
+    def changed(self):
+        """(source_url, target_url, status_code, fetched_at) rows of the
+        permanent hops added since the last call, target None for stored hops
+        that were invalidated or became temporary"""
+        with self._lock:
+            rows = [(source,) + (self._hops[source] if source in self._persisted else (None, None, None))
+                    for source in self._dirty]
+            self._dirty.clear()
+        return rows
+
+
+redirect_cache = RedirectCache()
@@ -0,0 +1,229 @@
+"""Compact result records of link checks.
+
+A run keeps a result per link in memory, at millions of links a dict per
+result dominates the memory use of the worker. `CheckResult` stores the
+same information in a slotted object with shared values: status codes and
+content types are interned, the error is classified into an `ErrorClass`
+and timings a float32 array. `as_dict()` gives the dict shape used for storage
+and API responses.
+"""
+import math
+import re
+import sys
+from array import array
+from enum import IntEnum
+
+# Phases of the timings tuple, see timings.py
+TIMING_PHASES = ('dns', 'connect', 'tls', 'ttfb', 'total')
+
+# One shared int object per status code
+_STATUS_CODES = {code: code for code in range(100, 600)}
+
+
+class ErrorClass(IntEnum):
+    NONE = 0
+    TIMEOUT = 1
+    CONNECTION = 2
+    DNS = 3
+    SSL = 4
+    HTTP = 5  # the server responded with a 4xx/5xx status
+    OTHER = 6
+    HOST_UNREACHABLE = 7  # skipped, the circuit of the host is open (circuit_breaker.py)
+
+
+# Exception classes by exact name, so results.py does not import requests,
+# urllib3 or aiohttp, and as subclassing does not follow the categories
+# (urllib3's NewConnectionError is a ConnectTimeoutError, requests'
+# ConnectTimeout a ConnectionError). The first category with a class in the
+# error, its cause or the error it wraps decides.
+_ERROR_TYPES = (
+    (ErrorClass.TIMEOUT, {'ConnectTimeout', 'ConnectTimeoutError', 'ReadTimeout', 'ReadTimeoutError',
+                          'ServerTimeoutError', 'TimeoutError', 'timeout'}),
+    (ErrorClass.DNS, {'NameResolutionError', 'gaierror', 'ClientConnectorDNSError'}),
+    (ErrorClass.SSL, {'SSLError', 'ClientSSLError', 'CertificateError', 'SSLCertVerificationError',
+                      'ClientConnectorSSLError', 'ClientConnectorCertificateError'}),
+    (ErrorClass.CONNECTION, {'NewConnectionError', 'ConnectionRefusedError', 'ConnectionResetError',
+                             'ConnectionAbortedError', 'ProtocolError', 'ClientConnectorError',
+                             'ServerDisconnectedError', 'ClientOSError'}),
+)
+# Parts of requests and urllib3 messages that name the host or pool, and
+# would otherwise match the patterns below
+_MESSAGE_NOISE = re.compile(r"https?://\S+|\w*connectionpool\([^)]*\)|host='[^']*'|host=\S+")
+
+
+def _error_chain(error):
+    """`error` and the errors it was raised from or wraps, outermost first"""
+    chain, pending = [], [error]
+    while pending:
+        e = pending.pop(0)
+        if not isinstance(e, BaseException) or any(e is seen for seen in chain):
+            continue
+        chain.append(e)
+        # requests wraps urllib3's MaxRetryError, which keeps the cause as reason
+        pending.extend([getattr(e, 'reason', None), e.__cause__, e.__context__] + list(e.args[:1]))
+    return chain
+
+
+def _classify_message(text):
+    text = _MESSAGE_NOISE.sub('', text.lower())
+    if 'timeout' in text or 'timed out' in text:
+        return ErrorClass.TIMEOUT
+    if re.search(r'\bssl\b|certificate', text):
+        return ErrorClass.SSL
+    if re.search(r'failed to resolve|name resolution|name or service not known|nodename nor servname'
+                 r'|getaddrinfo|\bdns\b', text):
+        return ErrorClass.DNS
+    if re.search(r'connection (refused|reset|aborted)|failed to establish|cannot connect|connect call failed', text):
+        return ErrorClass.CONNECTION
+    return ErrorClass.OTHER
+
+
+def classify_error(error):
+    """ErrorClass of an exception raised by requests, urllib3 or aiohttp, by
+    its type and those of its causes; by its message for other exceptions
+    and for error messages"""
+    if isinstance(error, BaseException):
+        names = {type(e).__name__ for e in _error_chain(error)}
+        for error_class, types in _ERROR_TYPES:
+            if names & types:
+                return error_class
+        return _classify_message(f"{type(error).__name__} {error}")
+    return _classify_message(str(error))
+
+
+class CheckResult:
+    """Outcome of checking a single url"""
+    __slots__ = ('url', 'status_code', 'final_url', 'content_type', 'content_size', 'last_modified',
+                 'error', 'error_class', 'timings', 'gis_capabilities', 'retry_after',
+                 'redirect_chain', 'detected_format', 'format_mismatch')
+
+    def __init__(self, url, status_code=None, final_url=None, content_type=None, content_size=None,
+                 last_modified=None, error=None, error_class=None, timings=None, gis_capabilities=None,
+                 retry_after=None, redirect_chain=None, detected_format=None, format_mismatch=None):
+        self.url = url
+        self.status_code = _STATUS_CODES.get(status_code, status_code)
+        # Only kept when it differs from url, saves a string per result
+        self.final_url = final_url if final_url != url else None
+        self.content_type = sys.intern(content_type) if content_type else None
+        self.content_size = content_size
+        self.last_modified = last_modified
+        self.error = error
+        if error_class is None:
+            if error is not None:
+                error_class = classify_error(error)
+            elif self.status_code is not None and self.status_code >= 400:
+                error_class = ErrorClass.HTTP
+            else:
+                error_class = ErrorClass.NONE
+        self.error_class = error_class
+        self.timings = timings
+        self.gis_capabilities = gis_capabilities
+        # seconds the server asked to wait before trying again (retry.py)
+        self.retry_after = retry_after
+        # urls from url to final_url, only kept for redirects
+        self.redirect_chain = tuple(redirect_chain) if redirect_chain and len(redirect_chain) > 1 else None
+        # format sniffed from the content by deep validation (sniff.py)
+        self.detected_format = detected_format
+        self.format_mismatch = format_mismatch
+
+    @classmethod
+    def failed(cls, url, error, error_class=None):
+        """Result of a check that got no response"""
+        return cls(url, error=str(error), error_class=error_class or classify_error(error))
+
+    def redirected_from(self, url, hops):
+        """This result as result of `url`, which redirects to our url through
+        the urls `hops` (starting with `url`)"""
+        if url == self.url:
+            return self
+        chain = list(hops) + list(self.redirect_chain or (self.url,))
+        return CheckResult(
+            url,
+            status_code=self.status_code,
+            final_url=self.final_url or self.url,
+            content_type=self.content_type,
+            content_size=self.content_size,
+            last_modified=self.last_modified,
+            error=self.error,
+            error_class=self.error_class,
+            timings=self.timings,
+            retry_after=self.retry_after,
+            redirect_chain=chain,
+            detected_format=self.detected_format,
+            format_mismatch=self.format_mismatch
+        )
+
+    def at_final_url(self):
+        """This result as result of checking its final url"""
+        if self.final_url is None:
+            return self
+        return CheckResult(
+            self.final_url,
+            status_code=self.status_code,
+            content_type=self.content_type,
+            content_size=self.content_size,
+            last_modified=self.last_modified,
+            error=self.error,
+            error_class=self.error_class,
+            timings=self.timings,
+            retry_after=self.retry_after,
+            detected_format=self.detected_format,
+            format_mismatch=self.format_mismatch
+        )
+
+    @property
+    def valid(self):
+        return self.status_code is not None and 200 <= self.status_code < 400
+
+    @property
+    def is_redirect(self):
+        if self.status_code is None:
+            return None
+        return self.final_url is not None
+
+    def set_timings(self, timings):
+        """Store a timings dict (see timings.py), unset phases as nan"""
+        if not timings:
+            self.timings = None
+            return
+        self.timings = array('f', (math.nan if timings.get(phase) is None else timings[phase] for phase in TIMING_PHASES))
+
+    def timings_dict(self):
+        if self.timings is None:
+            return None
+        return {phase: None if math.isnan(value) else round(value, 2) for phase, value in zip(TIMING_PHASES, self.timings)}
+
+    def as_dict(self):
+        """The result as dict, in the shape insert_or_update_link and the API expect"""
+        result = {
+            'url': self.url,
+            'status_code': self.status_code,
+            'is_redirect': self.is_redirect,
+            'valid': self.valid,
+            'content_type': self.content_type,
+            'content_size': self.content_size,
+            'last_modified': self.last_modified,
+            'final_url': self.final_url or self.url,
+            'redirect_chain': list(self.redirect_chain) if self.redirect_chain else None,
+            'error_class': self.error_class.name.lower(),
+            'timings': self.timings_dict(),
+            'detected_format': self.detected_format,
+            'format_mismatch': self.format_mismatch,
+            'gis_capabilities': self.gis_capabilities
+        }
+        if self.error is not None:
+            result['error'] = self.error
+        return result
+
+
+class LinkSource:
+    """A link to check, with the distribution it was found in"""
+    __slots__ = ('record_id', 'name', 'url', 'protocol', 'service_type', 'capabilities')
+
+    def __init__(self, record_id, name, url, protocol, service_type=None, capabilities=None):
+        self.record_id = record_id
+        self.name = name
+        self.url = url
+        self.protocol = protocol
+        self.service_type = service_type
+        self.capabilities = capabilities
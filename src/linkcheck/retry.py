@@ -0,0 +1,95 @@
+"""Deferred retries of transient failures of the linkchecker task.
+
+A timeout or 503 of a busy but healthy service would otherwise count as a
+failure towards deprecating the link. Retrying inline slows the sweep down,
+so transient failures are checked again in passes after the sweep, each
+after a jittered exponential backoff (at least the `Retry-After` the server
+asked for). The number of retries of a run is capped by a global budget.
+"""
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+
+try:
+    from .results import ErrorClass
+except ImportError:
+    from results import ErrorClass
+
+# Passes over the transient failures after the sweep, 0 disables retries
+RETRY_ATTEMPTS = int(os.environ.get("RETRY_ATTEMPTS") or 2)
+# Maximum number of retries of a run
+RETRY_BUDGET = int(os.environ.get("RETRY_BUDGET") or 500)
+# Base of the exponential backoff and upper bound of a delay, in seconds
+RETRY_BACKOFF = float(os.environ.get("RETRY_BACKOFF") or 2)
+RETRY_MAX_DELAY = float(os.environ.get("RETRY_MAX_DELAY") or 120)
+
+RETRY_STATUSES = {429, 502, 503, 504}
+# Statuses whose Retry-After header is honoured
+RETRY_AFTER_STATUSES = {429, 503}
+_RESET_ERRORS = ('reset', 'remotedisconnected', 'connection aborted', 'broken pipe')
+
+
+def is_transient(result):
+    """True if the failure of `result` may well pass on a later try"""
+    if result.status_code is not None:
+        return result.status_code in RETRY_STATUSES
+    if result.error_class == ErrorClass.TIMEOUT:
+        return True
+    if result.error_class == ErrorClass.CONNECTION:
+        error = (result.error or '').lower()
+        return any(reset in error for reset in _RESET_ERRORS)
+    return False
+
+
+def parse_retry_after(value):
+    """Seconds to wait according to a Retry-After header (delay or http date), or None"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class RetryPolicy:
+    """Backoff and the global retry budget of a run"""
+
+    def __init__(self, attempts=RETRY_ATTEMPTS, budget=RETRY_BUDGET, backoff=RETRY_BACKOFF, max_delay=RETRY_MAX_DELAY):
+        self.attempts = attempts
+        self.budget = budget
+        self.backoff = backoff
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+
+    def delay(self, attempt, retry_after=None):
+        """Seconds to wait before retry `attempt` (1 based), None if the
+        server asked to wait longer than `max_delay`"""
+        if retry_after is not None and retry_after > self.max_delay:
+            return None
+        # full jitter, spreads the retries of links on the same host
+        delay = random.uniform(0, min(self.max_delay, self.backoff * 2 ** attempt))
+        return max(delay, retry_after or 0)
+
+    def take(self):
+        """Use one retry of the budget, False once it is spent"""
+        with self._lock:
+            if self.budget <= 0:
+                return False
+            self.budget -= 1
+            return True
+
+
+def wait_until(due):
+    """Sleep until time.monotonic() reaches `due`"""
+    remaining = due - time.monotonic()
+    if remaining > 0:
+        time.sleep(remaining)
@@ -0,0 +1,64 @@
+"""Detection of the OGC service type behind a link.
+
+Kept free of heavy imports, it is used on every link by both the
+linkchecker task and the on-demand checker.
+"""
+from urllib.parse import urlsplit, parse_qs
+
+SERVICE_TYPES = ('wms', 'wmts', 'wfs', 'wcs', 'ogcapi')
+
+OGCAPI_PATTERNS = ('/ogc/features', '/ogcapi', '/api/features')
+
+PROTOCOL_HINTS = (('wms', 'wms'), ('wmts', 'wmts'), ('wfs', 'wfs'), ('wcs', 'wcs'), ('ows', 'wms'))
+PATH_HINTS = ('wms', 'wmts', 'wfs', 'wcs')
+
+
+def detect_service_type(url, protocol=None):
+    """Detect the OGC service type of a url, optionally using the protocol
+    (or format) the metadata declares for it.
+
+    Returns one of SERVICE_TYPES or None if there is no clear indication.
+    """
+    if not url:
+        return None
+
+    url_lower = url.lower()
+
+    # Check for OGC API patterns in URL
+    is_ogcapi_url = any(pattern in url_lower for pattern in OGCAPI_PATTERNS)
+
+    # First check protocol if provided otherwise check URL
+    if protocol:
+        protocol_lower = protocol.lower()
+
+        # Direct OGC API protocol
+        if 'ogc api' in protocol_lower:
+            return 'ogcapi'
+
+        # Protocol specifies WFS but URL suggests OGC API
+        if 'wfs' in protocol_lower and is_ogcapi_url:
+            print(f"URL suggests OGCAPI but protocol says WFS, using 'ogcapi' instead for: {url}")
+            return 'ogcapi'
+
+        # Standard OGC service types, OWS defaults to WMS
+        for hint, service_type in PROTOCOL_HINTS:
+            if hint in protocol_lower:
+                return service_type
+
+    if is_ogcapi_url:
+        return 'ogcapi'
+
+    # Check for service parameter in query string
+    if 'service=' in url_lower:
+        query_params = parse_qs(urlsplit(url_lower).query)
+        service = query_params.get('service', [None])[0]
+        if service in PATH_HINTS:
+            return service
+
+    # Check URL path for service indicators
+    for service_type in PATH_HINTS:
+        if '/' + service_type in url_lower:
+            return service_type
+
+    # No clear indication found
+    return None
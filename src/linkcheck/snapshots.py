@@ -0,0 +1,180 @@
+"""Static snapshots of the list endpoints and the summary of a run.
+
+The list endpoints return the same rows until the next run, so as its last
+step the linkchecker task writes each of them (see queries.py) and the
+summary to `SNAPSHOT_DIR`, as `<name>.json` and `<name>.json.gz`. Files are
+written to a temporary name and moved in place, readers never see a
+partial snapshot; `manifest.json`, which names the run, is replaced last
+and removed when the next run starts. The API serves the files while the
+manifest belongs to the latest finished run it knows of and is younger than
+`SNAPSHOT_MAX_AGE` hours, and queries the database otherwise.
+"""
+import gzip
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+
+try:
+    from .queries import LISTS, SUMMARY_TOP_HOSTS, for_psycopg2, summary_document, summary_query
+except ImportError:
+    from queries import LISTS, SUMMARY_TOP_HOSTS, for_psycopg2, summary_document, summary_query
+
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR")
+# Weekly runs, a snapshot older than this belongs to a run that did not finish
+SNAPSHOT_MAX_AGE = float(os.environ.get("SNAPSHOT_MAX_AGE") or 8 * 24)
+MANIFEST = 'manifest.json'
+SUMMARY = 'summary'
+FETCH_SIZE = 5000
+_manifest = (None, None)
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+class _AtomicWriter:
+    """Writes `name` and `name.gz` under temporary names, moved in place on commit"""
+
+    def __init__(self, directory, name):
+        self.paths = [os.path.join(directory, name), os.path.join(directory, name + '.gz')]
+        self._files = []
+        for path in self.paths:
+            fd, tmp = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path), suffix='.tmp')
+            self._files.append((os.fdopen(fd, 'wb'), tmp))
+        raw, gz = self._files[0][0], self._files[1][0]
+        self._gzip = gzip.GzipFile(fileobj=gz, mode='wb', mtime=0)
+        self._outputs = (raw, self._gzip)
+
+    def write(self, text):
+        data = text.encode('utf-8')
+        for output in self._outputs:
+            output.write(data)
+
+    def commit(self):
+        self._gzip.close()
+        for (f, tmp), path in zip(self._files, self.paths):
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, path)
+
+    def abort(self):
+        for f, tmp in self._files:
+            f.close()
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+
+def write_json(directory, name, document):
+    writer = _AtomicWriter(directory, name)
+    try:
+        writer.write(json.dumps(document, default=_default))
+        writer.commit()
+    except BaseException:
+        writer.abort()
+        raise
+
+
+def write_list(conn, directory, name, schema='public'):
+    """Stream the rows of list `name` into its snapshot, returns the number of rows"""
+    query, values, fields = LISTS[name]
+    writer = _AtomicWriter(directory, name + '.json')
+    count = 0
+    try:
+        with conn.cursor(name=f'snapshot_{name}') as cur:
+            cur.itersize = FETCH_SIZE
+            cur.execute(for_psycopg2(query(schema)), values)
+            columns = [column.name for column in cur.description]
+            writer.write('[')
+            for row in cur:
+                record = dict(zip(columns, row))
+                writer.write((',' if count else '') + json.dumps({field: record.get(field) for field in fields}, default=_default))
+                count += 1
+            writer.write(']')
+        writer.commit()
+    except BaseException:
+        writer.abort()
+        raise
+    return count
+
+
+def summary(conn, schema='public'):
+    """The summary of all links, with the default number of hosts"""
+    with conn.cursor() as cur:
+        cur.execute(for_psycopg2(summary_query(schema)), {'top': SUMMARY_TOP_HOSTS})
+        columns = [column.name for column in cur.description]
+        return summary_document(dict(zip(columns, row)) for row in cur.fetchall())
+
+
+def invalidate_snapshots(directory=SNAPSHOT_DIR):
+    """Stop serving the snapshots of the previous run, called when a run starts"""
+    if not directory:
+        return
+    try:
+        os.remove(os.path.join(directory, MANIFEST))
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        print(f"Could not invalidate snapshots: {e}")
+
+
+def write_snapshots(conn, run_id=None, directory=SNAPSHOT_DIR, schema='public'):
+    """Write the snapshots of all lists, the summary and the manifest of run `run_id`"""
+    if not directory:
+        return None
+    os.makedirs(directory, exist_ok=True)
+    started = time.time()
+    counts = {name: write_list(conn, directory, name, schema) for name in LISTS}
+    generated_at = datetime.now()
+    document = summary(conn, schema)
+    document['generated_at'] = generated_at
+    write_json(directory, SUMMARY + '.json', document)
+    conn.commit()
+    # last, it marks the snapshots as complete
+    write_json(directory, MANIFEST, {'run': run_id, 'generated_at': generated_at, 'counts': counts})
+    print(f"Wrote snapshots of {len(counts)} lists to {directory} in {time.time() - started:.2f} seconds")
+    return counts
+
+
+def manifest(directory=SNAPSHOT_DIR):
+    """(manifest, modification time) of the snapshots, None if there are none;
+    read again only when the file changed"""
+    global _manifest
+    path = os.path.join(directory, MANIFEST)
+    try:
+        mtime = os.stat(path).st_mtime
+        key = (path, mtime)
+        if _manifest[0] != key:
+            with open(path, encoding='utf-8') as f:
+                _manifest = (key, json.load(f))
+    except (OSError, ValueError):
+        return None
+    return _manifest[1], mtime
+
+
+def snapshot_file(name, accept_encoding='', directory=SNAPSHOT_DIR, max_age=SNAPSHOT_MAX_AGE, run=None):
+    """(path, content encoding) of the snapshot of `name` if it is fresh,
+    the gzip file when the client accepts it; None otherwise. With `run`,
+    the latest finished run, the snapshots of an earlier run are stale."""
+    if not directory:
+        return None
+    current = manifest(directory)
+    if current is None:
+        return None
+    document, mtime = current
+    if time.time() - mtime > max_age * 3600:
+        return None
+    # the index may not have seen the run that wrote the snapshots yet
+    if run is not None and (document.get('run') or 0) < run:
+        return None
+    path = os.path.join(directory, name + '.json')
+    if 'gzip' in (accept_encoding or '') and os.path.exists(path + '.gz'):
+        return path + '.gz', 'gzip'
+    if os.path.exists(path):
+        return path, None
+    return None
@@ -0,0 +1,119 @@
+"""Detection of the actual format of a resource from its first bytes.
+
+A link declared as GeoPackage that serves an html login page still answers
+200. With deep validation enabled (`DEEP_VALIDATION=true`, or per on-demand
+check) the first `SNIFF_BYTES` of a resource are requested with a Range
+header (servers ignoring it are cut off after that many bytes), the format
+is detected from magic bytes and compared with the content-type header and
+the format declared by the distribution.
+"""
+import os
+import struct
+
+DEEP_VALIDATION = (os.environ.get("DEEP_VALIDATION") or "false").lower() == "true"
+# Hard cap of the bytes read per link
+SNIFF_BYTES = min(int(os.environ.get("SNIFF_BYTES") or 8192), 65536)
+
+# GeoTIFF tags: ModelPixelScale, ModelTiepoint, ModelTransformation, GeoKeyDirectory
+GEOTIFF_TAGS = {33550, 33922, 34264, 34735}
+EXCEPTION_ROOTS = (b'<serviceexceptionreport', b'<ows:exceptionreport', b'<exceptionreport', b'<ows2:exceptionreport')
+
+# Per detected format: terms of content types and declared formats it satisfies
+FORMAT_TERMS = {
+    'zip': ('zip', 'shapefile', 'shp', 'kmz', 'x-compressed'),
+    'geotiff': ('tif', 'geotiff'),
+    'tiff': ('tif',),
+    'gpkg': ('geopackage', 'gpkg', 'sqlite'),
+    'sqlite': ('sqlite',),
+    'pdf': ('pdf',),
+    'html': ('html', 'landing', 'web page', 'webpage'),
+    'xml': ('xml', 'gml', 'ogc:', 'wms', 'wfs', 'wcs', 'wmts', 'csw', 'kml', 'atom', 'rss'),
+    'json': ('json',),
+    'gzip': ('gz',),
+}
+
+
+def _tiff_format(head):
+    """'geotiff' if the first IFD in `head` holds GeoTIFF tags, else 'tiff'"""
+    order = '<' if head[:2] == b'II' else '>'
+    try:
+        (offset,) = struct.unpack_from(order + 'I', head, 4)
+        (count,) = struct.unpack_from(order + 'H', head, offset)
+        for i in range(count):
+            (tag,) = struct.unpack_from(order + 'H', head, offset + 2 + i * 12)
+            if tag in GEOTIFF_TAGS:
+                return 'geotiff'
+    except struct.error:
+        # ifd beyond the bytes read, or BigTIFF
+        pass
+    return 'tiff'
+
+
+def detect_format(head):
+    """Format of a resource starting with the bytes `head`, None if unknown"""
+    if not head:
+        return None
+    if head[:4] in (b'PK\x03\x04', b'PK\x05\x06', b'PK\x07\x08'):
+        return 'zip'
+    if head[:4] in (b'II*\x00', b'MM\x00*', b'II+\x00', b'MM\x00+'):
+        return _tiff_format(head)
+    if head.startswith(b'SQLite format 3\x00'):
+        # application_id of the database header
+        return 'gpkg' if head[68:72] in (b'GPKG', b'GP10', b'GP11') else 'sqlite'
+    if head.startswith(b'%PDF-'):
+        return 'pdf'
+    if head[:2] == b'\x1f\x8b':
+        return 'gzip'
+
+    text = head.lstrip(b'\xef\xbb\xbf \t\r\n').lower()
+    if text[:1] in (b'{', b'['):
+        return 'json'
+    if text[:1] == b'<':
+        if text.startswith((b'<!doctype html', b'<html')) or b'<html' in text[:1024]:
+            return 'html'
+        if any(root in text for root in EXCEPTION_ROOTS):
+            return 'ogc-exception'
+        return 'xml'
+    return None
+
+
+def _formats_of(text):
+    """Detected formats a content type or declared format allows, None if it says nothing"""
+    if not text:
+        return None
+    text = text.lower()
+    formats = {fmt for fmt, terms in FORMAT_TERMS.items() if any(term in text for term in terms)}
+    return formats or None
+
+
+def format_mismatch(detected, content_type=None, declared=None):
+    """Description of how the detected format contradicts the content-type
+    header or declared format, None if it does not (or can not be told)"""
+    if detected is None:
+        return None
+    if detected == 'ogc-exception':
+        return 'content is an OGC exception report'
+    problems = []
+    allowed = _formats_of(content_type)
+    if allowed is not None and detected not in allowed:
+        problems.append(f"content-type is {content_type}")
+    allowed = _formats_of(declared)
+    if allowed is not None and detected not in allowed:
+        problems.append(f"declared format is {declared}")
+    if not problems:
+        return None
+    return f"content is {detected}, but " + ' and '.join(problems)
+
+
+def read_head(chunks, limit=SNIFF_BYTES):
+    """The first `limit` bytes of an iterable of byte chunks"""
+    head = b''
+    for chunk in chunks:
+        head += chunk[:limit - len(head)]
+        if len(head) >= limit:
+            break
+    return head
+
+
+def range_header(limit=SNIFF_BYTES):
+    return {'Range': f'bytes=0-{limit - 1}'}
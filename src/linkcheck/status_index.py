@@ -0,0 +1,312 @@
+"""In-memory index of the latest status of every link, for the API.
+
+`/latest_status` is answered from memory instead of Postgres, as are
+`/status` for unknown urls and `/status?brief=true`. The index holds no
+per-link objects. Links are kept in parallel arrays sorted by a 64 bit hash
+of their canonical url, and a lookup is a binary search. Per link it stores:
+
+    key          8 bytes   blake2b hash of the canonical url (`url_key`)
+    id_link      4 bytes
+    status_code  2 bytes   -1 if the check got no response
+    error_class  1 byte    ErrorClass, 255 if unknown
+    deprecated   1 byte
+    last_checked 4 bytes   epoch seconds, 0 if never checked
+    records      8 bytes   start and length of its slice of the record positions
+    urlname      8 bytes   start and length of its slice of the urlnames
+
+The urlnames, the urls as checked, are stored utf-8 encoded one after the
+other. A lookup compares the url with the canonical form of the urlname,
+so urls sharing a hash are told apart.
+The record positions take 4 bytes per record of a link, each the position
+of a record_id in one list of the record_ids. That is 38 bytes per link
+plus its urlname, 4 per record link and about 120 bytes per record.
+benchmarks/status_index_memory.py loads 1M links with 46 byte urls, of 500k
+records, in about 13 seconds (4 of them sorting) into about 150 MB, with a
+peak of about 235 MB while loading. A lookup takes about 9 microseconds,
+merging 1000 new links about 50 milliseconds.
+
+The index is loaded at startup from the latest status the linkchecker task
+keeps on `links`. Every `STATUS_INDEX_REFRESH` seconds, links checked after
+the newest `last_checked` seen are merged in. A finished run (a new row in
+`runs` with `finished_at` set) triggers a full reload, which drops links
+that are no longer in the catalogue. Sorting and merging run in a thread,
+lookups keep using the current arrays until the new ones are swapped in.
+A link whose records or urlname changed gets a new slice; once such unused
+slices take half of the storage it is compacted.
+"""
+import asyncio
+import hashlib
+import os
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+
+try:
+    from .canonical import canonicalize_url
+    from .results import ErrorClass
+except ImportError:
+    from canonical import canonicalize_url
+    from results import ErrorClass
+
+# Seconds between refreshes, 0 disables the index
+STATUS_INDEX_REFRESH = float(os.environ.get("STATUS_INDEX_REFRESH") or 60)
+
+NO_STATUS = -1
+NO_ERROR_CLASS = 255
+_TYPECODES = ('q', 'i', 'h', 'B', 'B', 'I', 'I', 'I', 'I', 'I')
+KEY, ID_LINK, STATUS_CODE, ERROR_CLASS, DEPRECATED, LAST_CHECKED, RECORDS, RECORD_COUNT, URL, URL_LENGTH = range(10)
+_ERROR_CLASSES = {error_class.name.lower(): int(error_class) for error_class in ErrorClass}
+
+
+def url_key(url):
+    """Signed 64 bit hash of a canonical url"""
+    return int.from_bytes(hashlib.blake2b(url.encode('utf-8'), digest_size=8).digest(), 'little', signed=True)
+
+
+def index_query(schema, since=False):
+    """Latest status of all links, of those checked since `:since` if `since`"""
+    condition = "WHERE last_checked >= :since" if since else ""
+    return f"""
+        SELECT urlname, url_key, id_link, last_status_code, last_error_class, deprecated, last_checked,
+               ARRAY(
+                   SELECT r.record_id
+                   FROM {schema}.record_links rl
+                   JOIN {schema}.records r ON r.id = rl.fk_record
+                   WHERE rl.fk_link = l.id_link
+               ) AS record_ids
+        FROM {schema}.links l
+        {condition}
+    """
+
+
+def last_run_query(schema):
+    return f"SELECT MAX(id) AS run FROM {schema}.runs WHERE finished_at IS NOT NULL"
+
+
+def _empty():
+    return tuple(array(typecode) for typecode in _TYPECODES)
+
+
+def _canonical(row):
+    return row['url_key']
+
+
+class _Strings:
+    """The urlnames and record_ids the columns refer to by slices: urlnames
+    utf-8 encoded in `urls`, records as positions in `record_ids`. `garbage`
+    counts the bytes of slices no link refers to any more."""
+
+    def __init__(self):
+        self.urls = bytearray()
+        self.record_ids = []
+        self._positions = {}
+        self.records = array('I')
+        self.garbage = 0
+
+    @property
+    def size(self):
+        return len(self.urls) + self.records.itemsize * len(self.records)
+
+    def add_url(self, url):
+        """(start, length) of a new slice holding `url`"""
+        data = url.encode('utf-8')
+        start = len(self.urls)
+        self.urls += data
+        return start, len(data)
+
+    def url(self, start, length):
+        return self.urls[start:start + length].decode('utf-8')
+
+    def add_records(self, record_ids):
+        """(start, length) of a new slice of `record_ids`"""
+        start = len(self.records)
+        for record_id in record_ids or ():
+            position = self._positions.get(record_id)
+            if position is None:
+                position = self._positions[record_id] = len(self.record_ids)
+                self.record_ids.append(record_id)
+            self.records.append(position)
+        return start, len(self.records) - start
+
+    def records_of(self, start, length):
+        return [self.record_ids[position] for position in self.records[start:start + length]]
+
+
+def _status(row):
+    checked = row['last_checked']
+    return (
+        row['id_link'],
+        NO_STATUS if row['last_status_code'] is None else row['last_status_code'],
+        _ERROR_CLASSES.get(row['last_error_class'], NO_ERROR_CLASS),
+        1 if row['deprecated'] else 0,
+        int(checked.timestamp()) if checked else 0,
+    )
+
+
+def _append(columns, strings, row):
+    values = (url_key(_canonical(row)),) + _status(row) + strings.add_records(row['record_ids']) + strings.add_url(row['urlname'])
+    for column, value in zip(columns, values):
+        column.append(value)
+
+
+def _sorted(columns):
+    keys = columns[KEY]
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+    return tuple(array(column.typecode, map(column.__getitem__, order)) for column in columns)
+
+
+def _merged(columns, added):
+    """`columns` with the sorted `added` merged in, copied in slices"""
+    cuts = [bisect_left(columns[KEY], key) for key in added[KEY]]
+    merged = []
+    for column, new in zip(columns, added):
+        result = array(column.typecode)
+        previous = 0
+        for cut, value in zip(cuts, new):
+            result += column[previous:cut]
+            result.append(value)
+            previous = cut
+        result += column[previous:]
+        merged.append(result)
+    return tuple(merged)
+
+
+def _compacted(columns, strings):
+    """`columns` and `strings` without the slices no link refers to"""
+    fresh = _Strings()
+    records, record_counts, urls, url_lengths = (array(columns[i].typecode) for i in (RECORDS, RECORD_COUNT, URL, URL_LENGTH))
+    for start, count, url, length in zip(columns[RECORDS], columns[RECORD_COUNT], columns[URL], columns[URL_LENGTH]):
+        start, count = fresh.add_records(strings.records_of(start, count))
+        records.append(start)
+        record_counts.append(count)
+        urls.append(len(fresh.urls))
+        url_lengths.append(length)
+        fresh.urls += strings.urls[url:url + length]
+    columns = list(columns)
+    columns[RECORDS], columns[RECORD_COUNT], columns[URL], columns[URL_LENGTH] = records, record_counts, urls, url_lengths
+    return tuple(columns), fresh
+
+
+def _newest(watermark, row):
+    checked = row['last_checked']
+    return checked if checked and (watermark is None or checked > watermark) else watermark
+
+
+class StatusIndex:
+    """Latest status of links by url, see the module docstring"""
+
+    def __init__(self):
+        self._columns = None
+        self._strings = _Strings()
+        self.run = None
+        self.watermark = None
+
+    @property
+    def loaded(self):
+        return self._columns is not None
+
+    def __len__(self):
+        return len(self._columns[KEY]) if self._columns else 0
+
+    def _position(self, url):
+        """Position of the link with the canonical `url`, None if there is none"""
+        columns = self._columns
+        keys = columns[KEY]
+        key = url_key(url)
+        i = bisect_left(keys, key)
+        while i < len(keys) and keys[i] == key:
+            urlname = self._strings.url(columns[URL][i], columns[URL_LENGTH][i])
+            if urlname == url or canonicalize_url(urlname) == url:
+                return i
+            i += 1
+        return None
+
+    def lookup(self, url):
+        """Latest status of the canonical `url`, None if it is not known"""
+        if self._columns is None:
+            return None
+        i = self._position(url)
+        if i is None:
+            return None
+        (_, id_link, status_code, error_class, deprecated, checked,
+         records, record_count, urlname, length) = (column[i] for column in self._columns)
+        status_code = None if status_code == NO_STATUS else status_code
+        return {
+            'urlname': self._strings.url(urlname, length),
+            'id_link': id_link,
+            'status_code': status_code,
+            'valid': status_code is not None and 200 <= status_code < 400,
+            'error_class': None if error_class == NO_ERROR_CLASS else ErrorClass(error_class).name.lower(),
+            'deprecated': bool(deprecated),
+            'last_checked': datetime.fromtimestamp(checked) if checked else None,
+            'record_ids': self._strings.records_of(records, record_count),
+        }
+
+    def _apply(self, rows):
+        """Update the links of `rows` that are in the index in place, returns
+        the others as sorted columns to merge in"""
+        columns, strings = self._columns, self._strings
+        added = _empty()
+        for row in rows:
+            self.watermark = _newest(self.watermark, row)
+            i = self._position(_canonical(row))
+            if i is None:
+                _append(added, strings, row)
+                continue
+            for column, value in zip(columns[ID_LINK:RECORDS], _status(row)):
+                column[i] = value
+            start, count = columns[RECORDS][i], columns[RECORD_COUNT][i]
+            if strings.records_of(start, count) != list(row['record_ids'] or ()):
+                strings.garbage += strings.records.itemsize * count
+                columns[RECORDS][i], columns[RECORD_COUNT][i] = strings.add_records(row['record_ids'])
+            start, length = columns[URL][i], columns[URL_LENGTH][i]
+            if strings.url(start, length) != row['urlname']:
+                strings.garbage += length
+                columns[URL][i], columns[URL_LENGTH][i] = strings.add_url(row['urlname'])
+        return _sorted(added) if added[KEY] else None
+
+    def _needs_compaction(self):
+        return self._strings.garbage * 2 > self._strings.size
+
+    def rebuild(self, rows):
+        """Replace the index by the links `rows`"""
+        columns, strings, watermark = _empty(), _Strings(), None
+        for row in rows:
+            _append(columns, strings, row)
+            watermark = _newest(watermark, row)
+        self._columns, self._strings, self.watermark = _sorted(columns), strings, watermark
+
+    def update(self, rows):
+        """Merge the links `rows` into the index"""
+        if self._columns is None:
+            return self.rebuild(rows)
+        added = self._apply(rows)
+        if added is not None:
+            self._columns = _merged(self._columns, added)
+        if self._needs_compaction():
+            self._columns, self._strings = _compacted(self._columns, self._strings)
+
+    async def refresh(self, database, schema='public'):
+        """Reload after a finished run, merge the links checked since the
+        last refresh otherwise (the databases package). Lookups keep using
+        the current arrays while the new ones are read, sorted and merged."""
+        run = (await database.fetch_one(query=last_run_query(schema)))['run']
+        if self._columns is None or run != self.run or self.watermark is None:
+            columns, strings, watermark = _empty(), _Strings(), None
+            async for row in database.iterate(query=index_query(schema)):
+                _append(columns, strings, row)
+                watermark = _newest(watermark, row)
+            columns = await asyncio.to_thread(_sorted, columns)
+            self._columns, self._strings, self.watermark, self.run = columns, strings, watermark, run
+        else:
+            # links checked at the watermark may have been committed after the last refresh
+            rows = await database.fetch_all(query=index_query(schema, True), values={'since': self.watermark})
+            added = self._apply(rows)
+            if added is not None:
+                self._columns = await asyncio.to_thread(_merged, self._columns, added)
+            if self._needs_compaction():
+                self._columns, self._strings = await asyncio.to_thread(_compacted, self._columns, self._strings)
+        return len(self)
+
+
+status_index = StatusIndex()
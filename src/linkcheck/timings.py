@@ -0,0 +1,126 @@
+"""Per-request phase timings (DNS, connect, TLS, time to first byte).
+
+`requests` has no trace hooks, so the timings are taken by the connection
+classes of a dedicated transport adapter. Mount `TimedHTTPAdapter` on a
+session and wrap each check in `trace()`:
+
+    with trace() as timings:
+        session.get(url)
+    print(timings)
+"""
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+from urllib3.util.connection import allowed_gai_family
+
+PHASES = ('dns', 'connect', 'tls', 'ttfb', 'total')
+
+_local = threading.local()
+
+
+def empty_timings():
+    """Timings dict with every phase unset"""
+    return dict.fromkeys(PHASES)
+
+
+def _add(phase, seconds):
+    timings = getattr(_local, 'timings', None)
+    if timings is not None:
+        timings[phase] = round((timings[phase] or 0) + seconds * 1000, 2)
+
+
+@contextmanager
+def trace():
+    """Collect the phase timings (in ms) of all requests made in this block,
+    on this thread. Phases of redirects and retries add up; phases a request
+    does not go through (e.g. DNS on a reused connection) stay None."""
+    timings = empty_timings()
+    _local.timings = timings
+    started = time.perf_counter()
+    try:
+        yield timings
+    finally:
+        _local.timings = None
+        timings['total'] = round((time.perf_counter() - started) * 1000, 2)
+
+
+class _TimedConnectionMixin:
+
+    def _new_conn(self):
+        # Resolve once here so the lookup can be timed apart from the TCP
+        # connect, then connect to the resolved addresses in turn, falling
+        # back to the next one like socket.create_connection does.
+        host = self._dns_host
+        started = time.perf_counter()
+        try:
+            infos = socket.getaddrinfo(host, self.port, allowed_gai_family(), socket.SOCK_STREAM)
+            addresses = list(dict.fromkeys(info[4][0] for info in infos)) or [host]
+        except OSError:
+            addresses = [host]  # let urllib3 raise its own resolution error
+        _add('dns', time.perf_counter() - started)
+
+        started = time.perf_counter()
+        try:
+            for address in addresses[:-1]:
+                self._dns_host = address
+                try:
+                    return super()._new_conn()
+                except (NewConnectionError, ConnectTimeoutError):
+                    continue
+            self._dns_host = addresses[-1]
+            return super()._new_conn()
+        finally:
+            self._dns_host = host
+            _add('connect', time.perf_counter() - started)
+
+    def getresponse(self, *args, **kwargs):
+        started = time.perf_counter()
+        response = super().getresponse(*args, **kwargs)
+        _add('ttfb', time.perf_counter() - started)
+        return response
+
+
+class TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+
+    def connect(self):
+        started = time.perf_counter()
+        dns_connect = _current_dns_connect()
+        super().connect()
+        # connect() covers dns, tcp connect and the tls handshake
+        _add('tls', time.perf_counter() - started - (_current_dns_connect() - dns_connect))
+
+
+def _current_dns_connect():
+    timings = getattr(_local, 'timings', None)
+    if timings is None:
+        return 0
+    return ((timings['dns'] or 0) + (timings['connect'] or 0)) / 1000
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """Transport adapter whose connections record phase timings"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _TimedHTTPConnectionPool,
+            'https': _TimedHTTPSConnectionPool,
+        }
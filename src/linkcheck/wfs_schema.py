@@ -0,0 +1,99 @@
+"""Opt-in, cached retrieval of WFS feature type schemas.
+
+A DescribeFeatureType request plus XSD parse per distribution doubles the
+cost of probing a WFS, so schemas are only fetched when enabled for the run
+(`WFS_SCHEMA=true`) or for a service (`WFS_SCHEMA_SERVICES`, a comma
+separated list of hosts or url prefixes). Fetched schemas are cached by
+(endpoint, typename) with the hash of their content; the linkchecker task
+persists the cache so a schema is fetched once per `WFS_SCHEMA_TTL` days.
+"""
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+
+WFS_SCHEMA = (os.environ.get("WFS_SCHEMA") or "false").lower() == "true"
+WFS_SCHEMA_SERVICES = [s.strip() for s in (os.environ.get("WFS_SCHEMA_SERVICES") or "").split(",") if s.strip()]
+WFS_SCHEMA_TTL = float(os.environ.get("WFS_SCHEMA_TTL") or 7)
+SCHEMA_TIMEOUT = 30
+
+
+def content_hash(document):
+    """sha256 of the canonical json serialization of `document`"""
+    serialized = json.dumps(document, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+
+class SchemaCache:
+    """Feature type schemas by (endpoint, typename)"""
+
+    def __init__(self, enabled=WFS_SCHEMA, services=WFS_SCHEMA_SERVICES, ttl_days=WFS_SCHEMA_TTL):
+        self.enabled = enabled
+        self.services = services
+        self.ttl = timedelta(days=ttl_days)
+        self._entries = {}  # (endpoint, typename) -> (content_hash, schema, fetched_at)
+        self._dirty = set()
+        # fetches that failed in this run, not tried again until the next one
+        self._failed = set()
+        self._lock = threading.Lock()
+
+    def enabled_for(self, url):
+        """True if schemas should be retrieved for the service at `url`"""
+        if self.enabled:
+            return True
+        host = urlsplit(url).hostname or ''
+        return any(url.startswith(service) or host == service for service in self.services)
+
+    def get(self, endpoint, typename):
+        """(schema, content hash) of `typename`, fetched on a miss or once
+        expired; (None, None) if it could not be fetched in this run"""
+        key = (endpoint, typename)
+        with self._lock:
+            entry = self._entries.get(key)
+            failed = key in self._failed
+        if entry is not None and entry[2] + self.ttl > datetime.now():
+            return entry[1], entry[0]
+        if failed:
+            return None, None
+
+        schema = self._fetch(endpoint, typename)
+        if schema is None:
+            with self._lock:
+                self._failed.add(key)
+            return None, None
+        schema_hash = content_hash(schema)
+        with self._lock:
+            self._entries[key] = (schema_hash, schema, datetime.now())
+            self._dirty.add(key)
+        return schema, schema_hash
+
+    def _fetch(self, endpoint, typename):
+        from owslib.feature.schema import get_schema
+
+        try:
+            schema = get_schema(endpoint, typename, version='2.0.0', timeout=SCHEMA_TIMEOUT)
+        except Exception as e:
+            print(f"Error getting WFS schema of {typename} at {endpoint}: {e}")
+            return None
+        if schema is not None and not isinstance(schema, dict):
+            schema = schema.__dict__
+        return schema
+
+    def load(self, entries):
+        """Fill the cache from (endpoint, typename, content_hash, schema, fetched_at) rows"""
+        with self._lock:
+            for endpoint, typename, schema_hash, schema, fetched_at in entries:
+                self._entries[(endpoint, typename)] = (schema_hash, schema, fetched_at)
+
+    def changed(self):
+        """(endpoint, typename, content_hash, schema, fetched_at) of the entries
+        fetched since the last call"""
+        with self._lock:
+            rows = [key + self._entries[key] for key in self._dirty]
+            self._dirty.clear()
+        return rows
+
+
+schema_cache = SchemaCache()
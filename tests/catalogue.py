@@ -0,0 +1,126 @@
+"""Stand-in OGC API Records catalogue, to harvest from without pycsw.
+
+Serves `/collections/{collection}/items` as GeoJSON with `limit`/`offset`
+paging, `numberMatched` and `next` links, `sortby=-updated` and CQL2 text
+filters of the form `updated >= TIMESTAMP('...')`. Each capability can be
+switched off to stand in for catalogues that lack it.
+
+    python tests/catalogue.py --records 250 --port 8001
+    OGCAPI_URL=http://localhost:8001 python src/linkcheck/linkchecker.py --harvest
+"""
+import argparse
+import json
+import re
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+START = datetime(2025, 1, 1, tzinfo=timezone.utc)
+_FILTER = re.compile(r"updated\s*>=\s*TIMESTAMP\('([^']+)'\)")
+
+
+def make_record(i, updated=None, extent=None):
+    """Record `i` with two distribution links, updated `i` hours after START
+    unless `updated` is given; `extent` is its temporal extent"""
+    updated = updated or START + timedelta(hours=i)
+    return {
+        'type': 'Feature',
+        'id': f'record-{i}',
+        'time': {'interval': list(extent or ['2000-01-01', '2000-12-31'])},
+        'properties': {'title': f'Record {i}', 'updated': updated.strftime('%Y-%m-%dT%H:%M:%SZ')},
+        'links': [
+            {'rel': 'self', 'href': f'http://catalogue/items/record-{i}'},
+            {'href': f'https://data.example.org/{i}/download.zip', 'type': 'application/zip', 'name': 'Download'},
+            {'href': f'https://maps.example.org/wms?layer={i}', 'protocol': 'OGC:WMS', 'title': f'layer{i}'},
+        ],
+    }
+
+
+def _updated(record):
+    return datetime.fromisoformat(record['properties']['updated'].replace('Z', '+00:00'))
+
+
+class Catalogue:
+    """Records served by a stand-in catalogue and the requests it received"""
+
+    def __init__(self, records, filtering=True, sorting=True, number_matched=True, next_links=True):
+        self.records = records
+        self.filtering = filtering
+        self.sorting = sorting
+        self.number_matched = number_matched
+        self.next_links = next_links
+        self.requests = []
+        self.server = None
+
+    def page(self, path, query):
+        params = {key: values[0] for key, values in parse_qs(query).items()}
+        self.requests.append(params)
+        records = self.records
+        match = _FILTER.search(params.get('filter', ''))
+        if self.filtering and match:
+            since = datetime.fromisoformat(match.group(1).replace('Z', '+00:00'))
+            records = [record for record in records if _updated(record) >= since]
+        if self.sorting and params.get('sortby') == '-updated':
+            records = sorted(records, key=_updated, reverse=True)
+        limit = int(params.get('limit', 10))
+        offset = int(params.get('offset', 0))
+        page = {'type': 'FeatureCollection', 'features': records[offset:offset + limit], 'links': []}
+        if self.number_matched:
+            page['numberMatched'] = len(records)
+        if self.next_links and offset + limit < len(records):
+            next_params = dict(params, offset=offset + limit)
+            page['links'].append({'rel': 'next', 'href': f'{self.url}{path}?{urlencode(next_params)}'})
+        return page
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def items_url(self, collection='metadata:main'):
+        return f'{self.url}/collections/{collection}/items'
+
+    def start(self, port=0):
+        catalogue = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                parts = urlsplit(self.path)
+                if not re.fullmatch(r'/collections/[^/]+/items', parts.path):
+                    self.send_error(404)
+                    return
+                body = json.dumps(catalogue.page(parts.path, parts.query)).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/geo+json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--records', type=int, default=250)
+    parser.add_argument('--port', type=int, default=8001)
+    args = parser.parse_args()
+    catalogue = Catalogue([make_record(i) for i in range(args.records)]).start(args.port)
+    print(f"Serving {args.records} records at {catalogue.items_url()}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        catalogue.stop()
+
+
+if __name__ == '__main__':
+    main()
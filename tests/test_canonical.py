@@ -0,0 +1,49 @@
+"""Canonical form of urls of canonical.py"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'linkcheck'))
+
+from canonical import canonicalize_url  # noqa: E402
+
+
+@pytest.mark.parametrize('url, canonical', [
+    ('HTTPS://Example.ORG/Data', 'https://example.org/Data'),
+    ('https://example.org:443/a', 'https://example.org/a'),
+    ('http://example.org:80/a', 'http://example.org/a'),
+    ('http://example.org:8080/a', 'http://example.org:8080/a'),
+    ('https://example.org', 'https://example.org/'),
+    ('https://example.org/a/', 'https://example.org/a'),
+    ('https://example.org/a#section', 'https://example.org/a'),
+    ('https://example.org./a', 'https://example.org/a'),
+    ('  https://example.org/a ', 'https://example.org/a'),
+    ('https://user:pw@Example.org/a', 'https://user:pw@example.org/a'),
+    ('http://[::1]:8080/a', 'http://[::1]:8080/a'),
+])
+def test_canonical_form(url, canonical):
+    assert canonicalize_url(url) == canonical
+
+
+def test_query_parameters_are_sorted_by_name_then_value():
+    url = 'https://example.org/wms?SERVICE=WMS&request=GetCapabilities&layers=b&layers=a'
+    assert canonicalize_url(url) == 'https://example.org/wms?layers=a&layers=b&request=GetCapabilities&SERVICE=WMS'
+
+
+def test_empty_parameters_are_removed_parameters_without_value_kept():
+    assert canonicalize_url('https://example.org/?b=&&a=1&=') == 'https://example.org/?a=1&b='
+
+
+def test_encoding_and_case_of_paths_and_values_are_kept():
+    assert canonicalize_url('https://example.org/A%20B?q=X%26Y') == 'https://example.org/A%20B?q=X%26Y'
+
+
+def test_equivalent_urls_share_the_canonical_form():
+    urls = ['https://Example.org:443/a/?y=2&x=1', 'https://example.org/a?x=1&y=2#top', 'HTTPS://EXAMPLE.ORG/a?x=1&y=2']
+    assert len({canonicalize_url(url) for url in urls}) == 1
+
+
+@pytest.mark.parametrize('url', ['not a url', 'mailto:someone@example.org', 'http://example.org:port/'])
+def test_urls_that_can_not_be_parsed_are_kept(url):
+    assert canonicalize_url(url) == url
@@ -0,0 +1,86 @@
+"""Per-host circuits of circuit_breaker.py"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'linkcheck'))
+
+from circuit_breaker import HostCircuitBreaker, is_connection_failure  # noqa: E402
+from results import CheckResult, ErrorClass  # noqa: E402
+
+
+def refused(url):
+    return CheckResult.failed(url, "Connection refused", ErrorClass.CONNECTION)
+
+
+def ok(url):
+    return CheckResult(url, status_code=200)
+
+
+def test_failures_on_other_hosts_do_not_open_a_circuit():
+    breaker = HostCircuitBreaker(threshold=3, cooldown=60)
+    for i in range(3):
+        breaker.record(f'https://down-{i % 2}.example/x{i}', refused(f'https://down-{i % 2}.example/x{i}'))
+    assert breaker.allow('https://healthy.example/x')
+    assert breaker.open_hosts() == []
+
+
+def test_consecutive_failures_open_the_circuit_of_the_host():
+    breaker = HostCircuitBreaker(threshold=3, cooldown=60)
+    for i in range(3):
+        url = f'https://Down.example/{i}'
+        assert breaker.allow(url)
+        breaker.record(url, refused(url))
+    assert not breaker.allow('https://down.example/other')
+    assert breaker.allow('https://up.example/')
+    assert breaker.open_hosts() == ['down.example']
+    result = breaker.unreachable('https://down.example/other')
+    assert result.error_class == ErrorClass.HOST_UNREACHABLE
+    assert result.status_code is None
+
+
+def test_a_response_resets_the_failures():
+    breaker = HostCircuitBreaker(threshold=3, cooldown=60)
+    url = 'https://flaky.example/'
+    for _ in range(2):
+        breaker.record(url, refused(url))
+    breaker.record(url, ok(url))
+    for _ in range(2):
+        breaker.record(url, refused(url))
+    assert breaker.allow(url)
+
+
+def test_half_open_probe():
+    breaker = HostCircuitBreaker(threshold=1, cooldown=0)
+    url = 'https://down.example/'
+    breaker.record(url, refused(url))
+    # the cooldown passed, one probe goes through and the others wait for it
+    assert breaker.allow(url)
+    assert not breaker.allow(url)
+    breaker.record(url, ok(url))
+    assert breaker.allow(url)
+    assert breaker.open_hosts() == []
+
+
+def test_failed_probe_opens_the_circuit_again():
+    breaker = HostCircuitBreaker(threshold=1, cooldown=0)
+    url = 'https://down.example/'
+    breaker.record(url, refused(url))
+    assert breaker.allow(url)
+    breaker.record(url, refused(url))
+    assert breaker.open_hosts() == ['down.example']
+
+
+def test_disabled():
+    breaker = HostCircuitBreaker(threshold=0)
+    url = 'https://down.example/'
+    for _ in range(10):
+        breaker.record(url, refused(url))
+    assert breaker.allow(url)
+
+
+def test_connection_failures():
+    assert is_connection_failure(refused('https://a.example/'))
+    assert is_connection_failure(CheckResult.failed('https://a.example/', "no such host", ErrorClass.DNS))
+    assert not is_connection_failure(CheckResult('https://a.example/', status_code=503))
+    assert not is_connection_failure(CheckResult.failed('https://a.example/', "ReadTimeout", ErrorClass.TIMEOUT))
+    assert is_connection_failure(CheckResult.failed('https://a.example/', "ConnectTimeout", ErrorClass.TIMEOUT))
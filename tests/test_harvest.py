@@ -0,0 +1,81 @@
+"""Harvesting against the stand-in catalogue of catalogue.py"""
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'linkcheck'))
+
+from catalogue import START, Catalogue, make_record  # noqa: E402
+from harvest import harvest  # noqa: E402
+
+SINCE = START + timedelta(hours=200)
+
+
+@pytest.fixture
+def serve():
+    catalogues = []
+
+    def start(records, **options):
+        catalogue = Catalogue(records, **options).start()
+        catalogues.append(catalogue)
+        return catalogue
+
+    yield start
+    for catalogue in catalogues:
+        catalogue.stop()
+
+
+def records(count=250):
+    return [make_record(i) for i in range(count)]
+
+
+def test_full_harvest_reads_all_pages(serve):
+    catalogue = serve(records())
+    record_ids, distributions = harvest(catalogue.items_url())
+    assert sorted(record_ids) == sorted(f'record-{i}' for i in range(250))
+    # the self link is skipped
+    assert len(distributions) == 500
+    assert ('record-3', 'https://maps.example.org/wms?layer=3', 'OGC:WMS', 'layer3') in distributions
+    assert len(catalogue.requests) == 3
+
+
+def test_full_harvest_follows_next_links(serve):
+    catalogue = serve(records(), number_matched=False)
+    record_ids, _ = harvest(catalogue.items_url())
+    assert len(set(record_ids)) == 250
+    assert len(catalogue.requests) == 3
+
+
+def test_incremental_harvest_filters_on_updated(serve):
+    # record 240 has a temporal extent far in the past, record 10 an open
+    # ended one; only their last update matters
+    data = records()
+    data[240] = make_record(240, extent=['1990-01-01', '1990-12-31'])
+    data[10] = make_record(10, extent=['2000-01-01', None])
+    catalogue = serve(data)
+    record_ids, _ = harvest(catalogue.items_url(), since=SINCE)
+    assert sorted(record_ids) == sorted(f'record-{i}' for i in range(200, 250))
+    assert catalogue.requests[0]['filter'] == "updated >= TIMESTAMP('2025-01-09T08:00:00Z')"
+    assert 'datetime' not in catalogue.requests[0]
+
+
+def test_unfiltered_sorted_catalogue_stops_at_older_records(serve):
+    catalogue = serve(records(), filtering=False)
+    record_ids, _ = harvest(catalogue.items_url(), since=SINCE)
+    assert sorted(record_ids) == sorted(f'record-{i}' for i in range(200, 250))
+    assert len(catalogue.requests) == 1
+
+
+def test_unfiltered_unsorted_catalogue_is_filtered_here(serve):
+    catalogue = serve(records(), filtering=False, sorting=False)
+    record_ids, _ = harvest(catalogue.items_url(), since=SINCE)
+    assert sorted(record_ids) == sorted(f'record-{i}' for i in range(200, 250))
+
+
+def test_incremental_harvest_without_updates(serve):
+    catalogue = serve(records())
+    since = datetime.now(timezone.utc)
+    assert harvest(catalogue.items_url(), since=since) == ([], [])
@@ -0,0 +1,126 @@
+"""Redirect cache of redirects.py and its use by the linkchecker"""
+import os
+import sys
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'linkcheck'))
+
+from redirects import RedirectCache  # noqa: E402
+
+A, B, C = 'https://a.example/', 'https://b.example/', 'https://c.example/'
+
+
+def test_resolve_follows_cached_hops():
+    cache = RedirectCache()
+    cache.add([A, B, C], [301, 302])
+    assert cache.resolve(A) == [A, B, C]
+    assert cache.resolve(B) == [B, C]
+    assert cache.resolve(C) == [C]
+
+
+def test_loops_end_the_chain():
+    cache = RedirectCache()
+    cache.add([A, B, A], [301, 301])
+    assert cache.resolve(A) == [A, B]
+
+
+def test_expired_hops_are_not_followed():
+    cache = RedirectCache(ttl_days=30)
+    cache.load([(A, B, 301, datetime.now() - timedelta(days=31)), (B, C, 301, datetime.now() - timedelta(days=29))])
+    assert cache.resolve(A) == [A]
+    assert cache.resolve(B) == [B, C]
+
+
+def test_only_permanent_hops_are_persisted():
+    cache = RedirectCache()
+    cache.add([A, B, C], [301, 307])
+    rows = cache.changed()
+    assert [row[:3] for row in rows] == [(A, B, 301)]
+    assert cache.changed() == []
+
+
+def test_stored_hop_that_became_temporary_is_deleted():
+    cache = RedirectCache()
+    cache.load([(A, B, 301, datetime.now())])
+    cache.add([A, C], [302])
+    assert cache.changed() == [(A, None, None, None)]
+    # still followed during this run
+    assert cache.resolve(A) == [A, C]
+
+
+def test_invalidate():
+    cache = RedirectCache()
+    cache.load([(A, B, 308, datetime.now())])
+    cache.add([B, C], [301])
+    cache.changed()
+    cache.invalidate([A, B, C])
+    assert cache.resolve(A) == [A]
+    assert sorted(cache.changed()) == [(A, None, None, None), (B, None, None, None)]
+
+
+class Redirects(BaseHTTPRequestHandler):
+    """/a -> 301 /hub -> 302 /final, /gone is 404"""
+    routes = {'/a': (301, '/hub'), '/hub': (302, '/final'), '/final': (200, None), '/gone': (404, None)}
+    requests = Counter()
+
+    def do_HEAD(self):
+        Redirects.requests[self.path] += 1
+        status, location = self.routes.get(self.path, (404, None))
+        self.send_response(status)
+        if location:
+            self.send_header('Location', location)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    do_GET = do_HEAD
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    Redirects.requests.clear()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Redirects)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def checker(monkeypatch):
+    import linkchecker
+
+    cache = RedirectCache()
+    monkeypatch.setattr(linkchecker, 'redirect_cache', cache)
+    return linkchecker.URLChecker(), cache
+
+
+def test_targets_reached_earlier_in_the_run_are_not_requested_again(server, checker):
+    checker, cache = checker
+    [result] = checker.check_urls([f'{server}/a'])
+    assert (result.status_code, result.final_url) == (200, f'{server}/final')
+    assert result.redirect_chain == (f'{server}/a', f'{server}/hub', f'{server}/final')
+    requested = dict(Redirects.requests)
+
+    hub, again = checker.check_urls([f'{server}/hub', f'{server}/a'])
+    assert Redirects.requests == requested
+    assert (hub.url, hub.status_code, hub.redirect_chain) == (f'{server}/hub', 200, (f'{server}/hub', f'{server}/final'))
+    assert (again.url, again.final_url) == (f'{server}/a', f'{server}/final')
+    # only the permanent hop outlives the run
+    assert [row[:3] for row in cache.changed()] == [(f'{server}/a', f'{server}/hub', 301)]
+
+
+def test_cached_hops_to_a_broken_target_are_dropped(server, checker):
+    checker, cache = checker
+    cache.load([(f'{server}/old', f'{server}/gone', 301, datetime.now())])
+    [result] = checker.check_urls([f'{server}/old'])
+    assert (result.url, result.status_code) == (f'{server}/old', 404)
+    assert '/old' not in Redirects.requests
+    assert cache.changed() == [(f'{server}/old', None, None, None)]
@@ -0,0 +1,111 @@
+"""Check results and error classification of results.py"""
+import math
+import os
+import socket
+import ssl
+import sys
+
+import pytest
+import requests
+import urllib3
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'linkcheck'))
+
+from results import CheckResult, ErrorClass, classify_error  # noqa: E402
+
+
+def wrapped(cause, outer=requests.exceptions.ConnectionError):
+    """`cause` as requests raises it: urllib3's MaxRetryError keeps it as reason"""
+    return outer(urllib3.exceptions.MaxRetryError(None, 'https://example.org/', reason=cause))
+
+
+@pytest.mark.parametrize('error, error_class', [
+    (requests.exceptions.ConnectTimeout('connect'), ErrorClass.TIMEOUT),
+    (requests.exceptions.ReadTimeout('read'), ErrorClass.TIMEOUT),
+    (requests.exceptions.SSLError('handshake'), ErrorClass.SSL),
+    (wrapped(urllib3.exceptions.NameResolutionError('example.org', None, socket.gaierror(-2, 'unknown'))), ErrorClass.DNS),
+    # urllib3's NewConnectionError subclasses ConnectTimeoutError, it is a refused connection
+    (wrapped(urllib3.exceptions.NewConnectionError(None, 'Connection refused')), ErrorClass.CONNECTION),
+    (wrapped(urllib3.exceptions.SSLError(ssl.SSLCertVerificationError('certificate verify failed')),
+             requests.exceptions.SSLError), ErrorClass.SSL),
+    (socket.timeout('timed out'), ErrorClass.TIMEOUT),
+    (ConnectionRefusedError(111, 'Connection refused'), ErrorClass.CONNECTION),
+])
+def test_classified_by_exception_type(error, error_class):
+    assert classify_error(error) == error_class
+
+
+@pytest.mark.parametrize('message, error_class', [
+    ('Read timed out. (read timeout=5)', ErrorClass.TIMEOUT),
+    ("Failed to resolve 'example.invalid' ([Errno -2] Name or service not known)", ErrorClass.DNS),
+    ('[SSL: CERTIFICATE_VERIFY_FAILED] certificate verify failed', ErrorClass.SSL),
+    ('Failed to establish a new connection: [Errno 111] Connection refused', ErrorClass.CONNECTION),
+    ('Invalid URL', ErrorClass.OTHER),
+])
+def test_messages_are_classified_by_their_text(message, error_class):
+    assert classify_error(message) == error_class
+
+
+def test_url_in_the_message_does_not_decide():
+    # the message names a 'timeout' host, the error is a refused connection
+    error = wrapped(urllib3.exceptions.NewConnectionError(None, 'timeout.example.org: Failed to establish a new connection'))
+    assert classify_error(error) == ErrorClass.CONNECTION
+
+
+def test_error_class_of_results():
+    assert CheckResult('https://example.org/', status_code=200).error_class == ErrorClass.NONE
+    assert CheckResult('https://example.org/', status_code=404).error_class == ErrorClass.HTTP
+    assert CheckResult.failed('https://example.org/', requests.exceptions.ReadTimeout('read')).error_class == ErrorClass.TIMEOUT
+    skipped = CheckResult.failed('https://example.org/', 'Host unreachable', ErrorClass.HOST_UNREACHABLE)
+    assert skipped.error_class == ErrorClass.HOST_UNREACHABLE
+
+
+def test_results_are_slotted_and_share_values():
+    first = CheckResult('https://example.org/a', status_code=200, content_type='text/' + 'html')
+    second = CheckResult('https://example.org/b', status_code=200, content_type=''.join(['text/', 'html']))
+    assert not hasattr(first, '__dict__')
+    assert first.content_type is second.content_type
+    assert first.status_code is second.status_code
+
+
+def test_final_url_is_only_kept_when_it_differs():
+    result = CheckResult('https://example.org/', status_code=200, final_url='https://example.org/')
+    assert result.final_url is None
+    assert result.as_dict()['final_url'] == 'https://example.org/'
+    assert result.is_redirect is False
+    assert CheckResult.failed('https://example.org/', 'Invalid URL').is_redirect is None
+
+
+def test_as_dict():
+    result = CheckResult('https://example.org/a', status_code=200, final_url='https://example.org/b',
+                         content_type='text/html', redirect_chain=['https://example.org/a', 'https://example.org/b'])
+    result.set_timings({'dns': 1.234, 'connect': 2.0, 'total': 10.5})
+    document = result.as_dict()
+    assert document['valid'] is True
+    assert document['is_redirect'] is True
+    assert document['error_class'] == 'none'
+    assert document['redirect_chain'] == ['https://example.org/a', 'https://example.org/b']
+    assert document['timings'] == {'dns': 1.23, 'connect': 2.0, 'tls': None, 'ttfb': None, 'total': 10.5}
+    assert 'error' not in document
+    assert math.isnan(result.timings[2])
+
+    failed = CheckResult.failed('https://example.org/', 'Invalid URL').as_dict()
+    assert (failed['valid'], failed['error'], failed['error_class']) == (False, 'Invalid URL', 'other')
+
+
+def test_redirected_from():
+    final = CheckResult('https://example.org/landing', status_code=200)
+    result = final.redirected_from('https://doi.org/10.1/x', ['https://doi.org/10.1/x', 'https://example.org/hub'])
+    assert result.url == 'https://doi.org/10.1/x'
+    assert result.final_url == 'https://example.org/landing'
+    assert result.redirect_chain == ('https://doi.org/10.1/x', 'https://example.org/hub', 'https://example.org/landing')
+    assert final.redirected_from('https://example.org/landing', []) is final
+
+
+def test_at_final_url():
+    result = CheckResult('https://doi.org/10.1/x', status_code=200, final_url='https://example.org/landing',
+                         redirect_chain=['https://doi.org/10.1/x', 'https://example.org/landing'])
+    final = result.at_final_url()
+    assert (final.url, final.final_url, final.redirect_chain, final.status_code) == ('https://example.org/landing', None, None, 200)
+    direct = CheckResult('https://example.org/', status_code=200)
+    assert direct.at_final_url() is direct
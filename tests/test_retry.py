@@ -0,0 +1,129 @@
+"""Retry policy and Retry-After parsing of retry.py"""
+import os
+import sys
+import threading
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'linkcheck'))
+
+from results import CheckResult, ErrorClass  # noqa: E402
+from retry import RetryPolicy, is_transient, parse_retry_after  # noqa: E402
+
+URL = 'https://example.org/'
+
+
+@pytest.mark.parametrize('result, transient', [
+    (CheckResult(URL, status_code=503), True),
+    (CheckResult(URL, status_code=429), True),
+    (CheckResult(URL, status_code=504), True),
+    (CheckResult(URL, status_code=500), False),
+    (CheckResult(URL, status_code=404), False),
+    (CheckResult(URL, status_code=200), False),
+    (CheckResult.failed(URL, 'Read timed out', ErrorClass.TIMEOUT), True),
+    (CheckResult.failed(URL, 'Connection reset by peer', ErrorClass.CONNECTION), True),
+    (CheckResult.failed(URL, 'RemoteDisconnected: closed without response', ErrorClass.CONNECTION), True),
+    (CheckResult.failed(URL, 'Connection refused', ErrorClass.CONNECTION), False),
+    (CheckResult.failed(URL, 'Name or service not known', ErrorClass.DNS), False),
+    (CheckResult.failed(URL, 'Host unreachable', ErrorClass.HOST_UNREACHABLE), False),
+])
+def test_is_transient(result, transient):
+    assert is_transient(result) == transient
+
+
+def test_retry_after_in_seconds():
+    assert parse_retry_after('120') == 120.0
+    assert parse_retry_after(' 0 ') == 0.0
+
+
+def test_retry_after_as_http_date():
+    at = datetime.now(timezone.utc) + timedelta(seconds=90)
+    assert 80 <= parse_retry_after(format_datetime(at, usegmt=True)) <= 90
+
+
+def test_retry_after_in_the_past():
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0.0
+
+
+@pytest.mark.parametrize('value', [None, '', 'soon', '-5', '1.5'])
+def test_invalid_retry_after(value):
+    assert parse_retry_after(value) is None
+
+
+def test_delay_is_jittered_within_the_backoff():
+    policy = RetryPolicy(backoff=2, max_delay=120)
+    delays = [policy.delay(attempt) for attempt in (1, 2, 3) for _ in range(200)]
+    assert all(0 <= delay <= 16 for delay in delays)
+    assert max(policy.delay(1) for _ in range(200)) <= 4
+    assert len(set(delays)) > 100
+
+
+def test_delay_is_capped():
+    policy = RetryPolicy(backoff=2, max_delay=10)
+    assert all(policy.delay(20) <= 10 for _ in range(100))
+
+
+def test_delay_honours_retry_after():
+    policy = RetryPolicy(backoff=2, max_delay=120)
+    assert all(policy.delay(1, retry_after=30) >= 30 for _ in range(100))
+    # longer than we are willing to wait
+    assert policy.delay(1, retry_after=300) is None
+
+
+def test_budget():
+    policy = RetryPolicy(budget=2)
+    assert [policy.take() for _ in range(4)] == [True, True, False, False]
+
+
+class Flaky(BaseHTTPRequestHandler):
+    """503 with Retry-After for the first `failures` requests of each path;
+    the checker follows a failed HEAD with a GET"""
+    failures = 2
+    requests = Counter()
+
+    def do_HEAD(self):
+        Flaky.requests[self.path] += 1
+        if Flaky.requests[self.path] <= self.failures:
+            self.send_response(503)
+            self.send_header('Retry-After', '0')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    do_GET = do_HEAD
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def flaky():
+    Flaky.requests.clear()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Flaky)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+def test_transient_failures_are_retried_after_the_sweep(flaky):
+    from linkchecker import URLChecker
+
+    checker = URLChecker(retry_policy=RetryPolicy(attempts=2, budget=10, backoff=0.01))
+    results = checker.check_urls([f'{flaky}/a', f'{flaky}/b'])
+    assert [result.status_code for result in results] == [200, 200]
+    assert Flaky.requests == {'/a': 3, '/b': 3}
+
+
+def test_retries_stop_when_the_budget_is_spent(flaky):
+    from linkchecker import URLChecker
+
+    checker = URLChecker(retry_policy=RetryPolicy(attempts=2, budget=1, backoff=0.01))
+    results = checker.check_urls([f'{flaky}/a', f'{flaky}/b'])
+    assert sorted(result.status_code for result in results) == [200, 503]
+    assert sum(Flaky.requests.values()) == 5
@@ -0,0 +1,76 @@
+"""Format detection from the first bytes of resources, sniff.py"""
+import os
+import struct
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'linkcheck'))
+
+from sniff import detect_format, format_mismatch, range_header, read_head  # noqa: E402
+
+
+def tiff(tags, order=b'II'):
+    """A little or big endian tiff header with an IFD holding `tags`"""
+    fmt = '<' if order == b'II' else '>'
+    head = order + (b'*\x00' if order == b'II' else b'\x00*') + struct.pack(fmt + 'I', 8)
+    head += struct.pack(fmt + 'H', len(tags))
+    for tag in tags:
+        head += struct.pack(fmt + 'HHII', tag, 3, 1, 0)
+    return head
+
+
+def sqlite(application_id):
+    return b'SQLite format 3\x00' + b'\x00' * 52 + application_id + b'\x00' * 28
+
+
+@pytest.mark.parametrize('head, detected', [
+    (b'PK\x03\x04rest', 'zip'),
+    (tiff([256, 257, 33550, 34735]), 'geotiff'),
+    (tiff([256, 34735], order=b'MM'), 'geotiff'),
+    (tiff([256, 257]), 'tiff'),
+    # the IFD lies beyond the bytes read
+    (b'II*\x00\xff\xff\x00\x00', 'tiff'),
+    (sqlite(b'GPKG'), 'gpkg'),
+    (sqlite(b'\x00\x00\x00\x00'), 'sqlite'),
+    (b'%PDF-1.7', 'pdf'),
+    (b'\x1f\x8b\x08\x00', 'gzip'),
+    (b'\xef\xbb\xbf  {"type": "FeatureCollection"}', 'json'),
+    (b'[1, 2]', 'json'),
+    (b'<!DOCTYPE html><html><head>', 'html'),
+    (b'<?xml version="1.0"?>\n<html xmlns="http://www.w3.org/1999/xhtml">', 'html'),
+    (b'<?xml version="1.0"?><ServiceExceptionReport version="1.3.0">', 'ogc-exception'),
+    (b'<?xml version="1.0"?><ows:ExceptionReport>', 'ogc-exception'),
+    (b'<?xml version="1.0"?><WMS_Capabilities>', 'xml'),
+    (b'plain text', None),
+    (b'', None),
+])
+def test_detect_format(head, detected):
+    assert detect_format(head) == detected
+
+
+def test_matching_formats_are_no_mismatch():
+    assert format_mismatch('zip', 'application/zip', 'ESRI Shapefile') is None
+    assert format_mismatch('geotiff', 'image/tiff', 'GeoTIFF') is None
+    assert format_mismatch('xml', 'text/xml', 'OGC:WMS') is None
+    # content types and formats that say nothing about the content
+    assert format_mismatch('zip', 'application/octet-stream', None) is None
+    assert format_mismatch(None, 'application/zip', 'GeoPackage') is None
+
+
+def test_mismatches():
+    assert format_mismatch('html', 'application/zip', 'GeoPackage') == (
+        'content is html, but content-type is application/zip and declared format is GeoPackage')
+    assert format_mismatch('html', 'text/html', 'GeoPackage') == 'content is html, but declared format is GeoPackage'
+    assert format_mismatch('ogc-exception', 'text/xml', 'OGC:WMS') == 'content is an OGC exception report'
+
+
+def test_read_head_stops_at_the_limit():
+    chunks = iter([b'abc', b'defg', b'hij', b'never read'])
+    assert read_head(chunks, limit=8) == b'abcdefgh'
+    assert next(chunks) == b'never read'
+    assert read_head([b'ab'], limit=8) == b'ab'
+
+
+def test_range_header():
+    assert range_header(8192) == {'Range': 'bytes=0-8191'}
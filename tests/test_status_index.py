@@ -0,0 +1,149 @@
+"""The in-memory status index of status_index.py"""
+import asyncio
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'linkcheck'))
+
+import status_index as module  # noqa: E402
+from status_index import StatusIndex  # noqa: E402
+
+CHECKED = datetime(2025, 1, 1, 12)
+
+
+def row(i, status_code=200, record_ids=None, checked=CHECKED, urlname=None, url_key=None):
+    return {
+        'urlname': urlname or f'https://example.org/{i}',
+        'url_key': url_key or f'https://example.org/{i}',
+        'id_link': i,
+        'last_status_code': status_code,
+        'last_error_class': 'none' if status_code and status_code < 400 else 'http',
+        'deprecated': False,
+        'last_checked': checked,
+        'record_ids': [f'record-{i}'] if record_ids is None else record_ids,
+    }
+
+
+def keys(index):
+    return list(index._columns[module.KEY])
+
+
+def test_lookup():
+    index = StatusIndex()
+    assert index.lookup('https://example.org/1') is None
+    index.rebuild([row(1), row(2, 404, ['a', 'b']), row(3, None, [], checked=None)])
+    assert len(index) == 3
+    assert index.lookup('https://example.org/1') == {
+        'urlname': 'https://example.org/1',
+        'id_link': 1,
+        'status_code': 200,
+        'valid': True,
+        'error_class': 'none',
+        'deprecated': False,
+        'last_checked': CHECKED,
+        'record_ids': ['record-1'],
+    }
+    status = index.lookup('https://example.org/2')
+    assert (status['status_code'], status['valid'], status['error_class'], status['record_ids']) == (404, False, 'http', ['a', 'b'])
+    status = index.lookup('https://example.org/3')
+    assert (status['status_code'], status['last_checked'], status['record_ids']) == (None, None, [])
+    assert index.lookup('https://example.org/4') is None
+    assert index.watermark == CHECKED
+
+
+def test_urls_sharing_a_hash_are_told_apart(monkeypatch):
+    monkeypatch.setattr(module, 'url_key', lambda url: 7)
+    index = StatusIndex()
+    index.rebuild([row(1), row(2, 404)])
+    assert index.lookup('https://example.org/1')['id_link'] == 1
+    assert index.lookup('https://example.org/2')['id_link'] == 2
+    assert index.lookup('https://example.org/3') is None
+    index.update([row(2, 500), row(3)])
+    assert index.lookup('https://example.org/1')['status_code'] == 200
+    assert index.lookup('https://example.org/2')['status_code'] == 500
+    assert index.lookup('https://example.org/3')['id_link'] == 3
+
+
+def test_update_merges_new_links_in_order():
+    index = StatusIndex()
+    index.rebuild(row(i) for i in range(0, 200, 2))
+    later = datetime(2025, 1, 2)
+    index.update([row(i, 503, checked=later) for i in range(1, 200, 10)] + [row(4, 404, checked=later)])
+    assert len(index) == 120
+    assert keys(index) == sorted(keys(index))
+    assert all(index.lookup(f'https://example.org/{i}') for i in range(0, 200, 2))
+    assert index.lookup('https://example.org/11')['status_code'] == 503
+    assert index.lookup('https://example.org/4')['status_code'] == 404
+    assert index.watermark == later
+
+
+def test_unchanged_records_are_not_stored_again():
+    index = StatusIndex()
+    index.rebuild(row(i) for i in range(10))
+    size = index._strings.size
+    index.update([row(i, 404) for i in range(10)])
+    assert index._strings.size == size
+    assert index._strings.garbage == 0
+
+
+def test_replaced_slices_are_compacted():
+    many = [f'record-{i}' for i in range(20)]
+    index = StatusIndex()
+    index.rebuild(row(i, record_ids=many) for i in range(10))
+    index.update([row(i, record_ids=['a']) for i in range(2)])
+    assert index._strings.garbage == 2 * 20 * 4
+    assert index.lookup('https://example.org/1')['record_ids'] == ['a']
+    # the unused slices take more than half of the storage
+    index.update([row(i, record_ids=['b']) for i in range(10)])
+    assert index._strings.garbage == 0
+    assert len(index._strings.records) == 10
+    assert all(index.lookup(f'https://example.org/{i}')['record_ids'] == ['b'] for i in range(10))
+    assert index.lookup('https://example.org/9')['urlname'] == 'https://example.org/9'
+
+
+def test_links_are_found_by_their_canonical_url():
+    index = StatusIndex()
+    index.rebuild([row(1, urlname='https://Example.org/1/?b=2&a=1', url_key='https://example.org/1?a=1&b=2')])
+    status = index.lookup('https://example.org/1?a=1&b=2')
+    assert status['urlname'] == 'https://Example.org/1/?b=2&a=1'
+    assert index.lookup('https://example.org/1') is None
+
+
+class Database:
+    """The calls of the databases package the index makes"""
+
+    def __init__(self, run, rows):
+        self.run = run
+        self.rows = rows
+        self.since = []
+
+    async def fetch_one(self, query):
+        return {'run': self.run}
+
+    async def iterate(self, query):
+        for item in self.rows:
+            yield item
+
+    async def fetch_all(self, query, values):
+        self.since.append(values['since'])
+        return [item for item in self.rows if item['last_checked'] >= values['since']]
+
+
+def test_refresh():
+    index = StatusIndex()
+    database = Database(1, [row(i) for i in range(5)])
+    assert asyncio.run(index.refresh(database)) == 5
+    assert index.run == 1
+
+    # merges what was checked since the newest check seen
+    later = datetime(2025, 1, 2)
+    database.rows += [row(2, 404, checked=later), row(7, checked=later)]
+    assert asyncio.run(index.refresh(database)) == 6
+    assert database.since == [CHECKED]
+    assert index.lookup('https://example.org/2')['status_code'] == 404
+
+    # a finished run reloads, links that are gone are dropped
+    database.run, database.rows = 2, [row(1)]
+    assert asyncio.run(index.refresh(database)) == 1
+    assert index.lookup('https://example.org/7') is None